@@ -1,13 +1,52 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import Depends, FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
+from app.api.dependencies import get_message_buffer, warm_up
 from app.api.router.routes import router
 from appfrwk.config import get_config
+from appfrwk.database import get_database
 from appfrwk.logging_config import setup_logging, get_logger
 from appfrwk.logging_config.log_middleware import LogMiddleware
-from appfrwk.utils.verify_token import VerifyToken
+from appfrwk.metrics import REGISTRY
+from appfrwk.server import get_work_tracker
+from appfrwk.tracing import get_tracer, instrument_sqlalchemy
+from appfrwk.utils.verify_token import VerifyToken, get_verify_token
 
-# Setup logging configuration
-setup_logging()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Warm the shared resources concurrently at startup and release them on shutdown
+    """
+    from langchain.globals import set_debug
+
+    config = get_config()
+    logger = get_logger(config.APP_NAME)
+    set_debug(config.LANGCHAIN_DEBUG)
+
+    # Warm the JWKS signing keys, the model clients, the vector store and the database pools together
+    verifier = get_verify_token()
+    _, app.state.warm = await asyncio.gather(verifier.jwks.start(), warm_up())
+    if config.MESSAGE_WRITE_BEHIND:
+        await get_message_buffer().start()
+    app.state.started = True
+    logger.info(f"Startup complete, all resources warm={app.state.warm}")
+    try:
+        yield
+    finally:
+        # Let in-flight ingestion and streaming work finish before releasing what it uses; under
+        # appfrwk.server.run draining began at the shutdown signal and this only cancels what is left
+        app.state.started = False
+        await get_work_tracker().drain(config.TIMEOUT_GRACEFUL_SHUTDOWN)
+        if config.MESSAGE_WRITE_BEHIND:
+            # In-flight turns have been buffered by now, write them all before the pools close
+            await get_message_buffer().stop(config.TIMEOUT_GRACEFUL_SHUTDOWN)
+        await verifier.jwks.stop()
+        await get_database().dispose()
+        await asyncio.to_thread(get_tracer().shutdown)
 
 
 def create_app():
@@ -15,6 +54,9 @@ def create_app():
     Create a FastAPI application
     """
 
+    # Setup logging configuration
+    setup_logging()
+
     # Fetch configurations from the environment
     config = get_config()
 
@@ -24,12 +66,23 @@ def create_app():
         description=config.DESCRIPTION,
         version=config.VERSION,
         debug=config.DEBUG,
-        testing=config.TESTING
+        testing=config.TESTING,
+        lifespan=lifespan,
     )
+    app.state.started = False
+    app.state.warm = False
+
+    # Trace requests through the handlers, LangChain runs and SQL statements
+    if get_tracer().enabled:
+        instrument_sqlalchemy()
 
     # Add middleware
     app.add_middleware(LogMiddleware)
     app.include_router(router)
+    if config.ADMIN_API_ENABLED:
+        from app.api.router.admin import router as admin_router
+
+        app.include_router(admin_router)
     # Include routers. Now, we're using a more generalized import from the 'routers' folder
 
     # Root endpoint
@@ -42,4 +95,29 @@ def create_app():
         logger.info("Root endpoint accessed")
         return {"message": "Hello World"}
 
+    @app.get("/health/live", include_in_schema=False)
+    async def liveness():
+        """
+        The process is up and serving requests
+        """
+        return {"status": "ok"}
+
+    @app.get("/health/ready", include_in_schema=False)
+    async def readiness():
+        """
+        Startup finished, the worker is not draining and every database answers
+        """
+        databases = await get_database().ping()
+        ready = app.state.started and not get_work_tracker().draining and all(databases.values())
+        return JSONResponse({"status": "ok" if ready else "unavailable", "startup_complete": app.state.started,
+                             "warm": app.state.warm, "databases": databases}, status_code=200 if ready else 503)
+
+    if config.METRICS_ENABLED:
+        @app.get("/metrics", include_in_schema=False)
+        async def metrics():
+            """
+            Prometheus metrics endpoint
+            """
+            return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
     return app
@@ -0,0 +1,387 @@
+"""
+Lazily created clients shared by the routes.
+
+Nothing is built at import time: each provider creates its resource on
+first use (or during the lifespan warm-up) and caches it, so importing the
+routes does not connect to databases or model providers.
+"""
+import asyncio
+import inspect
+from functools import lru_cache
+from typing import Optional
+
+from fastapi import Depends, HTTPException, Request
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer, SecurityScopes
+
+from appfrwk.config import get_config
+from appfrwk.database import get_database
+from appfrwk.errors import UnauthenticatedException, UnauthorizedException
+from appfrwk.logging_config import get_logger
+from appfrwk.server import get_work_tracker
+
+log = get_logger(__name__)
+
+template = """Answer the question based only on the following context:
+   {context}
+
+   Question: {question}
+   """
+
+condense_template = """Given the following conversation and a follow up question, rephrase the follow up question to be a standalone question, in its original language.
+
+Chat History:
+{chat_history}
+Follow Up Input: {question}
+Standalone question:"""
+
+
+@lru_cache()
+def get_embeddings():
+    """
+    OpenAI embeddings client
+    """
+    from langchain_openai import OpenAIEmbeddings
+
+    return OpenAIEmbeddings(openai_api_key=get_config().OPENAI_API_KEY)
+
+
+def create_vector_store(collection_name: str):
+    """
+    pgvector store of a collection on the shared sync engine of DATABASE_URL2
+    (the store runs its queries through sync sessions)
+    """
+    from RagLLM.PGvector.store import AsnyPgVector
+
+    from app.services.vector_stores import get_sync_engine
+
+    config = get_config()
+    return AsnyPgVector(
+        connection_string=f"{config.DATABASE_URL2}",
+        embedding_function=get_embeddings(),
+        collection_name=f"{collection_name}",
+        connection=get_sync_engine(config.DATABASE_URL2),
+    )
+
+
+def stage_model_spec(stage: str) -> str:
+    """
+    Model of a pipeline stage (answer, rephrase, summary) from LLM_STAGE_MODELS
+    """
+    config = get_config()
+    return config.LLM_STAGE_MODELS.get(stage) or config.SERVICE_MODEL
+
+
+@lru_cache()
+def get_stage_model(stage: str):
+    """
+    Gateway chat model for a pipeline stage, falling back to LLM_FALLBACK_MODELS.
+    Only the answer and the agent use SERVICE_TEMPERATURE, the other stages run at 0.
+    """
+    from app.services.llm_gateway import create_gateway_model
+
+    config = get_config()
+    spec = stage_model_spec(stage)
+    fallbacks = [model for model in config.LLM_FALLBACK_MODELS if model != spec]
+    return create_gateway_model([spec, *fallbacks], temperature=None if stage in ("answer", "agent") else 0,
+                                max_tokens=config.LLM_STAGE_MAX_TOKENS.get(stage), stage=stage)
+
+
+def create_summarizer(data_directory: str, max_iterations: int, token_limit: Optional[int] = None):
+    """
+    RAPTOR summarizer for one document, summarizing with the summary stage
+    model. When the installed RagLLM does not let the model be passed in, the
+    client it builds (and the chains holding it) is swapped for the gateway
+    model; a summarizer that hides its client is refused rather than left
+    to bypass the gateway.
+    """
+    from RagLLM.Raptor.dyamic_raptor import TextClusterSummarizer
+
+    from app.services.llm_gateway import route_through_gateway
+
+    model = get_stage_model("summary")
+    parameters = inspect.signature(TextClusterSummarizer).parameters
+    name = next((name for name in ("model", "llm") if name in parameters), None)
+    kwargs = {name: model} if name else {}
+    summarizer = TextClusterSummarizer(token_limit=token_limit or get_config().RAPTOR_TOKEN_LIMIT,
+                                       data_directory=data_directory, max_iterations=max_iterations, **kwargs)
+    if name is None:
+        replaced = 0
+        for attribute, value in list(vars(summarizer).items()):
+            routed, count = route_through_gateway(value, model)
+            if count:
+                setattr(summarizer, attribute, routed)
+                replaced += count
+        if not replaced:
+            raise RuntimeError("TextClusterSummarizer neither accepts nor exposes a chat model, "
+                               "its summaries would bypass the LLM gateway")
+    return summarizer
+
+
+def get_summarizer_factory():
+    """
+    Route dependency providing create_summarizer, so ingestion can be run
+    with another summarizer through app.dependency_overrides
+    """
+    return create_summarizer
+
+
+def create_query_expanders(llm):
+    """
+    Query expanders of the QUERY_EXPANSION modes, generating with llm
+    """
+    from app.services.query_expansion import EXPANDERS, MultiQueryExpander
+
+    config = get_config()
+    expanders = []
+    for mode in config.QUERY_EXPANSION:
+        if mode not in EXPANDERS:
+            raise ValueError(f"Unknown query expansion mode {mode}, expected one of {sorted(EXPANDERS)}")
+        kwargs = {"count": config.QUERY_EXPANSION_QUERIES} if EXPANDERS[mode] is MultiQueryExpander else {}
+        expanders.append(EXPANDERS[mode](llm, budget=config.QUERY_EXPANSION_BUDGET_MS.get(mode, 1500) / 1000,
+                                         cache_size=config.QUERY_EXPANSION_CACHE_SIZE, **kwargs))
+    return expanders
+
+
+@lru_cache()
+def get_query_expanders():
+    """
+    Query expanders shared by every collection, so an expansion is cached once per question
+    """
+    if not get_config().QUERY_EXPANSION:
+        return ()
+    return tuple(create_query_expanders(get_stage_model("expansion")))
+
+
+def build_answer_pipeline(name: str, vector_store, llm, expanders=None):
+    """
+    Retrieval, re-ranking and context assembly pipeline configured from Settings.
+    Without re-ranking it retrieves RETRIEVAL_K documents, like the chain it replaced.
+    """
+    from app.services.context_assembly import ContextAssembler
+    from app.services.rag_pipeline import SourcedRAGPipeline
+    from app.services.reranking import Reranker, build_scorer
+
+    config = get_config()
+    reranker = None
+    if config.RERANK_ENABLED:
+        reranker = Reranker(build_scorer(config.RERANK_MODEL), batch_size=config.RERANK_BATCH_SIZE,
+                            cache_size=config.RERANK_CACHE_SIZE, deadline=config.RERANK_DEADLINE_MS / 1000)
+    return SourcedRAGPipeline(
+        vector_store=vector_store,
+        llm=llm,
+        template=template,
+        top_n=config.RERANK_TOP_N if reranker else config.RETRIEVAL_K,
+        fetch_k=config.RERANK_FETCH_K,
+        reranker=reranker,
+        assembler=ContextAssembler(config.CONTEXT_TOKEN_BUDGET, encoding_name=config.CONTEXT_ENCODING,
+                                   dedup_threshold=config.CONTEXT_DEDUP_THRESHOLD),
+        name=name,
+        expanders=get_query_expanders() if expanders is None else expanders,
+        rrf_k=config.RRF_K,
+    )
+
+
+def build_chat_pipeline(vector_store, rephrase_llm, answer_llm, expanders=None):
+    """
+    Conversational pipeline configured from Settings
+    """
+    from app.services.rag_pipeline import ConversationalRAGPipeline
+
+    return ConversationalRAGPipeline(rephrase_llm, condense_template,
+                                     build_answer_pipeline("rag_chain_chat", vector_store, answer_llm, expanders),
+                                     rephrase_empty_history=get_config().REPHRASE_EMPTY_HISTORY)
+
+
+def build_collection(name: str):
+    """
+    Vector store of a collection and the pipelines built on it
+    """
+    from app.services.vector_stores import CollectionHandle, ensure_partition
+
+    vector_store = create_vector_store(name)
+    if get_config().VECTOR_PARTITIONING:
+        ensure_partition(name)
+    return CollectionHandle(
+        name=name,
+        vector_store=vector_store,
+        source_pipeline=build_answer_pipeline("rag_chain_with_source", vector_store, get_stage_model("answer")),
+        chat_pipeline=build_chat_pipeline(vector_store, get_stage_model("rephrase"), get_stage_model("answer")),
+    )
+
+
+@lru_cache()
+def get_collection_registry():
+    """
+    Bounded LRU of the collections served by this worker
+    """
+    from app.services.vector_stores import VectorStoreRegistry
+
+    return VectorStoreRegistry(build_collection, get_config().VECTOR_STORE_CACHE_SIZE)
+
+
+async def get_collection_name(request: Request,
+                              credentials: Optional[HTTPAuthorizationCredentials] = Depends(
+                                  HTTPBearer(auto_error=False))) -> str:
+    """
+    Collection the request works on, chosen by COLLECTION_ROUTING
+    """
+    from app.services.vector_stores import is_valid_collection_name, tenant_collection_name
+
+    config = get_config()
+    if config.COLLECTION_ROUTING == "user":
+        from appfrwk.utils.verify_token import get_verify_token
+
+        if credentials is None:
+            raise UnauthenticatedException()
+        result = await get_verify_token()(SecurityScopes(), credentials)
+        return tenant_collection_name(result.sub, config.COLLECTION_PREFIX)
+    if config.COLLECTION_ROUTING == "parameter":
+        name = request.query_params.get("collection") or request.headers.get("x-collection")
+        if name:
+            if not is_valid_collection_name(name):
+                raise HTTPException(status_code=400, detail="Invalid collection name")
+            # Any caller can name a collection, so only the listed ones are served (and created by ingestion)
+            if name != config.collection_name and name not in config.COLLECTION_ALLOWED:
+                raise UnauthorizedException(f"Collection {name} is not available")
+            return name
+    return config.collection_name
+
+
+async def get_collection(name: str = Depends(get_collection_name)):
+    """
+    Handle of the request's collection, built off the event loop on first use
+    """
+    registry = get_collection_registry()
+    if name in registry:
+        return registry.get(name)
+    return await asyncio.to_thread(registry.get, name)
+
+
+def get_vector_store(collection=Depends(get_collection)):
+    """
+    pgvector store of the request's collection
+    """
+    return collection.vector_store
+
+
+def get_source_pipeline(collection=Depends(get_collection)):
+    """
+    Retrieval, re-ranking and context assembly pipeline for rag_chain_with_source
+    """
+    return collection.source_pipeline
+
+
+def get_chat_pipeline(collection=Depends(get_collection)):
+    """
+    Conversational pipeline for rag_chain_chat: rephrase, then answer like rag_chain_with_source
+    """
+    return collection.chat_pipeline
+
+
+@lru_cache()
+def get_tool_cache():
+    """
+    Agent tool result cache shared by the conversations of this worker
+    """
+    from app.services.tool_cache import ToolResultCache
+
+    config = get_config()
+    return ToolResultCache(config.AGENT_TOOL_CACHE_TTL, config.AGENT_TOOL_CACHE_SIZE)
+
+
+def prepare_agent_executor(agent_executor, conversation_id: Optional[str] = None):
+    """
+    Copy of the shared executor for one request, with the agent's chat model
+    replaced by the agent stage gateway model, the agent loop capped and its
+    tool results cached (the agent searches collection_name)
+    """
+    from app.services.llm_gateway import route_through_gateway
+    from app.services.tool_cache import copy_model
+    from app.services.vector_stores import collection_version
+
+    config = get_config()
+    agent, replaced = route_through_gateway(agent_executor.agent, get_stage_model("agent"))
+    if not replaced:
+        raise RuntimeError("The agent has no chat model the LLM gateway can replace")
+    tools = agent_executor.tools
+    if config.AGENT_TOOL_CACHE_ENABLED:
+        tools = get_tool_cache().wrap_tools(tools, conversation_id, collection_version(config.collection_name),
+                                            config.AGENT_TOOL_CACHE_SCOPES)
+    return copy_model(agent_executor, agent=agent, tools=tools, max_iterations=config.AGENT_MAX_ITERATIONS,
+                      max_execution_time=config.AGENT_MAX_EXECUTION_TIME)
+
+
+@lru_cache()
+def get_known_users():
+    """
+    Subs this worker knows have a user row
+    """
+    from app.services.conversations import KnownUsers
+
+    return KnownUsers(get_config().KNOWN_USERS_CACHE_SIZE)
+
+
+@lru_cache()
+def get_message_buffer():
+    """
+    Write-behind buffer of chat messages, flushed to DATABASE_URL
+    """
+    from app.services.message_buffer import MessageBuffer
+
+    config = get_config()
+    return MessageBuffer(config.MESSAGE_BUFFER_PATH, get_database().get_sessionmaker(config.DATABASE_URL),
+                         batch_size=config.MESSAGE_FLUSH_BATCH, flush_interval=config.MESSAGE_FLUSH_INTERVAL)
+
+
+async def track_ingestion():
+    """
+    Count an ingestion request as in-flight work so shutdown waits for it,
+    and refuse new ones with 503 while the worker drains
+    """
+    async with get_work_tracker().track("ingestion"):
+        yield
+
+
+async def require_admin(security_scopes: SecurityScopes,
+                        credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer())):
+    """
+    Admin routes need a valid token carrying the ADMIN_SCOPE scope
+    """
+    from appfrwk.utils.verify_token import get_verify_token
+
+    result = await get_verify_token()(security_scopes, credentials)
+    scope = get_config().ADMIN_SCOPE
+    if scope not in (result.payload.scope or "").split():
+        raise UnauthorizedException(f"Requires the {scope} scope")
+    return result
+
+
+def _load_encoding():
+    from app.services.context_assembly import get_encoding
+
+    get_encoding(get_config().CONTEXT_ENCODING)
+
+
+async def _warm(name: str, provider):
+    try:
+        await asyncio.to_thread(provider)
+        return True
+    except Exception as e:
+        log.error(f"Could not initialize {name}: {str(e)}")
+        return False
+
+
+async def warm_up() -> bool:
+    """
+    Build the shared clients concurrently and open the database pools.
+    Returns False when anything failed; the failed providers retry on first use.
+    """
+    database = get_database()
+    config = get_config()
+    created = await asyncio.gather(
+        _warm("vector store and pipelines", lambda: get_collection_registry().get(config.collection_name)),
+        _warm("conversation database", lambda: database.get_engine(config.DATABASE_URL)),
+        _warm("tokenizer", _load_encoding),
+    )
+    await database.warm()
+    return all(created)
@@ -0,0 +1,83 @@
+import os
+import re
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+
+from app.api.dependencies import require_admin
+from app.services.collection_transfer import aexport_collection, aimport_collection
+from app.services.vector_stores import bump_collection_version
+from appfrwk.config import get_config
+from appfrwk.logging_config import get_logger
+from appfrwk.server import get_work_tracker
+
+config = get_config()
+log = get_logger(__name__)
+
+# Router information
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+    dependencies=[Depends(require_admin)],
+    responses={404: {"description": "Not found"}},
+)
+
+EXPORT_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,127}$")
+
+
+class CollectionExport(BaseModel):
+    name: str  # directory under EXPORT_DIRECTORY
+    collection: Optional[str] = None  # defaults to collection_name
+    overwrite: bool = False
+
+
+class CollectionImport(BaseModel):
+    name: str
+    collection: Optional[str] = None  # defaults to the exported collection
+    mode: Literal["append", "replace"] = "append"
+
+
+def export_directory(name: str) -> str:
+    """
+    Exports live under EXPORT_DIRECTORY, the API never takes a path
+    """
+    if not EXPORT_NAME.match(name):
+        raise HTTPException(status_code=400, detail="Export names are letters, digits, '.', '_' and '-'")
+    return os.path.join(config.EXPORT_DIRECTORY, name)
+
+
+@router.post("/collection/export")
+async def export_collection(request: CollectionExport):
+    """
+    Export the collection's documents, metadata and vectors to EXPORT_DIRECTORY/name
+    """
+    directory = export_directory(request.name)
+    try:
+        async with get_work_tracker().track("transfer"):
+            stats = await aexport_collection(request.collection or config.collection_name, directory,
+                                             batch_size=config.TRANSFER_BATCH_SIZE,
+                                             shard_rows=config.TRANSFER_SHARD_ROWS, overwrite=request.overwrite)
+        return stats.as_dict()
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except FileExistsError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.post("/collection/import")
+async def import_collection(request: CollectionImport):
+    """
+    Load EXPORT_DIRECTORY/name into the collection with COPY
+    """
+    directory = export_directory(request.name)
+    try:
+        async with get_work_tracker().track("transfer"):
+            stats = await aimport_collection(directory, request.collection, request.mode,
+                                             batch_size=config.TRANSFER_BATCH_SIZE)
+        bump_collection_version(stats.collection)
+        return stats.as_dict()
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -1,27 +1,31 @@
+import asyncio
 import os
-from typing import List
+from contextlib import AsyncExitStack
+from datetime import datetime
+from typing import List, Optional
 
-from RagLLM.LangChainIntergrations.langchainlayer import LangChainService
 from RagLLM.PGvector.models import DocumentResponse
-from RagLLM.PGvector.store import AsnyPgVector
-from RagLLM.PGvector.store_factory import get_vector_store
-from RagLLM.Processing.langchain_processing import load_conversation_history
-from RagLLM.Raptor.dyamic_raptor import TextClusterSummarizer
 from RagLLM.database import agent_schemas as schemas
-from RagLLM.database import db, crud, agent_schemas
-from RagLLM.database.user_schemas import UserCreate
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from RagLLM.database import crud, agent_schemas
+from fastapi import APIRouter, HTTPException, Request, UploadFile, File
 from fastapi import Depends
-from langchain.globals import set_debug
-from langchain_anthropic import ChatAnthropic
-from langchain_community.chat_models.anthropic import ChatAnthropic
-from langchain_openai import OpenAIEmbeddings
-
-from app.api.schemas.user_schemas import DocumentInput, QuickMessage
+from fastapi.responses import StreamingResponse
+
+from app.api.dependencies import (get_chat_pipeline, get_collection_name, get_known_users, get_message_buffer,
+                                  get_source_pipeline, get_summarizer_factory, get_vector_store,
+                                  prepare_agent_executor, template, track_ingestion)
+from app.api.schemas.user_schemas import ConversationCreate, ConversationMessage, DocumentInput, QuickMessage
+from app.services.callbacks import request_callbacks
+from app.services.conversations import create_conversation as create_user_conversation, get_messages_after
+from app.services.ingestion import astream_ingest
+from app.services.vector_stores import bump_collection_version
+from appfrwk.admission import PRIORITY_BACKGROUND, admission, enter_admission
 from appfrwk.config import get_config
+from appfrwk.database import get_database, get_db
 from appfrwk.logging_config import get_logger
+from appfrwk.metrics import INGESTION_JOBS, time_phase
+from appfrwk.server import get_work_tracker
 
-set_debug(True)
 config = get_config()
 log = get_logger(__name__)
 
@@ -32,41 +36,49 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
-_template = """Given the following conversation and a follow up question, rephrase the follow up question to be a standalone question, in its original language.
-
-Chat History:
-{chat_history}
-Follow Up Input: {question}
-Standalone question:"""
 history = []
-template = """Answer the question based only on the following context:
-   {context}
 
-   Question: {question}
-   """
+AGENT_TIMEOUT_GRACE = 10.0
 
-try:
 
-    OPENAI_API_KEY = config.OPENAI_API_KEY
-    embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
+def add_routes(app):
+    app.include_router(router)
 
-    mode = "async"
-    pgvector_store = get_vector_store(
-        connection_string=f"{config.DATABASE_URL2}",
-        embeddings=embeddings,
-        collection_name=f"{config.collection_name}",
-        mode=mode,
-    )
-    db.connect()
 
-except ValueError as e:
-    raise HTTPException(status_code=500, detail=str(e))
-except Exception as e:
-    raise HTTPException(status_code=500, detail=str(e))
+async def ingest(summarizer, pgvector_store, collection_name: str, route: str, source: str, document_name: str):
+    try:
+        return await astream_ingest(summarizer, pgvector_store, route, source, batch_size=config.INGESTION_BATCH_SIZE,
+                                    queue_size=config.INGESTION_QUEUE_SIZE, writers=config.INGESTION_WRITERS,
+                                    encoding_name=config.CONTEXT_ENCODING, document_name=document_name)
+    finally:
+        # Results cached for the collection's previous content are stale
+        bump_collection_version(collection_name)
 
 
-def add_routes(app):
-    app.include_router(router)
+async def flush_buffered_messages(conversation_id: str):
+    """
+    History is loaded from the database, so buffered turns of the conversation are written first
+    """
+    if config.MESSAGE_WRITE_BEHIND:
+        buffer = get_message_buffer()
+        if await buffer.has_pending(conversation_id):
+            await buffer.flush(conversation_id)
+
+
+async def save_message(db_session, conversation_id: str, user_message: str, agent_message: str):
+    """
+    Store a chat turn, through the write-behind buffer with MESSAGE_WRITE_BEHIND.
+    Without a session one is opened for the write.
+    """
+    if config.MESSAGE_WRITE_BEHIND:
+        await get_message_buffer().append(conversation_id, user_message, agent_message)
+        return
+    if db_session is None:
+        async with get_database().get_sessionmaker(config.DATABASE_URL)() as session:
+            return await save_message(session, conversation_id, user_message, agent_message)
+    db_messages = agent_schemas.MessageCreate(
+        user_message=user_message, agent_message=agent_message, conversation_id=conversation_id)
+    await crud.create_conversation_message(db_session, message=db_messages, conversation_id=conversation_id)
 
 
 async def save_temp_file(upload_file: UploadFile, directory: str = "/tmp") -> str:
@@ -80,8 +92,12 @@ async def save_temp_file(upload_file: UploadFile, directory: str = "/tmp") -> st
         await upload_file.close()
 
 
-@router.post("/add-documents-upload")
-async def add_documents_upload_raptor(pdf_file: UploadFile = File(...), max_iteration: int = 5):
+@router.post("/add-documents-upload",
+             dependencies=[Depends(admission("ingestion", PRIORITY_BACKGROUND)), Depends(track_ingestion)])
+async def add_documents_upload_raptor(pdf_file: UploadFile = File(...), max_iteration: int = 5,
+                                      pgvector_store=Depends(get_vector_store),
+                                      collection_name: str = Depends(get_collection_name),
+                                      create_summarizer=Depends(get_summarizer_factory)):
     if pdf_file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="File must be a PDF.")
 
@@ -90,27 +106,26 @@ async def add_documents_upload_raptor(pdf_file: UploadFile = File(...), max_iter
         temp_file_path = await save_temp_file(pdf_file)
 
         # Proceed with your processing using the file path
-        # For example, let's say your summarizer needs a file path
-        model = ChatAnthropic(temperature=0, anthropic_api_key=config.anthropic_api_key,
-                              model_name="claude-3-opus-20240229")
-        summarizer = TextClusterSummarizer(token_limit=16000, data_directory=temp_file_path,
-                                           max_iterations=max_iteration)
-        final_output = summarizer.run()
-
-        # Add documents to pgvector_store as before
-        ids = await pgvector_store.aadd_documents(final_output)
+        summarizer = create_summarizer(temp_file_path, max_iteration)
+        # Chunks are stored as they are produced and each summary level as it completes
+        ingested = await ingest(summarizer, pgvector_store, collection_name, "add_documents_upload", "upload",
+                              pdf_file.filename)
 
         # Cleanup: remove the temporary file after use
         os.remove(temp_file_path)
 
-        return {"message": "Documents added successfully", "ids": ids}
+        INGESTION_JOBS.inc(source="upload", status="success")
+        return {"message": "Documents added successfully", "ids": ingested.ids}
 
     except Exception as e:
+        INGESTION_JOBS.inc(source="upload", status="error")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/get-all-ids/")
-async def get_all_ids():
+async def get_all_ids(pgvector_store=Depends(get_vector_store)):
+    from RagLLM.PGvector.store import AsnyPgVector
+
     try:
         if isinstance(pgvector_store, AsnyPgVector):
             ids = await pgvector_store.get_all_ids()
@@ -123,7 +138,9 @@ async def get_all_ids():
 
 
 @router.post("/get-documents-by-ids/", response_model=list[DocumentResponse])
-async def get_documents_by_ids(ids: list[str]):
+async def get_documents_by_ids(ids: list[str], pgvector_store=Depends(get_vector_store)):
+    from RagLLM.PGvector.store import AsnyPgVector
+
     try:
         if isinstance(pgvector_store, AsnyPgVector):
             existing_ids = await pgvector_store.get_all_ids()
@@ -142,119 +159,182 @@ async def get_documents_by_ids(ids: list[str]):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/add-documents-internet")
-async def add_documents_internet_raptor(input_data: DocumentInput):
+@router.post("/add-documents-internet",
+             dependencies=[Depends(admission("ingestion", PRIORITY_BACKGROUND)), Depends(track_ingestion)])
+async def add_documents_internet_raptor(input_data: DocumentInput, pgvector_store=Depends(get_vector_store),
+                                        collection_name: str = Depends(get_collection_name),
+                                        create_summarizer=Depends(get_summarizer_factory)):
     try:
-        summarizer = TextClusterSummarizer(token_limit=16000, data_directory=input_data.pdf_filename, max_iterations=input_data.max_iteration)
-
-        final_output = summarizer.run()
-
-        ids = (
-            await pgvector_store.aadd_documents(final_output)
-        )
+        summarizer = create_summarizer(input_data.pdf_filename, input_data.max_iteration)
+        ingested = await ingest(summarizer, pgvector_store, collection_name, "add_documents_internet", "internet",
+                              os.path.basename(input_data.pdf_filename))
 
-        return {"message": "Documents added successfully", "ids": ids}
+        INGESTION_JOBS.inc(source="internet", status="success")
+        return {"message": "Documents added successfully", "ids": ingested.ids}
     except Exception as e:
+        INGESTION_JOBS.inc(source="internet", status="error")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/create-conversation", response_model=schemas.Conversation)
-async def create_conversation(conversation: schemas.ConversationCreate,
-                              db_session=Depends(db.get_db)) -> schemas.Conversation:
-    """ Create conversation """
+async def create_conversation(conversation: ConversationCreate, db_session=Depends(get_db)) -> schemas.Conversation:
+    """ Create conversation, and its user on first use """
 
     try:
-
-        user_sub = conversation.user_sub
-        user = await crud.get_user_by_sub(db_session, user_sub)
-        if not user:
-            log.info(f"Sub not found, creating user")
-            user = await crud.create_user(db_session, UserCreate(sub=user_sub))
-        log.info(f"User retrieved")
-        log.info(f"Creating conversation")
-        db_conversation = await crud.create_conversation(db_session, conversation)
-        log.info(f"Conversation created")
+        with time_phase("create_conversation", "db"):
+            db_conversation = await create_user_conversation(
+                db_session, conversation.user_sub, [message.model_dump() for message in conversation.messages],
+                known_users=get_known_users())
+        log.info("Conversation created")
         return db_conversation
     except Exception as e:
         log.error(f"Error creating conversation: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
-@router.post("/rag_chain_chat/")
-async def quick_response(message: schemas.UserMessage, db_session=Depends(db.get_db)):
+@router.post("/rag_chain_chat/", dependencies=[Depends(admission("rag_chain_chat"))])
+async def quick_response(message: schemas.UserMessage, db_session=Depends(get_db),
+                         chat_pipeline=Depends(get_chat_pipeline)):
+    from RagLLM.LangChainIntergrations.langchainlayer import LangChainService
+    from RagLLM.Processing.langchain_processing import load_conversation_history
+
     Service = LangChainService(model_name=config.SERVICE_MODEL, template=template)
 
     try:
-        conversation = await crud.get_conversation(db_session, message.conversation_id)
+        with time_phase("rag_chain_chat", "db"):
+            await flush_buffered_messages(message.conversation_id)
+            conversation = await crud.get_conversation(db_session, message.conversation_id)
         log.info(f"User Message: {message.message}")
 
     except Exception as e:
         log.error(f"Error getting conversation: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
     try:
-        chathistory = load_conversation_history(conversation, Service)
-        log.info(f"current chat history {Service.get_message_history()}")
-
-        result = Service.rag_chain.invoke(
-            {
-                "question": message.message,
-                "chat_history": Service.get_message_history(),
-            }
-        )
-
-        db_messages = agent_schemas.MessageCreate(
-            user_message=message.message, agent_message=result, conversation_id=conversation.id)
-        await crud.create_conversation_message(db_session, message=db_messages, conversation_id=conversation.id)
+        with time_phase("rag_chain_chat", "history"):
+            chathistory = load_conversation_history(conversation, Service)
+        log.debug("current chat history %s", Service.get_message_history())
+
+        answer = await chat_pipeline.ainvoke(message.message, Service.get_message_history())
+        result = answer["answer"]
+
+        with time_phase("rag_chain_chat", "db"):
+            await save_message(db_session, conversation.id, message.message, result)
         return result
     except Exception as e:
         log.error(f"error code 500 {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/agent_rag_chain_chat/")
-async def agent_response(message: schemas.UserMessage, db_session=Depends(db.get_db)):
+@router.post("/rag_chain_chat/stream", response_class=StreamingResponse)
+async def quick_response_stream(message: schemas.UserMessage, request: Request, db_session=Depends(get_db),
+                                chat_pipeline=Depends(get_chat_pipeline)):
+    """
+    rag_chain_chat streaming the answer as plain text while it is generated.
+    The message is saved once the answer is complete.
+    """
+    from RagLLM.LangChainIntergrations.langchainlayer import LangChainService
+    from RagLLM.Processing.langchain_processing import load_conversation_history
+
     Service = LangChainService(model_name=config.SERVICE_MODEL, template=template)
 
+    # Dependencies are released before the body is sent, so the response holds
+    # its own admission slot and in-flight count until the stream ends
+    stack = AsyncExitStack()
     try:
-        conversation = await crud.get_conversation(db_session, message.conversation_id)
+        await stack.enter_async_context(get_work_tracker().track("streaming"))
+        await enter_admission(stack, request, "rag_chain_chat")
+    except BaseException:
+        await stack.aclose()
+        raise
+
+    try:
+        with time_phase("rag_chain_chat", "db"):
+            await flush_buffered_messages(message.conversation_id)
+            conversation = await crud.get_conversation(db_session, message.conversation_id)
+        log.info(f"User Message: {message.message}")
+        with time_phase("rag_chain_chat", "history"):
+            load_conversation_history(conversation, Service)
+        chunks = chat_pipeline.astream(message.message, Service.get_message_history())
+        # Wait for the first chunk so retrieval and provider errors still get a status code
+        first = await anext(chunks, "")
+    except BaseException as e:
+        await stack.aclose()
+        if isinstance(e, Exception):
+            log.error(f"error code 500 {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+        raise
+
+    async def body():
+        async with stack:
+            answer = [first]
+            try:
+                yield first
+                async for chunk in chunks:
+                    answer.append(chunk)
+                    yield chunk
+            except Exception as e:
+                log.error(f"Streaming rag_chain_chat failed: {e}")
+                yield "\n\n[The answer could not be completed]"
+                return
+            finally:
+                await chunks.aclose()
+
+            with time_phase("rag_chain_chat", "db"):
+                await save_message(None, conversation.id, message.message, "".join(answer))
+
+    return StreamingResponse(body(), media_type="text/plain; charset=utf-8")
+
+
+@router.post("/agent_rag_chain_chat/", dependencies=[Depends(admission("agent_rag_chain_chat"))])
+async def agent_response(message: schemas.UserMessage, db_session=Depends(get_db)):
+    from RagLLM.LangChainIntergrations.langchainlayer import LangChainService
+    from RagLLM.Processing.langchain_processing import load_conversation_history
+
+    Service = LangChainService(model_name=config.SERVICE_MODEL, template=template)
+
+    try:
+        with time_phase("agent_rag_chain_chat", "db"):
+            await flush_buffered_messages(message.conversation_id)
+            conversation = await crud.get_conversation(db_session, message.conversation_id)
         log.info(f"User Message: {message.message}")
 
     except Exception as e:
         log.error(f"Error getting conversation: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
     try:
-        chathistory = load_conversation_history(conversation, Service)
-        log.info(f"current chat history {Service.get_message_history()}")
-
-        result = Service.agent_executor.invoke(
-            {
-                "input": message.message,
-                "chat_history": Service.get_message_history(),
-            }
-        )
-
-        db_messages = agent_schemas.MessageCreate(
-            user_message=message.message, agent_message=result["output"], conversation_id=conversation.id)
-        await crud.create_conversation_message(db_session, message=db_messages, conversation_id=conversation.id)
+        with time_phase("agent_rag_chain_chat", "history"):
+            chathistory = load_conversation_history(conversation, Service)
+        log.debug("current chat history %s", Service.get_message_history())
+
+        # The executor stops itself after AGENT_MAX_ITERATIONS steps or AGENT_MAX_EXECUTION_TIME, checked between
+        # steps; the wait_for grace bounds a step that hangs
+        agent_executor = prepare_agent_executor(Service.agent_executor, message.conversation_id)
+        with time_phase("agent_rag_chain_chat", "agent"):
+            result = await asyncio.wait_for(agent_executor.ainvoke(
+                {
+                    "input": message.message,
+                    "chat_history": Service.get_message_history(),
+                },
+                config={"callbacks": request_callbacks("agent_rag_chain_chat")},
+            ), config.AGENT_MAX_EXECUTION_TIME + AGENT_TIMEOUT_GRACE)
+
+        with time_phase("agent_rag_chain_chat", "db"):
+            await save_message(db_session, conversation.id, message.message, result["output"])
 
         return result["output"]
+    except asyncio.TimeoutError:
+        log.error(f"Agent exceeded {config.AGENT_MAX_EXECUTION_TIME}s on conversation {message.conversation_id}")
+        raise HTTPException(status_code=504, detail="The agent did not finish in time")
     except Exception as e:
         log.error(f"error code 500 {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/rag_chain_with_source/")
-
-async def rag_chain_with_source_response(message: QuickMessage):
-    Service = LangChainService(model_name=config.SERVICE_MODEL, template=template)
+@router.post("/rag_chain_with_source/", dependencies=[Depends(admission("rag_chain_with_source"))])
 
+async def rag_chain_with_source_response(message: QuickMessage, source_pipeline=Depends(get_source_pipeline)):
     try:
-
-        result = Service.rag_chain_with_source.invoke(
-
-            message.question
-
-        )
+        result = await source_pipeline.ainvoke(message.question)
 
         return result
     except Exception as e:
@@ -263,7 +343,7 @@ async def rag_chain_with_source_response(message: QuickMessage):
 
 
 @router.get("/user-conversations", response_model=List[schemas.Conversation])
-async def get_user_conversations(user_sub: str, db_session=Depends(db.get_db)) -> List[schemas.Conversation]:
+async def get_user_conversations(user_sub: str, db_session=Depends(get_db)) -> List[schemas.Conversation]:
     """
     Get all conversations for an agent by id
     """
@@ -276,17 +356,27 @@ async def get_user_conversations(user_sub: str, db_session=Depends(db.get_db)) -
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
-@router.get("/get-conversation-messages", response_model=List[schemas.MessageCreate])
-async def get_conversation_messages(conversation_id: str, db_session=Depends(db.get_db)) -> List[schemas.MessageCreate]:
+@router.get("/get-conversation-messages", response_model=List[ConversationMessage])
+async def get_conversation_messages(conversation_id: str, after: Optional[datetime] = None,
+                                    db_session=Depends(get_db)) -> List[ConversationMessage]:
     """
-    Get all messages for a conversation by id
+    Get all messages for a conversation by id, or only those created after
+    the ``after`` cursor (created_at of the last message the client has)
     """
     try:
         log.info(
             f"Getting all messages for conversation id: {conversation_id}")
-        db_messages = await crud.get_conversation_messages(db_session, conversation_id)
-
-        message_history = db_messages
+        if after is not None:
+            message_history = [ConversationMessage.model_validate(row)
+                               for row in await get_messages_after(db_session, conversation_id, after)]
+        else:
+            message_history = await crud.get_conversation_messages(db_session, conversation_id)
+        if config.MESSAGE_WRITE_BEHIND:
+            # Turns still in the write-behind buffer, so clients read their own writes
+            stored = {str(row.id) for row in message_history}
+            message_history += [ConversationMessage.model_validate(row)
+                                for row in await get_message_buffer().pending(conversation_id, after)
+                                if row["id"] not in stored]
         message_history.sort(key=lambda x: x.created_at, reverse=False)
         
         return message_history
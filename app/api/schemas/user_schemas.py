@@ -1,4 +1,7 @@
-from pydantic import BaseModel
+from datetime import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel, ConfigDict
 
 class UserBase(BaseModel):
     """
@@ -18,3 +21,28 @@ class DocumentInput(BaseModel):
 
 class QuickMessage(BaseModel):
     question: str
+
+class ConversationMessage(BaseModel):
+    """
+    Stored conversation turn, created_at is the cursor for fetching newer ones
+    """
+    model_config = ConfigDict(from_attributes=True)
+
+    id: Optional[str] = None
+    conversation_id: Optional[str] = None
+    user_message: str
+    agent_message: str
+    created_at: Optional[datetime] = None
+
+
+class InitialMessage(BaseModel):
+    user_message: str
+    agent_message: str
+
+class ConversationCreate(BaseModel):
+    """
+    Conversation creation schema, the user is created on first use and the
+    conversation can start with earlier messages
+    """
+    user_sub: str
+    messages: List[InitialMessage] = []
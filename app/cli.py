@@ -0,0 +1,72 @@
+"""
+Command line administration of the vector store.
+
+Export a collection (collection_name by default) to a directory of
+.jsonl/.npy shards, and load it into another environment with COPY:
+
+    python -m app.cli export-collection exports/papers-2024-05
+    python -m app.cli import-collection exports/papers-2024-05 --collection papers --mode replace
+
+Both commands connect to DATABASE_URL2 and print the rows moved and the
+throughput as JSON.
+
+Partition the embeddings table by collection (once, in a maintenance
+window; set VECTOR_PARTITIONING so new collections get a partition too):
+
+    python -m app.cli partition-embeddings
+
+Index the node metadata stored at ingestion (ids, levels, sources and the
+children of summaries, see app.services.raptor_nodes):
+
+    python -m app.cli create-metadata-indexes
+"""
+import argparse
+import json
+
+from app.services.collection_transfer import IMPORT_MODES, export_collection, import_collection
+from app.services.raptor_nodes import create_metadata_indexes
+from app.services.vector_stores import partition_embeddings
+from appfrwk.config import get_config
+from appfrwk.logging_config import setup_logging
+
+
+def main():
+    config = get_config()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export-collection")
+    export_parser.add_argument("directory")
+    export_parser.add_argument("--collection", default=config.collection_name)
+    export_parser.add_argument("--batch-size", type=int, default=config.TRANSFER_BATCH_SIZE)
+    export_parser.add_argument("--shard-rows", type=int, default=config.TRANSFER_SHARD_ROWS)
+    export_parser.add_argument("--overwrite", action="store_true")
+
+    import_parser = commands.add_parser("import-collection")
+    import_parser.add_argument("directory")
+    import_parser.add_argument("--collection", help="target collection, defaults to the exported one")
+    import_parser.add_argument("--mode", choices=IMPORT_MODES, default="append",
+                               help="append skips ids already present, replace deletes the collection's rows first")
+    import_parser.add_argument("--batch-size", type=int, default=config.TRANSFER_BATCH_SIZE)
+
+    commands.add_parser("partition-embeddings")
+    commands.add_parser("create-metadata-indexes")
+
+    args = parser.parse_args()
+    setup_logging()
+    if args.command == "partition-embeddings":
+        print(json.dumps({"partitions_created": partition_embeddings()}, indent=2))
+        return
+    if args.command == "create-metadata-indexes":
+        print(json.dumps({"indexes": create_metadata_indexes()}, indent=2))
+        return
+    if args.command == "export-collection":
+        stats = export_collection(args.collection, args.directory, batch_size=args.batch_size,
+                                  shard_rows=args.shard_rows, overwrite=args.overwrite)
+    else:
+        stats = import_collection(args.directory, args.collection, args.mode, batch_size=args.batch_size)
+    print(json.dumps(stats.as_dict(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
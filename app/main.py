@@ -1,8 +1,5 @@
-from app import create_app
-from appfrwk.config import get_config
-import uvicorn
+from appfrwk.server import run
 
-config = get_config()
-app = create_app()
 if __name__ == "__main__":
-    uvicorn.run("main:app", host=config.HOST, port=config.PORT, reload=config.DEBUG)
\ No newline at end of file
+    # Workers, event loop, limits and timeouts come from the Settings (see appfrwk.server)
+    run("app:create_app")
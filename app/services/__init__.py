@@ -0,0 +1,3 @@
+"""
+Services used by the RAG routes: retrieval, re-ranking and answer generation.
+"""
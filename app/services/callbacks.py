@@ -0,0 +1,141 @@
+"""
+LangChain callback handlers used to observe chains we do not build ourselves
+"""
+import time
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from appfrwk.metrics import PHASE_DURATION
+from appfrwk.tracing import SPAN_KIND_CLIENT, SPAN_KIND_INTERNAL, Span, current_span, get_tracer
+
+
+class PhaseTimingCallback(BaseCallbackHandler):
+    """
+    Record retriever and LLM run durations as handler phases
+    """
+
+    def __init__(self, route: str):
+        self.route = route
+        self._started: Dict[UUID, float] = {}
+
+    def _start(self, run_id: UUID):
+        self._started[run_id] = time.perf_counter()
+
+    def _end(self, run_id: UUID, phase: str):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            PHASE_DURATION.observe(time.perf_counter() - started, route=self.route, phase=phase)
+
+    def on_retriever_start(self, serialized, query, *, run_id: UUID, **kwargs: Any):
+        self._start(run_id)
+
+    def on_retriever_end(self, documents, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, "retrieval")
+
+    def on_retriever_error(self, error, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, "retrieval")
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs: Any):
+        self._start(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs: Any):
+        self._start(run_id)
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, "llm")
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, "llm")
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Turn LangChain chain, retriever, LLM and tool runs into spans.
+
+    Runs are parented to the span of their parent run, or to the span that
+    was active when the chain was invoked.
+    """
+
+    def __init__(self):
+        self.tracer = get_tracer()
+        self.root = current_span()
+        self._spans: Dict[UUID, Span] = {}
+
+    def _start(self, name: str, run_id: UUID, parent_run_id: Optional[UUID], kind: str, **attributes):
+        parent = self._spans.get(parent_run_id) or self.root
+        if parent is None or not parent.sampled:
+            return
+        attributes["langchain.run_type"] = kind
+        self._spans[run_id] = self.tracer.start_span(
+            f"langchain.{kind} {name}", SPAN_KIND_CLIENT if kind in ("llm", "retriever") else SPAN_KIND_INTERNAL,
+            attributes, parent=parent)
+
+    def _end(self, run_id: UUID, error: Optional[BaseException] = None, **attributes):
+        span = self._spans.pop(run_id, None)
+        if span is None:
+            return
+        for key, value in attributes.items():
+            span.set_attribute(key, value)
+        if error is not None:
+            span.record_exception(error)
+        span.end()
+
+    @staticmethod
+    def _name(serialized, kwargs) -> str:
+        if kwargs.get("name"):
+            return kwargs["name"]
+        serialized = serialized or {}
+        return serialized.get("name") or (serialized.get("id") or ["run"])[-1]
+
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, parent_run_id=None, **kwargs: Any):
+        self._start(self._name(serialized, kwargs), run_id, parent_run_id, "chain")
+
+    def on_chain_end(self, outputs, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, error)
+
+    def on_retriever_start(self, serialized, query, *, run_id: UUID, parent_run_id=None, **kwargs: Any):
+        self._start(self._name(serialized, kwargs), run_id, parent_run_id, "retriever")
+
+    def on_retriever_end(self, documents, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, **{"retriever.documents": len(documents)})
+
+    def on_retriever_error(self, error, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, error)
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, parent_run_id=None, **kwargs: Any):
+        self._start(self._name(serialized, kwargs), run_id, parent_run_id, "llm")
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, parent_run_id=None, **kwargs: Any):
+        self._start(self._name(serialized, kwargs), run_id, parent_run_id, "llm")
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any):
+        usage = (getattr(response, "llm_output", None) or {}).get("token_usage") or {}
+        self._end(run_id, **{f"llm.usage.{key}": value for key, value in usage.items()
+                             if isinstance(value, (int, float))})
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id: UUID, parent_run_id=None, **kwargs: Any):
+        self._start(self._name(serialized, kwargs), run_id, parent_run_id, "tool")
+
+    def on_tool_end(self, output, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, error)
+
+
+def request_callbacks(route: str) -> List[BaseCallbackHandler]:
+    """
+    Callbacks passed to every chain invoked while handling a request
+    """
+    callbacks: List[BaseCallbackHandler] = [PhaseTimingCallback(route)]
+    if get_tracer().enabled:
+        callbacks.append(TracingCallbackHandler())
+    return callbacks
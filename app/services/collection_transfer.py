@@ -0,0 +1,316 @@
+"""
+Export and import of a pgvector collection without re-running ingestion.
+
+An export is a directory of shards plus a manifest:
+
+- ``part-NNNNN.jsonl``: one line per row with its id, custom_id, document
+  and metadata
+- ``part-NNNNN.npy``: the row's embeddings as a float32 matrix in the same
+  order (pgvector stores float32, so the copy is exact)
+- ``manifest.json``: collection name and metadata, dimension, row counts
+  and the shard list, written last (and atomically) so an interrupted
+  export is never imported; overwriting an export removes its manifest first
+
+Rows keep their ids when imported under the exported collection name. Under
+another name they get new ids derived from the target collection and the
+original id, so the copy does not collide with the original in the same
+database and a repeated import still skips what it already loaded.
+
+Rows are streamed from a server side cursor into memory mapped shards, and
+loaded back with COPY into a staging table, so memory use is bounded by the
+batch size whatever the collection size. Both directions use a sync
+psycopg2 connection (the pgvector store's driver) and run in a thread when
+called from the event loop.
+"""
+import asyncio
+import csv
+import io
+import json
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import Text, cast, func, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from app.services.vector_stores import collections, create_partition, embeddings, get_sync_engine, is_partitioned
+from appfrwk.logging_config import get_logger
+
+log = get_logger(__name__)
+
+FORMAT = "pgvector-collection"
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+IMPORT_MODES = ("append", "replace")
+
+EMBEDDING_COLUMNS = "uuid, collection_id, custom_id, document, cmetadata, embedding"
+
+
+@dataclass
+class TransferStats:
+    """
+    Rows and bytes moved by an export or import, and how long it took
+    """
+    collection: str
+    directory: str
+    rows: int = 0
+    skipped: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+
+    def as_dict(self) -> Dict:
+        seconds = self.seconds or float("nan")
+        return {
+            "collection": self.collection,
+            "directory": self.directory,
+            "rows": self.rows,
+            "skipped": self.skipped,
+            "megabytes": round(self.bytes / 2 ** 20, 1),
+            "seconds": round(self.seconds, 2),
+            "rows_per_s": round(self.rows / seconds) if self.seconds else None,
+            "mb_per_s": round(self.bytes / 2 ** 20 / seconds, 1) if self.seconds else None,
+        }
+
+
+def parse_vector(value: str) -> np.ndarray:
+    """
+    pgvector text form ``[0.1,0.2,...]`` -> float32 array
+    """
+    return np.fromstring(value.strip("[]"), sep=",", dtype=np.float32)
+
+
+def shard_name(index: int) -> str:
+    return f"part-{index:05d}"
+
+
+def write_shards(rows: Iterable[Tuple[str, Optional[str], str, Optional[Dict], str]], total: int, directory: str,
+                 shard_rows: int = 100_000) -> Tuple[List[Dict], Optional[int], int]:
+    """
+    Write (id, custom_id, document, metadata, vector text) rows into shards
+    of at most shard_rows rows. ``total`` sizes the memory mapped matrices.
+    Returns the shard list, the dimension and the bytes written.
+    """
+    shards: List[Dict] = []
+    dimension = None
+    documents = vectors = None
+    position = 0
+    for index, (id_, custom_id, document, metadata, vector) in enumerate(rows):
+        if index % shard_rows == 0:
+            _close_shard(documents, vectors)
+            vector = parse_vector(vector)
+            dimension = dimension or len(vector)
+            size = min(shard_rows, total - index)
+            name = shard_name(len(shards))
+            shards.append({"documents": f"{name}.jsonl", "vectors": f"{name}.npy", "rows": 0})
+            documents = open(os.path.join(directory, f"{name}.jsonl"), "w", encoding="utf-8")
+            vectors = np.lib.format.open_memmap(os.path.join(directory, f"{name}.npy"), mode="w+",
+                                                dtype=np.float32, shape=(size, dimension))
+            position = 0
+        else:
+            vector = parse_vector(vector)
+        documents.write(json.dumps({"id": str(id_), "custom_id": custom_id, "document": document,
+                                    "metadata": metadata}, ensure_ascii=False) + "\n")
+        vectors[position] = vector
+        position += 1
+        shards[-1]["rows"] = position
+    _close_shard(documents, vectors)
+    written = sum(os.path.getsize(os.path.join(directory, shard[key]))
+                  for shard in shards for key in ("documents", "vectors"))
+    return shards, dimension, written
+
+
+def _close_shard(documents, vectors):
+    if documents is not None:
+        documents.close()
+    if vectors is not None:
+        vectors.flush()
+
+
+def export_collection(collection_name: str, directory: str, engine: Optional[Engine] = None,
+                      batch_size: int = 5000, shard_rows: int = 100_000, overwrite: bool = False) -> TransferStats:
+    """
+    Export every row of a collection into directory
+    """
+    engine = engine or get_sync_engine()
+    manifest_path = os.path.join(directory, MANIFEST)
+    if os.path.exists(manifest_path):
+        if not overwrite:
+            raise FileExistsError(f"{directory} already holds an export")
+        # The shards are rewritten in place, the old manifest must not describe them meanwhile
+        os.remove(manifest_path)
+    os.makedirs(directory, exist_ok=True)
+    stats = TransferStats(collection_name, directory)
+    started = time.perf_counter()
+
+    # One snapshot for the row count and the rows, so the shard sizes match what is read
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="REPEATABLE READ")
+        with connection.begin():
+            collection = connection.execute(
+                select(collections.c.uuid, collections.c.cmetadata).where(collections.c.name == collection_name)
+            ).first()
+            if collection is None:
+                raise LookupError(f"Collection {collection_name} does not exist")
+            total = connection.scalar(select(func.count()).select_from(embeddings)
+                                      .where(embeddings.c.collection_id == collection.uuid))
+            result = connection.execute(
+                select(embeddings.c.uuid, embeddings.c.custom_id, embeddings.c.document, embeddings.c.cmetadata,
+                       cast(embeddings.c.embedding, Text))
+                .where(embeddings.c.collection_id == collection.uuid)
+                .order_by(embeddings.c.uuid),
+                execution_options={"stream_results": True, "yield_per": batch_size})
+            shards, dimension, stats.bytes = write_shards(result, total, directory, shard_rows)
+
+    stats.rows = sum(shard["rows"] for shard in shards)
+    manifest = {
+        "format": FORMAT,
+        "version": FORMAT_VERSION,
+        "collection": collection_name,
+        "collection_metadata": collection.cmetadata,
+        "dimension": dimension,
+        "dtype": "float32",
+        "rows": stats.rows,
+        "exported_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "shards": shards,
+    }
+    partial_path = f"{manifest_path}.partial"
+    with open(partial_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(partial_path, manifest_path)
+    stats.seconds = time.perf_counter() - started
+    log.info(f"Exported collection {stats.as_dict()}")
+    return stats
+
+
+def read_manifest(directory: str) -> Dict:
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding="utf-8") as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"{directory} has no {MANIFEST}, the export is missing or incomplete")
+    if manifest.get("format") != FORMAT or manifest.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported export format {manifest.get('format')} v{manifest.get('version')}")
+    return manifest
+
+
+def format_vector(vector: np.ndarray) -> str:
+    return "[" + ",".join(map(str, vector.tolist())) + "]"
+
+
+def shard_rows_csv(directory: str, shard: Dict, collection_id: str, batch_size: int = 5000,
+                   new_ids: bool = False) -> Iterator[str]:
+    """
+    CSV text of a shard for COPY, batch_size rows at a time. With new_ids the
+    rows get ids derived from collection_id and their exported id.
+    """
+    namespace = uuid.UUID(collection_id)
+    vectors = np.load(os.path.join(directory, shard["vectors"]), mmap_mode="r")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    with open(os.path.join(directory, shard["documents"]), encoding="utf-8") as documents:
+        for index, line in enumerate(documents):
+            row = json.loads(line)
+            row_id = str(uuid.uuid5(namespace, row["id"])) if new_ids else row["id"]
+            writer.writerow([row_id, collection_id, row["custom_id"], row["document"],
+                             json.dumps(row["metadata"]) if row["metadata"] is not None else None,
+                             format_vector(vectors[index])])
+            if (index + 1) % batch_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class IteratorReader(io.RawIOBase):
+    """
+    File-like view of an iterator of text chunks, read by cursor.copy_expert
+    """
+
+    def __init__(self, chunks: Iterable[str]):
+        self._chunks = iter(chunks)
+        self._pending = b""
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            try:
+                self._pending = next(self._chunks).encode("utf-8")
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        self.bytes_read += size
+        return size
+
+
+def _collection_id(connection: Connection, name: str, metadata: Optional[Dict]) -> str:
+    existing = connection.scalar(select(collections.c.uuid).where(collections.c.name == name))
+    if existing is not None:
+        return str(existing)
+    collection_id = str(uuid.uuid4())
+    connection.execute(collections.insert().values(uuid=collection_id, name=name, cmetadata=metadata))
+    return collection_id
+
+
+def import_collection(directory: str, collection_name: Optional[str] = None, mode: str = "append",
+                      engine: Optional[Engine] = None, batch_size: int = 5000) -> TransferStats:
+    """
+    Load an export into a collection (the exported name by default) in one
+    transaction. ``append`` keeps existing rows and skips ids already
+    present, ``replace`` deletes the collection's rows first. Under another
+    name than the exported one the rows get new ids.
+    """
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"mode must be one of {IMPORT_MODES}")
+    manifest = read_manifest(directory)
+    engine = engine or get_sync_engine()
+    stats = TransferStats(collection_name or manifest["collection"], directory)
+    new_ids = stats.collection != manifest["collection"]
+    started = time.perf_counter()
+
+    with engine.begin() as connection:
+        collection_id = _collection_id(connection, stats.collection, manifest.get("collection_metadata"))
+        if is_partitioned(connection):
+            create_partition(connection, collection_id)
+        if mode == "replace":
+            connection.execute(embeddings.delete().where(embeddings.c.collection_id == collection_id))
+        # Rows are copied into a staging table first, so ids that already exist are skipped instead of
+        # failing the whole COPY (the conflict target is left out, a partitioned table's key includes collection_id)
+        connection.execute(text("CREATE TEMP TABLE collection_import (LIKE langchain_pg_embedding "
+                                "INCLUDING DEFAULTS) ON COMMIT DROP"))
+        cursor = connection.connection.dbapi_connection.cursor()
+        try:
+            for shard in manifest["shards"]:
+                reader = IteratorReader(shard_rows_csv(directory, shard, collection_id, batch_size, new_ids))
+                cursor.copy_expert(f"COPY collection_import ({EMBEDDING_COLUMNS}) FROM STDIN "
+                                   f"WITH (FORMAT csv, FORCE_NOT_NULL (document))",
+                                   reader, size=1 << 20)
+                stats.bytes += reader.bytes_read
+        finally:
+            cursor.close()
+        inserted = connection.execute(text(
+            f"INSERT INTO langchain_pg_embedding ({EMBEDDING_COLUMNS}) "
+            f"SELECT {EMBEDDING_COLUMNS} FROM collection_import ON CONFLICT DO NOTHING")).rowcount
+    stats.rows = inserted
+    stats.skipped = manifest["rows"] - inserted
+    stats.seconds = time.perf_counter() - started
+    log.info(f"Imported collection {stats.as_dict()}")
+    return stats
+
+
+async def aexport_collection(*args, **kwargs) -> TransferStats:
+    return await asyncio.to_thread(export_collection, *args, **kwargs)
+
+
+async def aimport_collection(*args, **kwargs) -> TransferStats:
+    return await asyncio.to_thread(import_collection, *args, **kwargs)
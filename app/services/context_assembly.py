@@ -0,0 +1,150 @@
+"""
+Token-budgeted assembly of the {context} block of the RAG prompt.
+
+Token counts are computed once per chunk with tiktoken and cached in the
+chunk metadata (``token_count``) at ingestion time, so query-time packing is
+a sum over metadata instead of re-tokenizing every retrieved document.
+"""
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Sequence, Set, Tuple
+
+import tiktoken
+from langchain_core.documents import Document
+
+from appfrwk.logging_config import get_logger
+
+log = get_logger(__name__)
+
+TOKEN_COUNT_KEY = "token_count"
+DEFAULT_ENCODING = "cl100k_base"
+
+_WORD_RE = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = DEFAULT_ENCODING):
+    """
+    Load (once) the tiktoken encoding
+    """
+    return tiktoken.get_encoding(encoding_name)
+
+
+def count_tokens(text: str, encoding_name: str = DEFAULT_ENCODING) -> int:
+    """
+    Count the tokens of a text
+    """
+    return len(get_encoding(encoding_name).encode(text, disallowed_special=()))
+
+
+def document_tokens(document: Document, encoding_name: str = DEFAULT_ENCODING) -> int:
+    """
+    Token count of a document, read from its metadata when available
+    """
+    tokens = document.metadata.get(TOKEN_COUNT_KEY)
+    if tokens is None:
+        tokens = count_tokens(document.page_content, encoding_name)
+        document.metadata[TOKEN_COUNT_KEY] = tokens
+    return int(tokens)
+
+
+def annotate_token_counts(documents: List[Document], encoding_name: str = DEFAULT_ENCODING) -> List[Document]:
+    """
+    Store the token count of every document in its metadata before ingestion
+    """
+    for document in documents:
+        document_tokens(document, encoding_name)
+    return documents
+
+
+def _shingles(text: str, size: int = 3) -> Set[Tuple[str, ...]]:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+@dataclass
+class AssembledContext:
+    """
+    Result of packing retrieved documents into the token budget
+    """
+    documents: List[Document]
+    text: str
+    tokens_used: int
+    token_budget: int
+    dropped: int = 0
+    duplicates: int = 0
+    scores: List[float] = field(default_factory=list)
+
+    def usage(self) -> Dict:
+        """
+        Token accounting reported with each response
+        """
+        return {
+            "context_tokens": self.tokens_used,
+            "token_budget": self.token_budget,
+            "documents": len(self.documents),
+            "dropped": self.dropped,
+            "duplicates": self.duplicates,
+        }
+
+
+class ContextAssembler:
+    """
+    Pack ranked documents greedily into a token budget.
+
+    Candidates are expected best-first.  A candidate is skipped when most of
+    its text is already covered by a selected document (e.g. a RAPTOR summary
+    that repeats a leaf chunk), or when it does not fit in the remaining
+    budget; smaller, lower ranked candidates may still fill the gap.
+    """
+
+    def __init__(self, token_budget: int, encoding_name: str = DEFAULT_ENCODING,
+                 dedup_threshold: float = 0.8, separator: str = "\n\n"):
+        self.token_budget = token_budget
+        self.encoding_name = encoding_name
+        self.dedup_threshold = dedup_threshold
+        self.separator = separator
+        self._separator_tokens = count_tokens(separator, encoding_name) if separator else 0
+
+    def _is_duplicate(self, shingles: Set, selected: List[Set]) -> bool:
+        if not shingles:
+            return True
+        for other in selected:
+            if len(shingles & other) / len(shingles) >= self.dedup_threshold:
+                return True
+        return False
+
+    def assemble(self, ranked: Sequence[Tuple[Document, float]]) -> AssembledContext:
+        """
+        Select documents for the prompt and build the context text
+        """
+        documents, scores, selected_shingles = [], [], []
+        tokens_used = dropped = duplicates = 0
+        for document, score in ranked:
+            shingles = _shingles(document.page_content)
+            if self._is_duplicate(shingles, selected_shingles):
+                duplicates += 1
+                continue
+            cost = document_tokens(document, self.encoding_name) + (self._separator_tokens if documents else 0)
+            if tokens_used + cost > self.token_budget:
+                dropped += 1
+                continue
+            documents.append(document)
+            scores.append(score)
+            selected_shingles.append(shingles)
+            tokens_used += cost
+
+        context = AssembledContext(
+            documents=documents,
+            text=self.separator.join(doc.page_content for doc in documents),
+            tokens_used=tokens_used,
+            token_budget=self.token_budget,
+            dropped=dropped,
+            duplicates=duplicates,
+            scores=scores,
+        )
+        log.debug(f"Assembled context {context.usage()}")
+        return context
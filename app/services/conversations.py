@@ -0,0 +1,131 @@
+"""
+Queries on the conversation database that RagLLM's crud module does not
+provide. Tables are described with lightweight table() constructs matching
+the alembic migrations, so no ORM models are needed.
+"""
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import column, select, table
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from appfrwk.logging_config import get_logger
+from appfrwk.metrics import record_cache
+
+log = get_logger(__name__)
+
+users = table("users", column("id"), column("sub"), column("created_at"), column("modified_at"))
+conversations = table("conversations", column("id"), column("user_sub"), column("created_at"), column("modified_at"))
+messages = table(
+    "messages",
+    column("id"), column("conversation_id"), column("user_message"), column("agent_message"),
+    column("created_at"), column("modified_at"),
+)
+
+
+def naive_utc(value: datetime) -> datetime:
+    """
+    created_at is stored as naive UTC
+    """
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def upsert(session: AsyncSession, target):
+    """
+    INSERT of the session's dialect, which supports ON CONFLICT
+    (PostgreSQL in production, SQLite for local runs)
+    """
+    dialect = postgresql if session.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(target)
+
+
+async def get_messages_after(session: AsyncSession, conversation_id: str, after: datetime) -> List[Dict]:
+    """
+    Messages of a conversation created after ``after``, oldest first
+    """
+    after = naive_utc(after)
+    query = (select(messages)
+             .where(messages.c.conversation_id == conversation_id, messages.c.created_at > after)
+             .order_by(messages.c.created_at))
+    return [dict(row) for row in (await session.execute(query)).mappings()]
+
+
+class KnownUsers:
+    """
+    LRU of user subs known to exist, so their next conversations skip the user upsert
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._subs: "OrderedDict[str, None]" = OrderedDict()
+
+    def __contains__(self, sub: str) -> bool:
+        known = sub in self._subs
+        if known:
+            self._subs.move_to_end(sub)
+        record_cache("known_users", hits=int(known), misses=int(not known))
+        return known
+
+    def add(self, sub: str):
+        self._subs[sub] = None
+        self._subs.move_to_end(sub)
+        while len(self._subs) > self.max_size:
+            self._subs.popitem(last=False)
+
+    def discard(self, sub: str):
+        self._subs.pop(sub, None)
+
+
+async def create_conversation(session: AsyncSession, user_sub: str, initial_messages: Sequence[Dict] = (),
+                              known_users: Optional[KnownUsers] = None) -> Dict:
+    """
+    Create a conversation, its user when the sub is new and its initial
+    (user_message, agent_message) messages in one transaction.
+
+    The user is created with INSERT ... ON CONFLICT DO NOTHING, so
+    concurrent first requests of a sub cannot fail on users.sub.
+    """
+    cached = known_users is not None and user_sub in known_users
+    try:
+        return await _create_conversation(session, user_sub, initial_messages, skip_user=cached,
+                                          known_users=known_users)
+    except IntegrityError:
+        if not cached:
+            raise
+        # The cached user was deleted since, create it again
+        await session.rollback()
+        known_users.discard(user_sub)
+        return await _create_conversation(session, user_sub, initial_messages, skip_user=False,
+                                          known_users=known_users)
+
+
+async def _create_conversation(session: AsyncSession, user_sub: str, initial_messages: Sequence[Dict],
+                               skip_user: bool, known_users: Optional[KnownUsers]) -> Dict:
+    now = datetime.utcnow()
+    if not skip_user:
+        created = (await session.execute(
+            upsert(session, users)
+            .values(id=str(uuid.uuid4()), sub=user_sub, created_at=now, modified_at=now)
+            .on_conflict_do_nothing(index_elements=["sub"])
+            .returning(users.c.sub))).scalar()
+        if created is not None:
+            log.info("Created user on first conversation")
+    conversation = {"id": str(uuid.uuid4()), "user_sub": user_sub, "created_at": now, "modified_at": now}
+    await session.execute(conversations.insert().values(**conversation))
+    # Spaced by a microsecond so created_at keeps their order
+    rows = [{"id": str(uuid.uuid4()), "conversation_id": conversation["id"],
+             "user_message": message["user_message"], "agent_message": message["agent_message"],
+             "created_at": now + timedelta(microseconds=index), "modified_at": now}
+            for index, message in enumerate(initial_messages)]
+    if rows:
+        await session.execute(messages.insert().values(rows))
+    await session.commit()
+    if known_users is not None:
+        known_users.add(user_sub)
+    return dict(conversation, messages=rows)
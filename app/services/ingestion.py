@@ -0,0 +1,158 @@
+"""
+Streaming ingestion of a RAPTOR tree into the vector store.
+
+The summarizer runs in a worker thread and hands its output over level by
+level: leaf chunks are embedded and stored as soon as they are produced, so
+a document is searchable long before its upper summary levels are done,
+and each summary level is flushed when it completes.
+
+Summarizers that expose ``iter_levels()`` (a generator of each level's
+documents) stream; others are run to completion and their ``run()`` output
+is stored level by level. Documents travel in batches through a bounded
+queue to a few writer tasks, so a slow store holds the summarizer back
+instead of letting finished batches pile up in memory.
+
+Each level is annotated in the summarizer thread with the node metadata of
+app.services.raptor_nodes (ids, token counts, offsets, children), and the
+node ids are used as the store ids.
+
+When a writer fails or the request is cancelled the error is raised right
+away: the summarizer thread stops before its next batch (a ``run()``-only
+summarizer finishes its tree first, off the request), and the documents
+of every batch handed to a writer are deleted by a background task
+tracked by the worker's WorkTracker.
+"""
+import asyncio
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from langchain_core.documents import Document
+
+from app.services.raptor_nodes import TreeAnnotator
+from appfrwk.logging_config import get_logger
+from appfrwk.metrics import INGESTION_DOCUMENTS, PHASE_DURATION, time_phase
+from appfrwk.server import get_work_tracker
+
+log = get_logger(__name__)
+
+
+@dataclass
+class IngestionResult:
+    """
+    Ids written by an ingestion and when the first of them became searchable
+    """
+    ids: List[str] = field(default_factory=list)
+    batches: int = 0
+    first_write_s: Optional[float] = None
+    seconds: float = 0.0
+
+
+def iter_levels(summarizer) -> Iterator[List[Document]]:
+    """
+    Documents of each RAPTOR level, leaves first
+    """
+    if hasattr(summarizer, "iter_levels"):
+        yield from summarizer.iter_levels()
+        return
+    levels: Dict[int, List[Document]] = {}
+    for document in summarizer.run():
+        levels.setdefault(document.metadata.get("level", 0), []).append(document)
+    for level in sorted(levels):
+        yield levels.pop(level)
+
+
+def batched(documents: Iterable[Document], size: int) -> Iterator[List[Document]]:
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def astream_ingest(summarizer, vector_store, route: str, source: str, batch_size: int = 64,
+                         queue_size: int = 4, writers: int = 2, encoding_name: str = "cl100k_base",
+                         document_name: Optional[str] = None) -> IngestionResult:
+    """
+    Run the summarizer and store its documents as they are produced.
+    ``document_name`` is the source of nodes the summarizer gives none.
+    When anything fails the documents of the batches sent to the store are
+    deleted again in the background, so a retried upload does not
+    duplicate them.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    result = IngestionResult()
+    # Node ids are the store ids, so a batch a cancelled writer may have stored is known before it is written
+    sent: List[str] = []
+    started = time.perf_counter()
+
+    def put(item):
+        # Checked per item, so at most the item in flight is queued after a failure empties the queue
+        if not stop.is_set():
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def produce():
+        annotator = TreeAnnotator(document_name, encoding_name)
+        for level in iter_levels(summarizer):
+            for batch in batched(annotator.annotate(level), batch_size):
+                if stop.is_set():
+                    return
+                put(batch)
+        for _ in range(writers):
+            put(None)
+
+    async def write():
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                return
+            ids = [document.metadata["id"] for document in batch]
+            sent.extend(ids)
+            ids = await vector_store.aadd_documents(batch, ids=ids)
+            result.ids.extend(ids)
+            result.batches += 1
+            INGESTION_DOCUMENTS.inc(len(ids), source=source)
+            if result.first_write_s is None:
+                result.first_write_s = time.perf_counter() - started
+                PHASE_DURATION.observe(result.first_write_s, route=route, phase="first_write")
+
+    with time_phase(route, "ingest"):
+        producer = asyncio.ensure_future(asyncio.to_thread(produce))
+        tasks = [asyncio.ensure_future(write()) for _ in range(writers)]
+        try:
+            await asyncio.gather(producer, *tasks)
+        except BaseException:
+            stop.set()
+            for task in tasks:
+                task.cancel()
+            # Room for a producer blocked on the full queue, it stops before its next batch
+            while not queue.empty():
+                queue.get_nowait()
+            # The summarizer thread cannot be interrupted and its outcome no longer matters
+            producer.add_done_callback(lambda future: future.cancelled() or future.exception())
+            get_work_tracker().spawn(_discard(vector_store, sent, tasks), "ingestion_cleanup")
+            raise
+    result.seconds = time.perf_counter() - started
+    log.info(f"Ingested {len(result.ids)} documents in {result.batches} batches, "
+             f"first searchable after {result.first_write_s or 0:.2f}s, done after {result.seconds:.2f}s")
+    return result
+
+
+async def _discard(vector_store, ids: List[str], writers: List[asyncio.Task]):
+    """
+    Delete the documents of a failed ingestion once its writers have stopped
+    """
+    await asyncio.gather(*writers, return_exceptions=True)
+    if not ids:
+        return
+    try:
+        await vector_store.adelete(ids)
+        log.info(f"Deleted the {len(ids)} documents of the failed ingestion")
+    except Exception as e:
+        log.error(f"Could not delete the {len(ids)} documents of the failed ingestion: {str(e)}")
@@ -0,0 +1,598 @@
+"""
+Shared LLM gateway: every chat model call goes through one policy.
+
+- a deadline for the whole call (all attempts, hedges and fallbacks)
+- retries with exponential backoff and jitter, limited by a retry budget
+  so retries cannot multiply load during an outage
+- optional hedging: when an async attempt has not answered after
+  ``hedge_after`` seconds a second identical request is sent and the first
+  answer wins
+- a circuit breaker per provider that skips a failing provider for a while
+- ordered fallback models, e.g. ``openai:gpt-4`` then ``anthropic:claude-3-haiku-20240307``
+
+``GatewayChatModel`` exposes the gateway as a LangChain chat model, so it can
+be used anywhere a ChatOpenAI instance was used before, and
+``route_through_gateway`` swaps it into chains and agents built elsewhere. Each gateway model
+serves one pipeline stage and records the latency and token usage of its
+calls per stage and model (LLM_STAGE_STATS). Results, the first chunk of a
+stream and errors are labelled with the provider and model that produced
+them (``gateway_provider`` / ``gateway_model``), so successes and failures
+of a fallback model land in the same series.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+from app.services.tool_cache import copy_model
+from appfrwk.config import get_config
+from appfrwk.logging_config import get_logger
+from appfrwk.metrics import LLM_BREAKER_STATE, LLM_CALLS, LLM_RETRIES, LLM_STAGE_DURATION, LLM_STAGE_TOKENS
+
+log = get_logger(__name__)
+stage_log = get_logger("llm_stages")
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+RETRYABLE_ERRORS = {"APITimeoutError", "APIConnectionError", "RateLimitError", "InternalServerError",
+                    "ServiceUnavailableError", "OverloadedError", "ReadTimeout", "ConnectTimeout"}
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class AllModelsFailed(RuntimeError):
+    pass
+
+
+def parse_model_spec(spec: str) -> Tuple[str, str]:
+    """
+    ``"anthropic:claude-3-haiku-20240307"`` -> ("anthropic", "claude-3-haiku-20240307"),
+    a bare model name is an OpenAI model
+    """
+    provider, _, model = spec.partition(":")
+    return (provider, model) if model else ("openai", provider)
+
+
+def model_name(model: BaseChatModel) -> str:
+    return getattr(model, "model_name", None) or getattr(model, "model", None) or type(model).__name__
+
+
+def gateway_labels(provider: str, model: BaseChatModel) -> Dict[str, str]:
+    return {"gateway_provider": provider, "gateway_model": model_name(model)}
+
+
+def label_error(error: BaseException, provider: str, model: BaseChatModel) -> BaseException:
+    """
+    Mark an error with the provider and model that raised it, unless already marked
+    """
+    if not hasattr(error, "gateway_provider"):
+        try:
+            for key, value in gateway_labels(provider, model).items():
+                setattr(error, key, value)
+        except AttributeError:
+            pass
+    return error
+
+
+def token_usage(result: ChatResult) -> Tuple[int, int]:
+    """
+    (prompt, completion) tokens of a result, from the message usage metadata
+    or the provider specific llm_output
+    """
+    for generation in result.generations:
+        usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+        if usage:
+            return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    llm_output = result.llm_output or {}
+    usage = llm_output.get("token_usage") or llm_output.get("usage") or {}
+    return (usage.get("prompt_tokens", usage.get("input_tokens", 0)) or 0,
+            usage.get("completion_tokens", usage.get("output_tokens", 0)) or 0)
+
+
+def record_stage(stage: str, seconds: float, result: Optional[ChatResult] = None,
+                 error: Optional[BaseException] = None, model: str = ""):
+    """
+    Count latency and tokens of one gateway call for its stage, and append
+    it to the llm_stages log when LLM_STAGE_STATS is on
+    """
+    prompt_tokens = completion_tokens = 0
+    labels = {}
+    if result is not None:
+        prompt_tokens, completion_tokens = token_usage(result)
+        labels = result.llm_output or {}
+    elif error is not None:
+        labels = {key: getattr(error, key) for key in ("gateway_provider", "gateway_model") if hasattr(error, key)}
+    provider = labels.get("gateway_provider", "")
+    model = labels.get("gateway_model", model)
+    LLM_STAGE_DURATION.observe(seconds, stage=stage, model=model)
+    if prompt_tokens:
+        LLM_STAGE_TOKENS.inc(prompt_tokens, stage=stage, model=model, kind="prompt")
+    if completion_tokens:
+        LLM_STAGE_TOKENS.inc(completion_tokens, stage=stage, model=model, kind="completion")
+    if get_config().LLM_STAGE_STATS:
+        stage_log.info("llm_stage", extra={"stats": {
+            "time": time.time(), "stage": stage, "provider": provider, "model": model,
+            "latency_s": round(seconds, 4), "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "status": "error" if error is not None else "success",
+            "error": type(error).__name__ if error is not None else None,
+        }})
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status in RETRYABLE_STATUS:
+        return True
+    return type(error).__name__ in RETRYABLE_ERRORS
+
+
+class CircuitBreaker:
+    """
+    Opens when at least ``failure_ratio`` of the last ``window`` calls failed
+    (with at least ``failure_threshold`` failures, and not before ``window``
+    calls were seen so a burst of early errors does not trip it), then lets a
+    single trial call through every ``reset_timeout`` seconds until one succeeds
+    """
+    CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 failure_ratio: float = 0.5, window: int = 20):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failure_ratio = failure_ratio
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self._outcomes: Deque[bool] = deque(maxlen=max(window, failure_threshold))
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Also re-arms a half open breaker whose trial call never reported back
+                self.opened_at = time.monotonic()
+                self._set(self.HALF_OPEN)
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                log.info(f"Circuit for {self.name} closed")
+                self._outcomes.clear()
+                self._set(self.CLOSED)
+            self._outcomes.append(True)
+
+    def record_failure(self):
+        with self._lock:
+            self._outcomes.append(False)
+            failures = self._outcomes.count(False)
+            full = len(self._outcomes) == self._outcomes.maxlen
+            if self.state == self.HALF_OPEN or (
+                    full and failures >= self.failure_threshold and failures >= self.failure_ratio * len(self._outcomes)):
+                if self.state != self.OPEN:
+                    log.warning(f"Circuit for {self.name} opened after {failures} failures")
+                self.opened_at = time.monotonic()
+                self._set(self.OPEN)
+
+    def _set(self, state: int):
+        self.state = state
+        LLM_BREAKER_STATE.set(state, provider=self.name)
+
+
+class RetryBudget:
+    """
+    Every call deposits ``ratio`` tokens and every retry or hedge spends one,
+    so extra attempts stay below ``ratio`` of the traffic (plus a small reserve)
+    """
+
+    def __init__(self, ratio: float = 0.2, reserve: float = 10.0):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.tokens = reserve
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.tokens + self.ratio, self.reserve + 100 * self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+@lru_cache()
+def get_breaker(provider: str) -> CircuitBreaker:
+    config = get_config()
+    return CircuitBreaker(provider, config.LLM_BREAKER_FAILURES, config.LLM_BREAKER_RESET,
+                          config.LLM_BREAKER_FAILURE_RATIO)
+
+
+@lru_cache()
+def get_retry_budget() -> RetryBudget:
+    return RetryBudget(get_config().LLM_RETRY_BUDGET_RATIO)
+
+
+def build_chat_model(spec: str, temperature: Optional[float] = None, max_tokens: Optional[int] = None,
+                     timeout: Optional[float] = None) -> BaseChatModel:
+    """
+    Build the provider client for a model spec. Provider SDK retries are
+    disabled, the gateway retries instead.
+    """
+    config = get_config()
+    provider, model = parse_model_spec(spec)
+    temperature = config.SERVICE_TEMPERATURE if temperature is None else temperature
+    max_tokens = config.SERVICE_MAX_TOKENS if max_tokens is None else max_tokens
+    timeout = config.LLM_TIMEOUT if timeout is None else timeout
+    if provider == "openai":
+        from langchain_openai import ChatOpenAI
+
+        kwargs = {"openai_api_base": config.OPENAI_BASE_URL} if config.OPENAI_BASE_URL else {}
+        return ChatOpenAI(model_name=model, temperature=temperature, max_tokens=max_tokens,
+                          openai_api_key=config.OPENAI_API_KEY, request_timeout=timeout, max_retries=0, **kwargs)
+    if provider == "anthropic":
+        from langchain_anthropic import ChatAnthropic
+
+        kwargs = {"anthropic_api_url": config.ANTHROPIC_BASE_URL} if config.ANTHROPIC_BASE_URL else {}
+        return ChatAnthropic(model_name=model, temperature=temperature, max_tokens=max_tokens,
+                             anthropic_api_key=config.anthropic_api_key, default_request_timeout=timeout,
+                             max_retries=0, **kwargs)
+    raise ValueError(f"Unknown LLM provider {provider!r} in {spec!r}")
+
+
+class LLMGateway:
+    """
+    Calls an ordered list of (provider, model) pairs under the gateway policy
+    """
+
+    def __init__(self, models: Sequence[Tuple[str, BaseChatModel]], deadline: float = 60.0,
+                 max_attempts: int = 3, backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 hedge_after: Optional[float] = None, retry_budget: Optional[RetryBudget] = None,
+                 breakers: Optional[Dict[str, CircuitBreaker]] = None):
+        if not models:
+            raise ValueError("LLMGateway needs at least one model")
+        self.models = list(models)
+        self.deadline = deadline
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.retry_budget = retry_budget or RetryBudget()
+        self.breakers = breakers if breakers is not None else {}
+
+    def breaker(self, provider: str) -> CircuitBreaker:
+        breaker = self.breakers.get(provider)
+        if breaker is None:
+            breaker = self.breakers[provider] = get_breaker(provider)
+        return breaker
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _candidates(self):
+        for provider, model in self.models:
+            if self.breaker(provider).allow():
+                yield provider, model
+            else:
+                LLM_CALLS.inc(provider=provider, outcome="circuit_open")
+
+    def _failure(self, error_type, message: str, last_error: Optional[BaseException]) -> BaseException:
+        """
+        Gateway error labelled like the last failed attempt, or the first model when none was made
+        """
+        error = error_type(message)
+        if hasattr(last_error, "gateway_provider"):
+            error.gateway_provider, error.gateway_model = last_error.gateway_provider, last_error.gateway_model
+            return error
+        return label_error(error, *self.models[0])
+
+    @staticmethod
+    def _model_kwargs(model: BaseChatModel, kwargs: Dict) -> Dict:
+        """
+        Call kwargs for one model. Tools (e.g. OpenAI tool dicts bound by an
+        agent built for ChatOpenAI) are formatted by the model's own
+        bind_tools, so a fallback of another provider gets its own format.
+        """
+        if "tools" not in kwargs:
+            return kwargs
+        kwargs = dict(kwargs)
+        tools = kwargs.pop("tools")
+        try:
+            return {**kwargs, **model.bind_tools(tools).kwargs}
+        except NotImplementedError:
+            return {**kwargs, "tools": tools}
+
+    def _record(self, provider: str, error: Optional[BaseException]):
+        if error is None:
+            self.breaker(provider).record_success()
+            LLM_CALLS.inc(provider=provider, outcome="success")
+        else:
+            if is_retryable(error):
+                self.breaker(provider).record_failure()
+            LLM_CALLS.inc(provider=provider, outcome="error")
+
+    async def agenerate(self, messages, stop=None, **kwargs) -> ChatResult:
+        deadline = time.monotonic() + self.deadline
+        self.retry_budget.deposit()
+        last_error: Optional[BaseException] = None
+        for provider, model in self._candidates():
+            for attempt in range(self.max_attempts):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._failure(DeadlineExceeded, f"LLM call exceeded its {self.deadline}s deadline",
+                                        last_error) from last_error
+                try:
+                    result = await asyncio.wait_for(self._hedged(provider, model, messages, stop, kwargs), remaining)
+                    result.llm_output = {**(result.llm_output or {}), **gateway_labels(provider, model)}
+                    return result
+                except Exception as e:
+                    last_error = label_error(e, provider, model)
+                    if isinstance(e, asyncio.TimeoutError):
+                        # The attempt was cancelled at the deadline, count it against the provider
+                        self._record(provider, e)
+                    if not await self._wait_to_retry(provider, e, attempt, deadline):
+                        break
+            log.warning(f"Falling back from {provider} after {type(last_error).__name__}")
+        raise self._failure(AllModelsFailed, "No LLM provider could answer", last_error) from last_error
+
+    async def _wait_to_retry(self, provider: str, error: BaseException, attempt: int, deadline: float) -> bool:
+        """
+        Back off before retrying the same provider, False when the error should
+        move on to the next model instead
+        """
+        if not is_retryable(error) or self.breaker(provider).state == CircuitBreaker.OPEN:
+            return False
+        if attempt + 1 >= self.max_attempts:
+            return False
+        if not self.retry_budget.withdraw():
+            LLM_RETRIES.inc(provider=provider, outcome="budget_exhausted")
+            return False
+        LLM_RETRIES.inc(provider=provider, outcome="retry")
+        delay = self._backoff(attempt)
+        log.warning(f"LLM call to {provider} failed ({type(error).__name__}), retrying in {delay:.2f}s")
+        await asyncio.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+        return True
+
+    async def astream(self, messages, stop=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        """
+        Stream the answer of the first healthy model. Until the first chunk
+        arrives the call is retried and falls back like agenerate (without
+        hedging); once output has been sent an error is raised to the caller.
+        Models that cannot stream answer in a single chunk. The first chunk's
+        generation_info names the provider and model answering.
+        """
+        deadline = time.monotonic() + self.deadline
+        self.retry_budget.deposit()
+        last_error: Optional[BaseException] = None
+        for provider, model in self._candidates():
+            for attempt in range(self.max_attempts):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._failure(DeadlineExceeded, f"LLM call exceeded its {self.deadline}s deadline",
+                                        last_error) from last_error
+                stream = model._astream(messages, stop=stop, **self._model_kwargs(model, kwargs))
+                try:
+                    first = await asyncio.wait_for(stream.__anext__(), remaining)
+                except StopAsyncIteration:
+                    self._record(provider, None)
+                    return
+                except NotImplementedError:
+                    try:
+                        result = await asyncio.wait_for(self._attempt(provider, model, messages, stop, kwargs),
+                                                        remaining)
+                    except Exception as e:
+                        raise label_error(e, provider, model)
+                    yield ChatGenerationChunk(message=AIMessageChunk(content=result.generations[0].text),
+                                              generation_info=gateway_labels(provider, model))
+                    return
+                except Exception as e:
+                    last_error = label_error(e, provider, model)
+                    self._record(provider, e)
+                    if not await self._wait_to_retry(provider, e, attempt, deadline):
+                        break
+                    continue
+
+                yield ChatGenerationChunk(message=first.message,
+                                          generation_info={**(first.generation_info or {}),
+                                                           **gateway_labels(provider, model)})
+                try:
+                    async for chunk in stream:
+                        yield chunk
+                except Exception as e:
+                    self._record(provider, e)
+                    raise label_error(e, provider, model)
+                self._record(provider, None)
+                return
+            log.warning(f"Falling back from {provider} after {type(last_error).__name__}")
+        raise self._failure(AllModelsFailed, "No LLM provider could answer", last_error) from last_error
+
+    async def _attempt(self, provider: str, model: BaseChatModel, messages, stop, kwargs) -> ChatResult:
+        try:
+            result = await model._agenerate(messages, stop=stop, **self._model_kwargs(model, kwargs))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._record(provider, e)
+            raise
+        self._record(provider, None)
+        return result
+
+    async def _hedged(self, provider: str, model: BaseChatModel, messages, stop, kwargs) -> ChatResult:
+        primary = asyncio.ensure_future(self._attempt(provider, model, messages, stop, kwargs))
+        if self.hedge_after is None:
+            return await primary
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+            if not done and self.retry_budget.withdraw():
+                LLM_RETRIES.inc(provider=provider, outcome="hedge")
+                tasks.add(asyncio.ensure_future(self._attempt(provider, model, messages, stop, kwargs)))
+            pending, error = tasks, None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # The losing attempt (or both, when the deadline cancelled us) is abandoned
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def generate(self, messages, stop=None, **kwargs) -> ChatResult:
+        """
+        Blocking variant used by synchronous callers (e.g. the RAPTOR
+        summarizer); same policy without hedging
+        """
+        deadline = time.monotonic() + self.deadline
+        self.retry_budget.deposit()
+        last_error: Optional[BaseException] = None
+        for provider, model in self._candidates():
+            for attempt in range(self.max_attempts):
+                if deadline - time.monotonic() <= 0:
+                    raise self._failure(DeadlineExceeded, f"LLM call exceeded its {self.deadline}s deadline",
+                                        last_error) from last_error
+                try:
+                    result = model._generate(messages, stop=stop, **self._model_kwargs(model, kwargs))
+                except Exception as e:
+                    self._record(provider, e)
+                    last_error = label_error(e, provider, model)
+                    if not is_retryable(e) or self.breaker(provider).state == CircuitBreaker.OPEN:
+                        break
+                    if attempt + 1 < self.max_attempts:
+                        if not self.retry_budget.withdraw():
+                            LLM_RETRIES.inc(provider=provider, outcome="budget_exhausted")
+                            break
+                        LLM_RETRIES.inc(provider=provider, outcome="retry")
+                        time.sleep(min(self._backoff(attempt), max(deadline - time.monotonic(), 0)))
+                    continue
+                self._record(provider, None)
+                result.llm_output = {**(result.llm_output or {}), **gateway_labels(provider, model)}
+                return result
+            log.warning(f"Falling back from {provider} after {type(last_error).__name__}")
+        raise self._failure(AllModelsFailed, "No LLM provider could answer", last_error) from last_error
+
+
+class GatewayChatModel(BaseChatModel):
+    """
+    LangChain chat model backed by an LLMGateway, serving one pipeline stage
+    """
+    gateway: Any
+    model_names: List[str] = []
+    stage: str = "answer"
+
+    @property
+    def _llm_type(self) -> str:
+        return "llm_gateway"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"models": self.model_names}
+
+    @property
+    def _default_model(self) -> str:
+        # Label of calls the gateway could not attribute to a model
+        return model_name(self.gateway.models[0][1])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        started = time.perf_counter()
+        try:
+            result = self.gateway.generate(messages, stop=stop, **kwargs)
+        except Exception as e:
+            record_stage(self.stage, time.perf_counter() - started, error=e, model=self._default_model)
+            raise
+        record_stage(self.stage, time.perf_counter() - started, result)
+        return result
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        started = time.perf_counter()
+        try:
+            result = await self.gateway.agenerate(messages, stop=stop, **kwargs)
+        except Exception as e:
+            record_stage(self.stage, time.perf_counter() - started, error=e, model=self._default_model)
+            raise
+        record_stage(self.stage, time.perf_counter() - started, result)
+        return result
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        started = time.perf_counter()
+        # Chunks add up to the full message, whose usage metadata (when the provider sends it) counts the tokens
+        streamed: Optional[ChatGenerationChunk] = None
+        try:
+            async for chunk in self.gateway.astream(messages, stop=stop, **kwargs):
+                streamed = chunk if streamed is None else streamed + chunk
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+        except Exception as e:
+            record_stage(self.stage, time.perf_counter() - started, error=e, model=self._default_model)
+            raise
+        info = (streamed.generation_info or {}) if streamed is not None else {}
+        result = ChatResult(generations=[streamed] if streamed is not None else [],
+                            llm_output={key: info[key] for key in ("gateway_provider", "gateway_model") if key in info})
+        record_stage(self.stage, time.perf_counter() - started, result, model=self._default_model)
+
+    def bind_tools(self, tools, **kwargs):
+        """
+        Bind tools to every call; each provider model formats them with its own bind_tools
+        """
+        return self.bind(tools=list(tools), **kwargs)
+
+
+def route_through_gateway(value, model: GatewayChatModel) -> Tuple[Any, int]:
+    """
+    Copy of ``value`` (an agent, chain, tool binding or a list or dict of
+    them) with every provider chat model in it replaced by the gateway
+    ``model``, and the number of chat models replaced. Only the models and
+    the objects holding them are copied, ``value`` itself is left as is.
+    """
+    if isinstance(value, BaseChatModel):
+        return (value, 0) if isinstance(value, GatewayChatModel) else (model, 1)
+    if isinstance(value, (list, tuple)):
+        routed = [route_through_gateway(item, model) for item in value]
+        replaced = sum(count for _, count in routed)
+        return (type(value)(item for item, _ in routed) if replaced else value), replaced
+    if isinstance(value, dict):
+        routed = {key: route_through_gateway(item, model) for key, item in value.items()}
+        replaced = sum(count for _, count in routed.values())
+        return ({key: item for key, (item, _) in routed.items()} if replaced else value), replaced
+    # pydantic v2 models, or the pydantic v1 models of langchain-core 0.1
+    fields = getattr(type(value), "model_fields", None) or getattr(type(value), "__fields__", None)
+    if not fields or isinstance(value, type):
+        return value, 0
+    update, replaced = {}, 0
+    for name in fields:
+        item, count = route_through_gateway(getattr(value, name, None), model)
+        if count:
+            update[name] = item
+            replaced += count
+    return (copy_model(value, **update) if update else value), replaced
+
+
+def create_gateway_model(specs: Sequence[str], temperature: Optional[float] = None,
+                         max_tokens: Optional[int] = None, stage: str = "answer") -> GatewayChatModel:
+    """
+    Gateway chat model for a stage trying ``specs`` in order, configured from Settings
+    """
+    config = get_config()
+    models = [(parse_model_spec(spec)[0], build_chat_model(spec, temperature, max_tokens)) for spec in specs]
+    gateway = LLMGateway(models, deadline=config.LLM_TIMEOUT, max_attempts=config.LLM_MAX_ATTEMPTS,
+                         backoff_base=config.LLM_BACKOFF_BASE, backoff_max=config.LLM_BACKOFF_MAX,
+                         hedge_after=config.LLM_HEDGE_AFTER, retry_budget=get_retry_budget())
+    return GatewayChatModel(gateway=gateway, model_names=list(specs), stage=stage)
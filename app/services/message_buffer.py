@@ -0,0 +1,190 @@
+"""
+Write-behind persistence of chat messages.
+
+With MESSAGE_WRITE_BEHIND a chat turn appends its message to a local SQLite
+database in WAL mode instead of awaiting a commit on the conversation
+database. A background task flushes the pending messages to the messages
+table in multi-row inserts, every MESSAGE_FLUSH_INTERVAL seconds or as soon
+as MESSAGE_FLUSH_BATCH are waiting, and the buffer is drained on shutdown.
+
+The buffer outlives the process: messages left by a crash are flushed at
+the next start. Workers of one host share the buffer file; the inserts
+skip ids already present, so a batch flushed twice (by two workers, or
+when the process stops between the insert and the buffer cleanup) is
+harmless. Reads of a conversation merge its pending messages, so clients
+see their own writes.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from app.services.conversations import messages, naive_utc, upsert
+from appfrwk.logging_config import get_logger
+from appfrwk.metrics import MESSAGE_BUFFER_PENDING, MESSAGES_FLUSHED
+
+log = get_logger(__name__)
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS pending_messages (seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL UNIQUE, "
+    "conversation_id TEXT NOT NULL, user_message TEXT NOT NULL, agent_message TEXT NOT NULL, created_at TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS pending_messages_conversation ON pending_messages (conversation_id)",
+)
+COLUMNS = "seq, id, conversation_id, user_message, agent_message, created_at"
+
+
+def _message(row: sqlite3.Row) -> Dict:
+    message = dict(row)
+    message.pop("seq")
+    message["created_at"] = datetime.fromisoformat(message["created_at"])
+    return message
+
+
+class MessageBuffer:
+    """
+    Durable local queue of chat messages flushed to the conversation
+    database by ``sessionmaker`` sessions
+    """
+
+    def __init__(self, path: str, sessionmaker: Callable, batch_size: int = 200, flush_interval: float = 0.5):
+        self.path = path
+        self.sessionmaker = sessionmaker
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._appended = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            # Survives a crash of the process; a power loss may lose the last appends
+            connection.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self._connection = connection
+        return self._connection
+
+    def _execute(self, sql: str, parameters=()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._connect().execute(sql, parameters).fetchall()
+
+    async def append(self, conversation_id: str, user_message: str, agent_message: str) -> Dict:
+        """
+        Buffer a message, returning it as it will be stored
+        """
+        message = {"id": str(uuid.uuid4()), "conversation_id": conversation_id, "user_message": user_message,
+                   "agent_message": agent_message, "created_at": datetime.utcnow()}  # created_at is naive UTC
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT INTO pending_messages (id, conversation_id, user_message, agent_message, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (message["id"], conversation_id, user_message, agent_message, message["created_at"].isoformat()))
+        self._appended += 1
+        if self._appended >= self.batch_size:
+            self._wake.set()
+        return message
+
+    async def pending(self, conversation_id: str, after: Optional[datetime] = None) -> List[Dict]:
+        """
+        Messages of a conversation not flushed yet, oldest first
+        """
+        rows = await asyncio.to_thread(
+            self._execute, f"SELECT {COLUMNS} FROM pending_messages WHERE conversation_id = ? ORDER BY seq",
+            (conversation_id,))
+        after = naive_utc(after) if after is not None else None
+        return [message for message in map(_message, rows) if after is None or message["created_at"] > after]
+
+    async def has_pending(self, conversation_id: str) -> bool:
+        rows = await asyncio.to_thread(
+            self._execute, "SELECT 1 FROM pending_messages WHERE conversation_id = ? LIMIT 1", (conversation_id,))
+        return bool(rows)
+
+    async def flush(self, conversation_id: Optional[str] = None) -> int:
+        """
+        Write pending messages (of one conversation, or all) to the database.
+        Returns the number of messages flushed.
+        """
+        query = f"SELECT {COLUMNS} FROM pending_messages"
+        parameters = ()
+        if conversation_id is not None:
+            query += " WHERE conversation_id = ?"
+            parameters = (conversation_id,)
+        query += f" ORDER BY seq LIMIT {int(self.batch_size)}"
+        flushed = 0
+        async with self._flush_lock:
+            self._appended = 0
+            while True:
+                rows = await asyncio.to_thread(self._execute, query, parameters)
+                if not rows:
+                    break
+                batch = [_message(row) for row in rows]
+                async with self.sessionmaker() as session:
+                    await session.execute(
+                        upsert(session, messages)
+                        .values([dict(message, modified_at=message["created_at"]) for message in batch])
+                        .on_conflict_do_nothing(index_elements=["id"]))
+                    await session.commit()
+                seqs = [row["seq"] for row in rows]
+                await asyncio.to_thread(
+                    self._execute, f"DELETE FROM pending_messages WHERE seq IN ({','.join('?' * len(seqs))})", seqs)
+                flushed += len(rows)
+                MESSAGES_FLUSHED.inc(len(rows), outcome="success")
+                if len(rows) < self.batch_size:
+                    break
+        if conversation_id is None:
+            MESSAGE_BUFFER_PENDING.set(await asyncio.to_thread(self.size))
+        return flushed
+
+    def size(self) -> int:
+        return self._execute("SELECT count(*) FROM pending_messages")[0][0]
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # Messages stay buffered and are retried on the next interval
+                MESSAGES_FLUSHED.inc(outcome="error")
+                log.error(f"Could not flush buffered messages: {str(e)}")
+
+    async def start(self):
+        """
+        Start flushing, beginning with what a previous process left
+        """
+        await asyncio.to_thread(self._connect)
+        self._task = asyncio.create_task(self._run())
+        log.info(f"Message write-behind started with {await asyncio.to_thread(self.size)} buffered messages")
+
+    async def stop(self, timeout: Optional[float] = None):
+        """
+        Stop the flush task and drain the buffer; what cannot be flushed in
+        time stays in the buffer for the next start
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            flushed = await asyncio.wait_for(self.flush(), timeout)
+            log.info(f"Message buffer drained, {flushed} messages flushed")
+        except Exception as e:
+            log.error(f"Message buffer not drained, {await asyncio.to_thread(self.size)} messages remain: {str(e)}")
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
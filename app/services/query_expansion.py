@@ -0,0 +1,214 @@
+"""
+Query expansion for retrieval.
+
+Vague questions retrieve poorly, so next to the question's own search the
+store is also searched with:
+
+- multi_query: alternative phrasings of the question written by the LLM
+- hyde: a hypothetical answer passage, whose embedding tends to sit closer
+  to the answering chunks than the question's (HyDE)
+
+All searches run concurrently and their rankings are merged with
+reciprocal rank fusion, which orders the candidates while they keep their
+relevance scores (the fusion score is in their ``fusion_score`` metadata). Expansions are memoized per question, and each mode
+has a latency budget covering its LLM call and searches: when the budget is
+spent the question's own results are used, and the late expansion still
+lands in the cache for the next time the question is asked.
+"""
+import asyncio
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from app.services.callbacks import request_callbacks
+from app.services.reranking import document_key
+from appfrwk.logging_config import get_logger
+from appfrwk.metrics import QUERY_EXPANSIONS, record_cache, time_phase
+
+log = get_logger(__name__)
+
+multi_query_template = """You are helping a search engine find documents that answer a question.
+Write {count} different versions of the question below, each on its own line, using other words and
+filling in what the question leaves implicit. Write only the questions, without numbering.
+
+Question: {question}"""
+
+hyde_template = """Write a short passage, as it could appear in a paper or documentation, that answers the
+question below. Write only the passage.
+
+Question: {question}"""
+
+_LIST_MARKER = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s*")
+
+
+class QueryExpander:
+    """
+    Generates the extra search queries of a question with an LLM.
+
+    Results are kept in an LRU per question. Concurrent requests for the
+    same question share one LLM call, which keeps running when a caller
+    stops waiting for it, so its result is cached for the next request.
+    """
+    name = "base"
+    template = ""
+
+    def __init__(self, llm, budget: Optional[float] = None, cache_size: int = 1024):
+        self.budget = budget
+        self.cache_size = cache_size
+        self.chain = ChatPromptTemplate.from_template(self.template) | llm | StrOutputParser()
+        self._cache: "OrderedDict[str, List[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    def inputs(self, question: str) -> Dict:
+        return {"question": question}
+
+    def parse(self, output: str, question: str) -> List[str]:
+        raise NotImplementedError
+
+    def _cache_get(self, question: str) -> Optional[List[str]]:
+        with self._lock:
+            queries = self._cache.get(question)
+            if queries is not None:
+                self._cache.move_to_end(question)
+            return queries
+
+    def _cache_put(self, question: str, queries: List[str]):
+        with self._lock:
+            self._cache[question] = queries
+            self._cache.move_to_end(question)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    async def _generate(self, question: str) -> List[str]:
+        output = await self.chain.ainvoke(self.inputs(question),
+                                          config={"callbacks": request_callbacks(f"expansion_{self.name}")})
+        return self.parse(output, question)
+
+    def _finished(self, question: str, future: asyncio.Future):
+        self._pending.pop(question, None)
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            log.warning(f"Query expansion {self.name} failed: {str(future.exception())}")
+            return
+        self._cache_put(question, future.result())
+
+    async def aexpand(self, question: str) -> List[str]:
+        """
+        Extra search queries for the question
+        """
+        question = question.strip()
+        queries = self._cache_get(question)
+        if queries is not None:
+            record_cache(f"expansion_{self.name}", hits=1)
+            return queries
+        record_cache(f"expansion_{self.name}", misses=1)
+        future = self._pending.get(question)
+        if future is None:
+            future = asyncio.ensure_future(self._generate(question))
+            self._pending[question] = future
+            future.add_done_callback(lambda done: self._finished(question, done))
+        return await asyncio.shield(future)
+
+
+class MultiQueryExpander(QueryExpander):
+    """
+    Alternative phrasings of the question
+    """
+    name = "multi_query"
+    template = multi_query_template
+
+    def __init__(self, llm, count: int = 3, budget: Optional[float] = None, cache_size: int = 1024):
+        super().__init__(llm, budget, cache_size)
+        self.count = count
+
+    def inputs(self, question: str) -> Dict:
+        return {"question": question, "count": self.count}
+
+    def parse(self, output: str, question: str) -> List[str]:
+        queries, seen = [], {question.lower()}
+        for line in output.splitlines():
+            query = _LIST_MARKER.sub("", line).strip()
+            if query and query.lower() not in seen:
+                seen.add(query.lower())
+                queries.append(query)
+        return queries[:self.count]
+
+
+class HyDEExpander(QueryExpander):
+    """
+    Hypothetical answer passage, searched in place of the question
+    """
+    name = "hyde"
+    template = hyde_template
+
+    def parse(self, output: str, question: str) -> List[str]:
+        passage = output.strip()
+        return [passage] if passage else []
+
+
+EXPANDERS = {expander.name: expander for expander in (MultiQueryExpander, HyDEExpander)}
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Tuple[Document, float]]],
+                           k: int = 60) -> List[Tuple[Document, float]]:
+    """
+    Merge rankings of (document, relevance score) pairs, best first: a
+    document's fusion score is the sum of 1 / (k + rank) over the rankings
+    it appears in. The pairs keep the document's best relevance score, the
+    fusion score goes to a copy of its metadata as ``fusion_score``.
+    """
+    fusion: Dict[str, float] = {}
+    relevance: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, (document, score) in enumerate(ranking, start=1):
+            key = document_key(document)
+            documents.setdefault(key, document)
+            fusion[key] = fusion.get(key, 0.0) + 1.0 / (k + rank)
+            relevance[key] = max(relevance.get(key, score), score)
+    fused = sorted(fusion, key=fusion.__getitem__, reverse=True)
+    return [(Document(page_content=documents[key].page_content,
+                      metadata={**documents[key].metadata, "fusion_score": fusion[key]}), relevance[key])
+            for key in fused]
+
+
+async def aexpanded_search(vector_store, question: str, k: int, expanders: Sequence[QueryExpander],
+                           rrf_k: int = 60, route: str = "retrieval") -> List[Tuple[Document, float]]:
+    """
+    Search the question and its expansions concurrently and fuse the rankings.
+    An expander that fails or exceeds its budget only drops its own rankings.
+    """
+    async def search(query: str) -> List[Tuple[Document, float]]:
+        return await vector_store.asimilarity_search_with_relevance_scores(query, k=k)
+
+    async def expanded(expander: QueryExpander) -> List[List[Tuple[Document, float]]]:
+        queries = await expander.aexpand(question)
+        return list(await asyncio.gather(*(search(query) for query in queries)))
+
+    async def within_budget(expander: QueryExpander) -> List[List[Tuple[Document, float]]]:
+        try:
+            with time_phase(route, f"expansion_{expander.name}"):
+                rankings = await asyncio.wait_for(expanded(expander), expander.budget)
+        except asyncio.TimeoutError:
+            QUERY_EXPANSIONS.inc(mode=expander.name, outcome="timeout")
+            log.info(f"Query expansion {expander.name} exceeded its {expander.budget}s budget")
+            return []
+        except Exception as e:
+            QUERY_EXPANSIONS.inc(mode=expander.name, outcome="error")
+            log.warning(f"Query expansion {expander.name} failed: {str(e)}")
+            return []
+        QUERY_EXPANSIONS.inc(mode=expander.name, outcome="used" if rankings else "empty")
+        return rankings
+
+    own, *expansions = await asyncio.gather(search(question), *(within_budget(expander) for expander in expanders))
+    rankings = [own] + [ranking for group in expansions for ranking in group]
+    if len(rankings) == 1:
+        return own
+    return reciprocal_rank_fusion(rankings, rrf_k)[:k]
@@ -0,0 +1,173 @@
+"""
+Retrieval-augmented generation pipelines: answers with their sources, and
+conversational answers that first rephrase the follow-up question.
+"""
+import time
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from app.services.callbacks import request_callbacks
+from app.services.context_assembly import ContextAssembler
+from app.services.query_expansion import QueryExpander, aexpanded_search
+from app.services.reranking import Reranker
+from appfrwk.logging_config import get_logger
+from appfrwk.metrics import PHASE_DURATION, time_phase
+
+log = get_logger(__name__)
+
+
+def format_documents(documents: List[Document]) -> str:
+    """
+    Join document contents into the {context} block of the prompt
+    """
+    return "\n\n".join(doc.page_content for doc in documents)
+
+
+def format_chat_history(chat_history) -> str:
+    """
+    Render chat history (a message history, messages or (human, ai) pairs)
+    into the {chat_history} block of the rephrase prompt
+    """
+    messages = getattr(chat_history, "messages", chat_history) or []
+    lines = []
+    for message in messages:
+        if isinstance(message, (tuple, list)):
+            lines.append(f"Human: {message[0]}\nAssistant: {message[1]}")
+        elif hasattr(message, "content"):
+            role = "Human" if getattr(message, "type", "") == "human" else "Assistant"
+            lines.append(f"{role}: {message.content}")
+        else:
+            lines.append(str(message))
+    return "\n".join(lines)
+
+
+class SourcedRAGPipeline:
+    """
+    Retrieve -> (optionally re-rank) -> pack into the token budget -> generate.
+
+    When a reranker is configured the store is over-fetched with fetch_k
+    candidates and only the best top_n are considered for the prompt.
+    With expanders, the question's expansions are searched too and the
+    rankings fused (see app.services.query_expansion).
+    """
+
+    def __init__(self, vector_store, llm, template: str, top_n: int = 4,
+                 fetch_k: Optional[int] = None, reranker: Optional[Reranker] = None,
+                 assembler: Optional[ContextAssembler] = None, name: str = "rag_chain_with_source",
+                 expanders: Sequence[QueryExpander] = (), rrf_k: int = 60):
+        self.name = name
+        self.vector_store = vector_store
+        self.reranker = reranker
+        self.expanders = list(expanders)
+        self.rrf_k = rrf_k
+        self.assembler = assembler
+        self.top_n = top_n
+        self.fetch_k = max(fetch_k or top_n, top_n)
+        self.chain = ChatPromptTemplate.from_template(template) | llm | StrOutputParser()
+
+    async def aretrieve(self, question: str) -> List[Tuple[Document, float]]:
+        """
+        Return the (document, score) pairs that will be used as context
+        """
+        k = self.fetch_k if self.reranker else self.top_n
+        with time_phase(self.name, "retrieval"):
+            if self.expanders:
+                candidates = await aexpanded_search(self.vector_store, question, k, self.expanders,
+                                                    self.rrf_k, route=self.name)
+            else:
+                candidates = await self.vector_store.asimilarity_search_with_relevance_scores(question, k=k)
+        if self.reranker:
+            with time_phase(self.name, "rerank"):
+                return await self.reranker.arerank(question, candidates, self.top_n)
+        return candidates[:self.top_n]
+
+    async def aprepare(self, question: str) -> Tuple[List[Document], str, Optional[Dict]]:
+        """
+        Retrieve and pack the context: (documents used, context text, token usage)
+        """
+        ranked = await self.aretrieve(question)
+        if self.assembler:
+            assembled = self.assembler.assemble(ranked)
+            usage = assembled.usage()
+            log.info(f"Context assembled {usage}")
+            return assembled.documents, assembled.text, usage
+        documents = [doc for doc, _ in ranked]
+        return documents, format_documents(documents), None
+
+    async def ainvoke(self, question: str) -> Dict:
+        """
+        Answer the question, returning the same shape as rag_chain_with_source
+        """
+        documents, context, usage = await self.aprepare(question)
+        with time_phase(self.name, "llm"):
+            answer = await self.chain.ainvoke({"context": context, "question": question},
+                                              config={"callbacks": request_callbacks(self.name)})
+        result = {
+            "question": question,
+            "context": [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in documents],
+            "answer": answer,
+        }
+        if usage is not None:
+            result["usage"] = usage
+        return result
+
+    async def astream(self, question: str) -> AsyncIterator[str]:
+        """
+        Answer the question, yielding the answer text as it is generated
+        """
+        _, context, _ = await self.aprepare(question)
+        started = time.perf_counter()
+        first = True
+        async for chunk in self.chain.astream({"context": context, "question": question},
+                                              config={"callbacks": request_callbacks(self.name)}):
+            if first:
+                PHASE_DURATION.observe(time.perf_counter() - started, route=self.name, phase="llm_first_token")
+                first = False
+            yield chunk
+        PHASE_DURATION.observe(time.perf_counter() - started, route=self.name, phase="llm")
+
+
+class ConversationalRAGPipeline:
+    """
+    Rephrase the follow-up question into a standalone question using the
+    chat history, then answer it with a SourcedRAGPipeline.
+
+    The rephrase is skipped when there is no history, unless
+    rephrase_empty_history is set.
+    """
+
+    def __init__(self, llm, condense_template: str, answer_pipeline: SourcedRAGPipeline,
+                 rephrase_empty_history: bool = False):
+        self.answer_pipeline = answer_pipeline
+        self.name = answer_pipeline.name
+        self.rephrase_empty_history = rephrase_empty_history
+        self.condense_chain = ChatPromptTemplate.from_template(condense_template) | llm | StrOutputParser()
+
+    async def arephrase(self, question: str, chat_history=None) -> str:
+        """
+        Standalone version of the follow-up question
+        """
+        history = format_chat_history(chat_history)
+        if not history and not self.rephrase_empty_history:
+            return question
+        with time_phase(self.name, "rephrase"):
+            return await self.condense_chain.ainvoke({"question": question, "chat_history": history},
+                                                     config={"callbacks": request_callbacks(self.name)})
+
+    async def ainvoke(self, question: str, chat_history=None) -> Dict:
+        standalone = await self.arephrase(question, chat_history)
+        result = await self.answer_pipeline.ainvoke(standalone.strip() or question)
+        result["question"] = question
+        result["standalone_question"] = standalone
+        return result
+
+    async def astream(self, question: str, chat_history=None) -> AsyncIterator[str]:
+        """
+        Rephrase, then yield the answer text as it is generated
+        """
+        standalone = await self.arephrase(question, chat_history)
+        async for chunk in self.answer_pipeline.astream(standalone.strip() or question):
+            yield chunk
@@ -0,0 +1,216 @@
+"""
+Metadata of the RAPTOR tree nodes, computed once at ingestion and stored
+with each vector, and the pgvector indexes and lookups built on it.
+
+Every node gets:
+
+- ``id``: the node id, also the store id of its row
+- ``level``: 0 for the chunks, n for the summaries of iteration n
+- ``source``: the document it comes from
+- ``token_count``: see app.services.context_assembly
+- ``char_start`` / ``char_end``: its span of the document text; a summary
+  spans its children
+- ``children`` (summaries): the ids of the nodes it summarizes
+- ``children_inferred`` (summaries): true when the summarizer did not
+  report the children and they were guessed, see below
+
+Levels are stored leaves first as soon as they are produced, so a node's
+parent does not exist yet when the node is written. Parents are found
+through the children lists instead, with an indexed containment lookup.
+When the summarizer does not report the children of its summaries, each
+node of a level is assigned to the summary of the next level sharing the
+most words with it. Those links, and the spans derived from them, are
+only a guess: the summaries are marked ``children_inferred`` and the tree
+lookups leave them out unless asked for.
+"""
+import re
+import uuid
+from typing import Dict, List, Optional, Set
+
+from langchain_core.documents import Document
+from sqlalchemy import bindparam, func, literal_column, select, text
+from sqlalchemy.engine import Engine
+
+from app.services.context_assembly import annotate_token_counts
+from app.services.vector_stores import collections, embeddings, get_sync_engine, is_partitioned
+from appfrwk.logging_config import get_logger
+
+log = get_logger(__name__)
+
+_WORD_RE = re.compile(r"\w+")
+
+# Expression indexes of the lookups below; expressions must match the queries exactly
+METADATA_INDEXES = {
+    "langchain_pg_embedding_node_id": "(collection_id, (cmetadata ->> 'id'))",
+    "langchain_pg_embedding_level": "(collection_id, ((cmetadata ->> 'level')::int))",
+    "langchain_pg_embedding_source": "(collection_id, (cmetadata ->> 'source'))",
+    "langchain_pg_embedding_children": "USING gin ((cmetadata::jsonb -> 'children') jsonb_path_ops)",
+}
+_NODE_ID = literal_column("(cmetadata ->> 'id')")
+_LEVEL = literal_column("((cmetadata ->> 'level')::int)")
+_SOURCE = literal_column("(cmetadata ->> 'source')")
+_TOKEN_COUNT = literal_column("((cmetadata ->> 'token_count')::int)")
+
+
+def _words(text: str) -> Set[str]:
+    return set(_WORD_RE.findall(text.lower()))
+
+
+class TreeAnnotator:
+    """
+    Annotates the levels of one document's tree as they are produced, the
+    first level given being the chunks. Only the ids, words and spans of the
+    previous level are kept.
+    """
+
+    def __init__(self, source: Optional[str] = None, encoding_name: str = "cl100k_base"):
+        self.source = source
+        self.encoding_name = encoding_name
+        self._previous: List[Dict] = []
+        self._offset = 0
+        self._level = 0
+
+    def annotate(self, documents: List[Document]) -> List[Document]:
+        leaves = not self._previous
+        for document in documents:
+            metadata = document.metadata
+            metadata.setdefault("id", str(uuid.uuid4()))
+            metadata.setdefault("level", self._level)
+            if self.source and not metadata.get("source"):
+                metadata["source"] = self.source
+        annotate_token_counts(documents, self.encoding_name)
+        if leaves:
+            self._annotate_leaves(documents)
+        else:
+            self._annotate_summaries(documents)
+        self._previous = [{"id": document.metadata["id"], "words": _words(document.page_content),
+                           "start": document.metadata.get("char_start"), "end": document.metadata.get("char_end")}
+                          for document in documents]
+        self._level += 1
+        return documents
+
+    def _annotate_leaves(self, documents: List[Document]):
+        # Splitters with add_start_index report the offset, otherwise the chunks are taken as consecutive
+        for document in documents:
+            start = document.metadata.get("start_index", self._offset)
+            document.metadata["char_start"] = start
+            document.metadata["char_end"] = start + len(document.page_content)
+            self._offset = document.metadata["char_end"]
+
+    def _annotate_summaries(self, documents: List[Document]):
+        children: Dict[int, List[Dict]] = {}
+        inferred = not any("children" in document.metadata for document in documents)
+        if inferred:
+            words = [_words(document.page_content) for document in documents]
+            for child in self._previous:
+                overlap = [len(child["words"] & summary) / (len(child["words"] | summary) or 1) for summary in words]
+                children.setdefault(max(range(len(documents)), key=overlap.__getitem__), []).append(child)
+        nodes = {child["id"]: child for child in self._previous}
+        for index, document in enumerate(documents):
+            metadata = document.metadata
+            if "children" in metadata:
+                members = [nodes[child] for child in metadata["children"] if child in nodes]
+            else:
+                members = children.get(index, [])
+                metadata["children"] = [child["id"] for child in members]
+                metadata["children_inferred"] = inferred
+            starts = [child["start"] for child in members if child["start"] is not None]
+            ends = [child["end"] for child in members if child["end"] is not None]
+            if starts and ends:
+                metadata["char_start"], metadata["char_end"] = min(starts), max(ends)
+
+
+def create_metadata_indexes(engine: Optional[Engine] = None) -> List[str]:
+    """
+    Create the expression indexes of the node lookups. Built concurrently
+    unless the embeddings table is partitioned (the indexes then cascade to
+    the partitions, holding a lock that blocks writes). Returns the indexes.
+    """
+    engine = engine or get_sync_engine()
+    with engine.connect() as connection:
+        concurrently = "" if is_partitioned(connection) else "CONCURRENTLY "
+        connection.rollback()
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        for name, definition in METADATA_INDEXES.items():
+            connection.execute(text(
+                f"CREATE INDEX {concurrently}IF NOT EXISTS {name} ON langchain_pg_embedding {definition}"))
+            log.info(f"Created index {name}")
+    return list(METADATA_INDEXES)
+
+
+def _collection_id(connection, collection_name: str):
+    collection_id = connection.scalar(select(collections.c.uuid).where(collections.c.name == collection_name))
+    if collection_id is None:
+        raise LookupError(f"Collection {collection_name} does not exist")
+    return collection_id
+
+
+def _node(row) -> Dict:
+    return {"id": row.cmetadata.get("id"), "document": row.document, "metadata": row.cmetadata}
+
+
+def get_nodes(collection_name: str, node_ids: List[str], engine: Optional[Engine] = None) -> List[Dict]:
+    """
+    Nodes by id, in the order given
+    """
+    engine = engine or get_sync_engine()
+    with engine.connect() as connection:
+        collection_id = _collection_id(connection, collection_name)
+        rows = connection.execute(
+            select(embeddings.c.document, embeddings.c.cmetadata)
+            .where(embeddings.c.collection_id == collection_id,
+                   _NODE_ID.in_(bindparam("node_ids", node_ids, expanding=True)))).all()
+    nodes = {node["id"]: node for node in map(_node, rows)}
+    return [nodes[node_id] for node_id in node_ids if node_id in nodes]
+
+
+def get_children(collection_name: str, node_id: str, include_inferred: bool = False,
+                 engine: Optional[Engine] = None) -> List[Dict]:
+    """
+    Nodes summarized by a node, none for a chunk or, unless include_inferred,
+    for a summary whose children were guessed
+    """
+    parent = get_nodes(collection_name, [node_id], engine)
+    if not parent:
+        raise LookupError(f"Node {node_id} does not exist")
+    metadata = parent[0]["metadata"]
+    if metadata.get("children_inferred") and not include_inferred:
+        return []
+    return get_nodes(collection_name, metadata.get("children", []), engine)
+
+
+def get_parent(collection_name: str, node_id: str, include_inferred: bool = False,
+               engine: Optional[Engine] = None) -> Optional[Dict]:
+    """
+    The summary whose children include the node, None for a root or, unless
+    include_inferred, when the summary's children were guessed
+    """
+    engine = engine or get_sync_engine()
+    with engine.connect() as connection:
+        collection_id = _collection_id(connection, collection_name)
+        query = (select(embeddings.c.document, embeddings.c.cmetadata)
+                 .where(embeddings.c.collection_id == collection_id,
+                        text("cmetadata::jsonb -> 'children' @> jsonb_build_array(CAST(:node_id AS text))")
+                        .bindparams(node_id=node_id))
+                 .limit(1))
+        if not include_inferred:
+            query = query.where(text("(cmetadata ->> 'children_inferred') IS DISTINCT FROM 'true'"))
+        row = connection.execute(query).first()
+    return _node(row) if row is not None else None
+
+
+def level_token_totals(collection_name: str, source: Optional[str] = None,
+                       engine: Optional[Engine] = None) -> Dict[int, Dict[str, int]]:
+    """
+    Nodes and tokens per level, of one source document or the whole
+    collection, summed from the stored token counts
+    """
+    engine = engine or get_sync_engine()
+    with engine.connect() as connection:
+        query = (select(_LEVEL.label("level"), func.count().label("nodes"), func.sum(_TOKEN_COUNT).label("tokens"))
+                 .select_from(embeddings)
+                 .where(embeddings.c.collection_id == _collection_id(connection, collection_name))
+                 .group_by(_LEVEL).order_by(_LEVEL))
+        if source is not None:
+            query = query.where(_SOURCE == bindparam("source", source))
+        return {row.level: {"nodes": row.nodes, "tokens": int(row.tokens or 0)} for row in connection.execute(query)}
@@ -0,0 +1,237 @@
+"""
+Re-ranking stage that sits between vector retrieval and generation.
+
+The vector store is asked for a large candidate set (e.g. 50 hits) and a
+scorer picks the few that are actually sent to the LLM.  Scorers are
+pluggable: a local cross-encoder for production, or the lexical scorer which
+has no dependencies and is deterministic (handy for tests and benchmarks).
+"""
+import asyncio
+import hashlib
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from appfrwk.logging_config import get_logger
+from appfrwk.metrics import record_cache
+
+log = get_logger(__name__)
+
+_WORD_RE = re.compile(r"\w+")
+
+
+class BaseScorer:
+    """
+    Scores (query, text) pairs, higher is more relevant
+    """
+    name = "base"
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        raise NotImplementedError
+
+
+class LexicalScorer(BaseScorer):
+    """
+    Dependency free scorer based on query term overlap.
+
+    Each text is scored on its own so scores are comparable across batches.
+    """
+    name = "lexical"
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        query_terms = set(_WORD_RE.findall(query.lower()))
+        if not query_terms:
+            return [0.0] * len(texts)
+        scores = []
+        for text in texts:
+            terms = _WORD_RE.findall(text.lower())
+            counts = Counter(terms)
+            matched = sum(math.log1p(counts[term]) for term in query_terms)
+            scores.append(matched / math.sqrt(len(terms) + 1))
+        return scores
+
+
+class CrossEncoderScorer(BaseScorer):
+    """
+    Local cross-encoder (sentence-transformers) running on CPU by default.
+
+    The model is loaded on first use so importing this module stays cheap.
+    """
+    name = "cross-encoder"
+
+    def __init__(self, model_name: str, device: str = "cpu", max_length: int = 512):
+        self.model_name = model_name
+        self.device = device
+        self.max_length = max_length
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._model is None:
+                try:
+                    from sentence_transformers import CrossEncoder
+                except ImportError as e:
+                    raise ImportError(
+                        "CrossEncoderScorer requires the 'sentence-transformers' package") from e
+                log.info(f"Loading cross-encoder model {self.model_name} on {self.device}")
+                self._model = CrossEncoder(
+                    self.model_name, device=self.device, max_length=self.max_length)
+        return self._model
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        model = self._model or self._load()
+        pairs = [(query, text) for text in texts]
+        return [float(s) for s in model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)]
+
+
+def build_scorer(name: str) -> BaseScorer:
+    """
+    Build a scorer from its configured name.
+
+    "lexical" selects the LexicalScorer, anything else is treated as a
+    cross-encoder model name (e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2").
+    """
+    if name == LexicalScorer.name:
+        return LexicalScorer()
+    return CrossEncoderScorer(name)
+
+
+def document_key(document: Document) -> str:
+    """
+    Stable identifier for a retrieved document, used as part of cache keys
+    """
+    doc_id = document.metadata.get("id") or document.metadata.get("custom_id")
+    if doc_id:
+        return str(doc_id)
+    return hashlib.sha1(document.page_content.encode("utf-8")).hexdigest()
+
+
+class Reranker:
+    """
+    Re-rank retrieval candidates with a scorer.
+
+    Candidates are scored in batches and scores are cached per (query,
+    document). The deadline bounds the whole scoring: batches are shrunk to
+    what the measured per-candidate latency says fits in the time left, and
+    in arerank a batch still running at the deadline is abandoned (its
+    scores are cached when it finishes). Candidates that could not be scored
+    in time keep their retrieval order behind the scored ones.
+    """
+
+    def __init__(self, scorer: BaseScorer, batch_size: int = 16, cache_size: int = 4096,
+                 deadline: Optional[float] = None):
+        self.scorer = scorer
+        self.batch_size = max(1, batch_size)
+        self.cache_size = cache_size
+        self.deadline = deadline
+        self._cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Moving average of the scoring time per candidate
+        self._item_seconds: Optional[float] = None
+
+    def _cache_get(self, key):
+        with self._lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+            return score
+
+    def _cache_put(self, key, score: float):
+        with self._lock:
+            self._cache[key] = score
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _lookup(self, query: str, candidates: Sequence[Tuple[Document, float]]):
+        keys = [(query, document_key(doc)) for doc, _ in candidates]
+        scores: List[Optional[float]] = [self._cache_get(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        record_cache("rerank", hits=len(candidates) - len(missing), misses=len(missing))
+        return keys, scores, missing
+
+    def _next_batch(self, missing: List[int], remaining: Optional[float]) -> List[int]:
+        """
+        The next candidates to score, as many as fit in the remaining time
+        """
+        size = self.batch_size
+        if remaining is not None and self._item_seconds:
+            size = max(1, min(size, int(remaining / self._item_seconds)))
+        return missing[:size]
+
+    def _score(self, query: str, texts: List[str], keys) -> List[float]:
+        started = time.monotonic()
+        batch_scores = self.scorer.score(query, texts)
+        per_item = (time.monotonic() - started) / max(len(texts), 1)
+        self._item_seconds = per_item if self._item_seconds is None else 0.8 * self._item_seconds + 0.2 * per_item
+        for key, score in zip(keys, batch_scores):
+            self._cache_put(key, score)
+        return batch_scores
+
+    def _remaining(self, started: float) -> Optional[float]:
+        return None if self.deadline is None else self.deadline - (time.monotonic() - started)
+
+    def _ranked(self, candidates, scores, top_n: int, started: float, timed_out: bool):
+        scored = sorted(
+            ((candidates[i][0], score) for i, score in enumerate(scores) if score is not None),
+            key=lambda item: item[1], reverse=True)
+        unscored = [candidates[i] for i, score in enumerate(scores) if score is None]
+
+        elapsed = (time.monotonic() - started) * 1000
+        log.debug(f"Re-ranked {len(candidates)} candidates in {elapsed:.2f}ms "
+                  f"unscored={len(unscored)} timed_out={timed_out}")
+        return (scored + unscored)[:top_n]
+
+    def rerank(self, query: str, candidates: Sequence[Tuple[Document, float]],
+               top_n: int) -> List[Tuple[Document, float]]:
+        """
+        Return the top_n candidates as (document, score) pairs, best first.
+        A batch started before the deadline runs to completion.
+        """
+        started = time.monotonic()
+        keys, scores, missing = self._lookup(query, candidates)
+        timed_out = False
+        while missing:
+            remaining = self._remaining(started)
+            if remaining is not None and remaining <= 0:
+                timed_out = True
+                break
+            batch = self._next_batch(missing, remaining)
+            missing = missing[len(batch):]
+            batch_scores = self._score(query, [candidates[i][0].page_content for i in batch], [keys[i] for i in batch])
+            for i, score in zip(batch, batch_scores):
+                scores[i] = score
+        return self._ranked(candidates, scores, top_n, started, timed_out)
+
+    async def arerank(self, query: str, candidates: Sequence[Tuple[Document, float]],
+                      top_n: int) -> List[Tuple[Document, float]]:
+        """
+        Async variant: batches are scored in a worker thread, and a batch
+        still running at the deadline is abandoned
+        """
+        started = time.monotonic()
+        keys, scores, missing = self._lookup(query, candidates)
+        timed_out = False
+        while missing:
+            remaining = self._remaining(started)
+            if remaining is not None and remaining <= 0:
+                timed_out = True
+                break
+            batch = self._next_batch(missing, remaining)
+            missing = missing[len(batch):]
+            scoring = asyncio.to_thread(self._score, query, [candidates[i][0].page_content for i in batch],
+                                        [keys[i] for i in batch])
+            try:
+                batch_scores = await asyncio.wait_for(scoring, remaining)
+            except asyncio.TimeoutError:
+                timed_out = True
+                break
+            for i, score in zip(batch, batch_scores):
+                scores[i] = score
+        return self._ranked(candidates, scores, top_n, started, timed_out)
@@ -0,0 +1,166 @@
+"""
+Cache of agent tool results.
+
+The agent of /RAG/agent_rag_chain_chat/ often calls the same retrieval tool
+with the same arguments, within a turn and across the turns of a
+conversation. Results are cached by tool name, normalized arguments and the
+version of the collection the tools search (bumped by ingestion, see
+app.services.vector_stores.bump_collection_version), either per
+conversation or in a global scope shared by every conversation, with a TTL
+per scope.
+
+Each request gets copies of the tools with their functions wrapped, so
+the schemas the agent sees are unchanged and the shared tool objects are
+never keyed with one request's conversation or collection version. Hits and misses are counted in
+cache_requests_total and added as events to the active trace span.
+"""
+import copy
+import functools
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from appfrwk.logging_config import get_logger
+from appfrwk.metrics import record_cache
+from appfrwk.tracing import current_span
+
+log = get_logger(__name__)
+
+SCOPES = ("conversation", "global")
+
+# Passed by LangChain to tools that ask for them, never part of the key
+_IGNORED_ARGUMENTS = {"callbacks", "run_manager", "config"}
+
+_MISSING = object()
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {str(key): _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def copy_model(model, **update):
+    """
+    Shallow copy of a pydantic v2 or v1 model (LangChain tools and executors) with fields replaced
+    """
+    if hasattr(model, "model_copy"):
+        return model.model_copy(update=update)
+    # pydantic v1's copy() leaves out the fields declared with exclude=True, such as Chain.callbacks
+    copied = copy.copy(model)
+    object.__setattr__(copied, "__dict__", {**model.__dict__, **update})
+    object.__setattr__(copied, "__fields_set__", model.__fields_set__ | set(update))
+    return copied
+
+
+def normalize_arguments(args: Sequence, kwargs: Dict) -> str:
+    """
+    Key of a tool call's arguments: whitespace collapsed, keyword order ignored
+    """
+    kwargs = {key: value for key, value in kwargs.items() if key not in _IGNORED_ARGUMENTS}
+    return json.dumps({"args": _normalize(list(args)), "kwargs": _normalize(kwargs)}, sort_keys=True, default=str)
+
+
+class ToolResultCache:
+    """
+    TTL and size bounded LRU of tool results, thread safe since the agent
+    runs sync tools in the threadpool
+    """
+
+    def __init__(self, ttls: Dict[str, float], max_entries: int = 10000):
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def wrap_tools(self, tools: Sequence, conversation_id: Optional[str], version: int,
+                   scopes: Optional[Dict[str, str]] = None, default_scope: str = "conversation") -> List:
+        """
+        Copies of the tools whose calls go through the cache, ``scopes``
+        giving the scope of each tool name. The tools given are left as they
+        are; those that cannot be cached are returned themselves.
+        """
+        scopes = scopes or {}
+        wrapped = []
+        for tool in tools:
+            scope = scopes.get(tool.name, default_scope)
+            if scope not in SCOPES:
+                raise ValueError(f"Unknown tool cache scope {scope}, expected one of {SCOPES}")
+            owner = conversation_id if scope == "conversation" else "*"
+            if owner is None or (getattr(tool, "func", None) is None and getattr(tool, "coroutine", None) is None):
+                log.debug(f"Tool {tool.name} is not cached")
+                wrapped.append(tool)
+                continue
+            prefix = (scope, owner, tool.name, version)
+            update = {}
+            if getattr(tool, "func", None) is not None:
+                update["func"] = self._cached(tool.func, prefix)
+            if getattr(tool, "coroutine", None) is not None:
+                update["coroutine"] = self._acached(tool.coroutine, prefix)
+            wrapped.append(copy_model(tool, **update))
+        return wrapped
+
+    def _lookup(self, prefix: Tuple, args, kwargs):
+        key = prefix + (normalize_arguments(args, kwargs),)
+        value = self.get(key)
+        _trace(prefix, value is not _MISSING)
+        return key, value
+
+    def _cached(self, func, prefix: Tuple):
+        @functools.wraps(func)
+        def cached(*args, **kwargs):
+            key, value = self._lookup(prefix, args, kwargs)
+            if value is _MISSING:
+                value = func(*args, **kwargs)
+                self.put(key, value, self.ttls.get(prefix[0], 0))
+            return value
+
+        return cached
+
+    def _acached(self, coroutine, prefix: Tuple):
+        @functools.wraps(coroutine)
+        async def cached(*args, **kwargs):
+            key, value = self._lookup(prefix, args, kwargs)
+            if value is _MISSING:
+                value = await coroutine(*args, **kwargs)
+                self.put(key, value, self.ttls.get(prefix[0], 0))
+            return value
+
+        return cached
+
+
+def _trace(prefix: Tuple, hit: bool):
+    scope, _, tool, version = prefix
+    record_cache("agent_tools", hits=int(hit), misses=int(not hit))
+    span = current_span()
+    if span is not None:
+        span.add_event("agent_tool.cache", {"tool": tool, "scope": scope, "hit": hit, "collection_version": version})
+    log.debug(f"Agent tool {tool} cache {'hit' if hit else 'miss'} ({scope} scope)")
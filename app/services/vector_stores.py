@@ -0,0 +1,225 @@
+"""
+Per-collection vector stores.
+
+Each tenant or project can have its own pgvector collection, chosen per
+request (see app.api.dependencies.get_collection_name). A bounded LRU keeps
+the handles (store and pipelines) of the most recently used collections;
+every store shares the DATABASE_URL2 engine, so the number of collections
+does not multiply connections.
+
+The embeddings of all collections live in one table, filtered by
+collection_id. ``partition_embeddings`` optionally turns it into a table
+LIST-partitioned by collection, so a search scans only its tenant's rows
+and per-collection indexes stay small; new collections then get their own
+partition when their handle is first built.
+"""
+import hashlib
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import JSON, column, select, table, text
+from sqlalchemy.engine import Connection, Engine
+
+from appfrwk.config import get_config
+from appfrwk.database import get_database
+from appfrwk.logging_config import get_logger
+from appfrwk.metrics import VECTOR_STORE_HANDLES, record_cache
+
+log = get_logger(__name__)
+
+# Tables of the LangChain PGVector schema used by the store
+collections = table("langchain_pg_collection", column("uuid"), column("name"), column("cmetadata", JSON))
+embeddings = table("langchain_pg_embedding", column("uuid"), column("collection_id"), column("embedding"),
+                   column("document"), column("cmetadata", JSON), column("custom_id"))
+
+COLLECTION_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,62}$")
+
+
+def get_sync_engine(url: Optional[str] = None) -> Engine:
+    """
+    Shared sync engine on the vector database (DATABASE_URL2), switching an
+    async driver to psycopg2 for maintenance that needs the DBAPI connection
+    """
+    return get_database().get_engine(url or get_config().DATABASE_URL2, asynchronous=False)
+
+
+# Bumped when this worker writes to a collection, so results cached for the old content are not served;
+# caches on other workers only see the change once their entries expire
+_versions: Dict[str, int] = {}
+
+
+def collection_version(name: str) -> int:
+    return _versions.get(name, 0)
+
+
+def bump_collection_version(name: str):
+    _versions[name] = _versions.get(name, 0) + 1
+
+
+def is_valid_collection_name(name: str) -> bool:
+    return bool(COLLECTION_NAME.match(name))
+
+
+def tenant_collection_name(sub: str, prefix: str = "tenant_") -> str:
+    """
+    Collection of a user, e.g. ``auth0|65f1c2`` -> ``tenant_auth0_65f1c2``;
+    long subjects are hashed
+    """
+    name = re.sub(r"[^a-z0-9]+", "_", sub.lower()).strip("_")
+    if not name or len(prefix) + len(name) > 48:
+        name = hashlib.sha1(sub.encode()).hexdigest()[:20]
+    return f"{prefix}{name}"
+
+
+@dataclass
+class CollectionHandle:
+    """
+    Vector store of one collection and the pipelines built on it
+    """
+    name: str
+    vector_store: Any
+    source_pipeline: Any
+    chat_pipeline: Any
+
+
+class VectorStoreRegistry:
+    """
+    Bounded LRU of collection handles built by ``factory(name)``.
+    Thread safe; concurrent first uses of a collection build it once.
+    """
+
+    def __init__(self, factory: Callable[[str], CollectionHandle], max_size: int = 64):
+        self.factory = factory
+        self.max_size = max_size
+        self._handles: "OrderedDict[str, CollectionHandle]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_locks: Dict[str, threading.Lock] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._handles
+
+    def __len__(self) -> int:
+        return len(self._handles)
+
+    def get(self, name: str) -> CollectionHandle:
+        with self._lock:
+            handle = self._handles.get(name)
+            if handle is not None:
+                self._handles.move_to_end(name)
+                record_cache("vector_stores", hits=1)
+                return handle
+            build_lock = self._build_locks.setdefault(name, threading.Lock())
+        with build_lock:
+            handle = self._handles.get(name)
+            if handle is None:
+                record_cache("vector_stores", misses=1)
+                handle = self.factory(name)
+                with self._lock:
+                    self._handles[name] = handle
+                    while len(self._handles) > self.max_size:
+                        evicted, _ = self._handles.popitem(last=False)
+                        log.info(f"Evicted vector store of collection {evicted}")
+                    self._build_locks.pop(name, None)
+                    VECTOR_STORE_HANDLES.set(len(self._handles))
+        return handle
+
+
+def is_partitioned(connection: Connection) -> bool:
+    return bool(connection.scalar(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = 'langchain_pg_embedding'")))
+
+
+def partition_table_name(collection_id: str) -> str:
+    return f"langchain_pg_embedding_p_{uuid.UUID(str(collection_id)).hex}"
+
+
+def create_partition(connection: Connection, collection_id: str):
+    connection.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition_table_name(collection_id)} PARTITION OF langchain_pg_embedding "
+        f"FOR VALUES IN ('{uuid.UUID(str(collection_id))}')"))
+
+
+def ensure_partition(collection_name: str, engine: Optional[Engine] = None) -> bool:
+    """
+    Give a collection its own partition when the embeddings table is
+    partitioned. Returns False when it is not partitioned.
+    """
+    engine = engine or get_sync_engine()
+    with engine.begin() as connection:
+        if not is_partitioned(connection):
+            return False
+        collection_id = connection.scalar(select(collections.c.uuid).where(collections.c.name == collection_name))
+        if collection_id is None:
+            raise LookupError(f"Collection {collection_name} does not exist")
+        create_partition(connection, collection_id)
+    return True
+
+
+def _partitioned_indexes(connection: Connection) -> List[str]:
+    """
+    CREATE INDEX statements recreating the indexes of the renamed table
+    (vector, metadata, custom_id) on the partitioned one. The primary key is
+    replaced separately; other unique indexes without the partition column
+    cannot be unique on a partitioned table and become plain indexes.
+    """
+    rows = connection.execute(text(
+        "SELECT pg_get_indexdef(i.indexrelid) AS definition, i.indisunique AS is_unique, "
+        "EXISTS (SELECT 1 FROM pg_attribute a WHERE a.attrelid = i.indrelid AND a.attname = 'collection_id' "
+        "AND a.attnum = ANY (i.indkey)) AS has_collection "
+        "FROM pg_index i WHERE i.indrelid = 'langchain_pg_embedding_unpartitioned'::regclass AND NOT i.indisprimary"))
+    statements = []
+    for row in rows:
+        statement = re.sub(r" ON (ONLY )?(\S+\.)?langchain_pg_embedding_unpartitioned ", " ON langchain_pg_embedding ",
+                           row.definition)
+        if row.is_unique and not row.has_collection:
+            log.warning(f"Index recreated without its unique constraint: {statement}")
+            statement = statement.replace("CREATE UNIQUE INDEX", "CREATE INDEX", 1)
+        statements.append(statement)
+    return statements
+
+
+def partition_embeddings(engine: Optional[Engine] = None) -> List[str]:
+    """
+    One-time conversion of langchain_pg_embedding into a table LIST
+    partitioned by collection_id, with a partition per existing collection
+    and a default partition. Rows are copied in one transaction holding an
+    exclusive lock, so run it in a maintenance window. The primary key
+    becomes (collection_id, uuid), a partitioned table's keys must include
+    the partition column. The other indexes are recreated on the
+    partitioned table, so every partition (existing and future) gets its
+    own vector and metadata indexes. Returns the partitions created.
+    """
+    engine = engine or get_sync_engine()
+    with engine.begin() as connection:
+        if is_partitioned(connection):
+            log.info("langchain_pg_embedding is already partitioned")
+            return []
+        connection.execute(text("LOCK TABLE langchain_pg_embedding IN ACCESS EXCLUSIVE MODE"))
+        connection.execute(text("ALTER TABLE langchain_pg_embedding RENAME TO langchain_pg_embedding_unpartitioned"))
+        indexes = _partitioned_indexes(connection)
+        connection.execute(text(
+            "CREATE TABLE langchain_pg_embedding (LIKE langchain_pg_embedding_unpartitioned INCLUDING DEFAULTS) "
+            "PARTITION BY LIST (collection_id)"))
+        connection.execute(text("ALTER TABLE langchain_pg_embedding ADD PRIMARY KEY (collection_id, uuid)"))
+        connection.execute(text(
+            "ALTER TABLE langchain_pg_embedding ADD FOREIGN KEY (collection_id) "
+            "REFERENCES langchain_pg_collection (uuid) ON DELETE CASCADE"))
+        connection.execute(text(
+            "CREATE TABLE langchain_pg_embedding_default PARTITION OF langchain_pg_embedding DEFAULT"))
+        created = []
+        for collection_id in connection.scalars(select(collections.c.uuid)).all():
+            create_partition(connection, collection_id)
+            created.append(partition_table_name(collection_id))
+        connection.execute(text("INSERT INTO langchain_pg_embedding SELECT * FROM langchain_pg_embedding_unpartitioned"))
+        connection.execute(text("DROP TABLE langchain_pg_embedding_unpartitioned"))
+        # Built after the copy, once per partition; the names are free again now the old table is gone
+        for statement in indexes:
+            connection.execute(text(statement))
+    log.info(f"Partitioned langchain_pg_embedding into {len(created)} collection partitions, "
+             f"recreated {len(indexes)} indexes")
+    return created
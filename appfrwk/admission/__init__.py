@@ -0,0 +1,214 @@
+"""
+Admission control for LLM-bound routes.
+
+Requests take one of ADMISSION_CAPACITY slots shared by every LLM-bound
+route; a route can additionally be capped (ADMISSION_ROUTE_LIMITS) so that
+e.g. the agent or ingestion cannot take every slot. When no slot is free a
+request waits in a bounded queue where interactive chat goes before
+background ingestion; a full queue or a wait longer than ADMISSION_MAX_WAIT
+is rejected with 503 right away instead of piling up on the providers.
+Each user also has a token bucket, exceeding it returns 429. Users are
+told apart by the sub of their bearer token, anonymous requests by the
+client address.
+
+State is per worker process and only touched from the event loop thread.
+"""
+import asyncio
+import itertools
+import time
+from bisect import insort
+from collections import OrderedDict
+from contextlib import AsyncExitStack, asynccontextmanager
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from fastapi import Request
+from fastapi.security import HTTPAuthorizationCredentials, SecurityScopes
+
+from appfrwk.config import get_config
+from appfrwk.errors import RateLimitedException, ServiceOverloadedException
+from appfrwk.metrics import ADMISSION_ACTIVE, ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTED, ADMISSION_WAIT
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+
+class RateLimiter:
+    """
+    Token bucket per key: ``burst`` requests at once, refilled at ``rate`` per second
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # key -> [tokens, last refill time]
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def acquire(self, key: str, now: Optional[float] = None) -> float:
+        """
+        Take a token for key. Returns 0 when allowed, otherwise the seconds
+        until a token is available.
+        """
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / self.rate if self.rate > 0 else float("inf")
+
+
+class AdmissionController:
+    """
+    Shared concurrency slots with per-route caps and a bounded priority wait queue
+    """
+
+    def __init__(self, capacity: int, route_limits: Optional[Dict[str, int]] = None,
+                 max_queue: int = 100, max_wait: float = 10.0):
+        self.capacity = capacity
+        self.route_limits = dict(route_limits or {})
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self._route_active: Dict[str, int] = {}
+        # (priority, sequence, route, future), kept sorted so the first eligible waiter is found first
+        self._waiters: List = []
+        self._sequence = itertools.count()
+
+    def _has_room(self, route: str) -> bool:
+        limit = self.route_limits.get(route)
+        return self.active < self.capacity and (limit is None or self._route_active.get(route, 0) < limit)
+
+    def _take(self, route: str):
+        self.active += 1
+        self._route_active[route] = self._route_active.get(route, 0) + 1
+        ADMISSION_ACTIVE.inc(route=route)
+
+    async def acquire(self, route: str, priority: int = PRIORITY_INTERACTIVE) -> float:
+        """
+        Wait for a slot, returns the time waited. Raises ServiceOverloadedException
+        when the queue is full or the wait exceeds max_wait.
+        """
+        # Slots are handed to eligible waiters as soon as they free up, so a free
+        # slot here means nobody who could use it is waiting
+        if self._has_room(route):
+            self._take(route)
+            ADMISSION_WAIT.observe(0, route=route)
+            return 0.0
+        if len(self._waiters) >= self.max_queue:
+            ADMISSION_REJECTED.inc(route=route, reason="queue_full")
+            raise ServiceOverloadedException("Too many requests are waiting, try again later", self.max_wait)
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (priority, next(self._sequence), route, future)
+        insort(self._waiters, waiter, key=lambda item: item[:2])
+        ADMISSION_QUEUE_DEPTH.inc(route=route)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # The slot was granted while we gave up, hand it on
+                self.release(route)
+            else:
+                future.cancel()
+                self._waiters.remove(waiter)
+                ADMISSION_QUEUE_DEPTH.dec(route=route)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            ADMISSION_REJECTED.inc(route=route, reason="timeout")
+            raise ServiceOverloadedException("Timed out waiting for capacity, try again later", self.max_wait)
+        waited = time.perf_counter() - started
+        ADMISSION_WAIT.observe(waited, route=route)
+        return waited
+
+    def release(self, route: str):
+        """
+        Free a slot and hand free slots to the first eligible waiters
+        """
+        self.active -= 1
+        self._route_active[route] -= 1
+        ADMISSION_ACTIVE.dec(route=route)
+        index = 0
+        while index < len(self._waiters) and self.active < self.capacity:
+            waiter = self._waiters[index]
+            if self._has_room(waiter[2]):
+                self._waiters.pop(index)
+                ADMISSION_QUEUE_DEPTH.dec(route=waiter[2])
+                self._take(waiter[2])
+                waiter[3].set_result(True)
+            else:
+                index += 1
+
+    @asynccontextmanager
+    async def admit(self, route: str, priority: int = PRIORITY_INTERACTIVE):
+        await self.acquire(route, priority)
+        try:
+            yield
+        finally:
+            self.release(route)
+
+
+@lru_cache()
+def get_admission_controller() -> AdmissionController:
+    config = get_config()
+    return AdmissionController(config.ADMISSION_CAPACITY, config.ADMISSION_ROUTE_LIMITS,
+                               config.ADMISSION_MAX_QUEUE, config.ADMISSION_MAX_WAIT)
+
+
+@lru_cache()
+def get_rate_limiter() -> RateLimiter:
+    config = get_config()
+    return RateLimiter(config.RATE_LIMIT_PER_MINUTE / 60, config.RATE_LIMIT_BURST, config.RATE_LIMIT_MAX_USERS)
+
+
+async def request_identity(request: Request) -> str:
+    """
+    Key of the caller for rate limiting: the sub of the bearer token, which
+    must then be valid, or the client address of anonymous requests
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        from appfrwk.utils.verify_token import get_verify_token
+
+        result = await get_verify_token()(SecurityScopes(), HTTPAuthorizationCredentials(scheme=scheme,
+                                                                                         credentials=token))
+        return f"user:{result.sub}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def admission(route: str, priority: int = PRIORITY_INTERACTIVE):
+    """
+    Route dependency applying the user rate limit and holding an admission
+    slot for the request, e.g. ``dependencies=[Depends(admission("rag_chain_chat"))]``
+    """
+    async def dependency(request: Request):
+        async with AsyncExitStack() as stack:
+            await enter_admission(stack, request, route, priority)
+            yield
+
+    return dependency
+
+
+async def enter_admission(stack: AsyncExitStack, request: Request, route: str,
+                          priority: int = PRIORITY_INTERACTIVE):
+    """
+    Apply the user rate limit and take an admission slot released when the
+    stack closes. Streaming routes use this to hold the slot until the
+    response body is sent, a dependency is released before that.
+    """
+    if not get_config().ADMISSION_ENABLED:
+        return
+    retry_after = get_rate_limiter().acquire(await request_identity(request))
+    if retry_after:
+        ADMISSION_REJECTED.inc(route=route, reason="rate_limited")
+        raise RateLimitedException(retry_after)
+    await stack.enter_async_context(get_admission_controller().admit(route, priority))
@@ -1,7 +1,7 @@
 """FastAPI Configuration File"""
 import os
 import pathlib
-from typing import List, Tuple, Union, Dict
+from typing import List, Optional, Tuple, Union, Dict
 # from appfrwk.config.agents_conf import AgentsConfig
 from functools import lru_cache
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -13,6 +13,15 @@ class Settings(BaseSettings):
     # Server Config
     HOST: str = "0.0.0.0"
     PORT: int = 8000
+    WORKERS: int = 1
+    LOOP: str = "auto"  # auto uses uvloop when it is installed
+    HTTP: str = "auto"  # auto uses httptools when it is installed
+    TIMEOUT_KEEP_ALIVE: int = 5
+    TIMEOUT_GRACEFUL_SHUTDOWN: int = 30
+    LIMIT_CONCURRENCY: Optional[int] = None
+    LIMIT_MAX_REQUESTS: Optional[int] = None
+    BACKLOG: int = 2048
+    PRELOAD: bool = True
 
     # App Details
     APP_NAME: str = "FastAPI_Boilerplate"
@@ -25,6 +34,11 @@ class Settings(BaseSettings):
     AUTH0_API_AUDIENCE: str
     AUTH0_ISSUER: str
     AUTH0_ALGORITHMS: str
+    AUTH0_JWKS_URL: Optional[str] = None
+    JWKS_REFRESH_INTERVAL: int = 3600
+    JWKS_MIN_REFRESH_INTERVAL: int = 30
+    JWKS_FETCH_TIMEOUT: float = 5.0
+    TOKEN_CACHE_SIZE: int = 1024
 
     # Debug config
     DEBUG: bool = False
@@ -34,6 +48,29 @@ class Settings(BaseSettings):
     APP_ROOT_DIRECTORY: str = os.getcwd()
     LOG_DIRECTORY: str = os.path.join(APP_ROOT_DIRECTORY, "logs")
     PLUGINS_DIRECTORY: str = os.path.join("appfrwk.plugins")
+
+    # Logging config (queue based logging keeps file I/O off the event loop)
+    LOG_ASYNC: bool = True
+    LOG_QUEUE_SIZE: int = 10000
+    LOG_QUEUE_DROP_POLICY: str = "drop_new"
+    LOG_BATCH_SIZE: int = 64
+    LOG_FLUSH_INTERVAL: float = 1.0
+    LANGCHAIN_DEBUG: bool = False
+
+    # Metrics config (served from /metrics)
+    METRICS_ENABLED: bool = True
+
+    # Tracing config (OTLP/JSON spans written to TRACING_FILE or posted to TRACING_OTLP_ENDPOINT)
+    TRACING_ENABLED: bool = False
+    TRACING_EXPORTER: str = "file"
+    TRACING_SAMPLE_RATIO: float = 0.1
+    TRACING_SERVICE_NAME: Optional[str] = None
+    TRACING_FILE: Optional[str] = None  # defaults to LOG_DIRECTORY/traces.jsonl
+    TRACING_OTLP_ENDPOINT: str = "http://localhost:4318/v1/traces"
+    TRACING_QUEUE_SIZE: int = 2048
+    TRACING_BATCH_SIZE: int = 256
+    TRACING_EXPORT_INTERVAL: float = 2.0
+
     OPENAI_API_KEY: str
     SERVICE_MODEL: str = os.getenv("SERVICE_MODEL", "gpt-4")
     SERVICE_TEMPERATURE: float = os.getenv("SERVICE_TEMPERATURE", 0.5)
@@ -41,12 +78,122 @@ class Settings(BaseSettings):
     SERVICE_FREQUENCY_PENALTY: float = os.getenv(
         "SERVICE_FREQUENCY_PENALTY", 0.5)
     SERVICE_PRESENCE_PENALTY: float = os.getenv("SERVICE_PRESENCE_PENALTY", 0)
+
+    # Model routing per pipeline stage (answer, rephrase, expansion, summary, agent), stages not listed use SERVICE_MODEL
+    LLM_STAGE_MODELS: Dict[str, str] = {"rephrase": "gpt-3.5-turbo", "expansion": "gpt-3.5-turbo",
+                                        "summary": "anthropic:claude-3-haiku-20240307"}
+    LLM_STAGE_MAX_TOKENS: Dict[str, int] = {"rephrase": 256, "expansion": 256}
+    REPHRASE_EMPTY_HISTORY: bool = False  # the first message of a conversation is already standalone
+    LLM_STAGE_STATS: bool = True  # per-call stage, model, tokens and latency in LOG_DIRECTORY/llm_stages.log
+
+    # LLM gateway config (models are "provider:model", a bare name is an OpenAI model)
+    LLM_FALLBACK_MODELS: List[str] = []
+    LLM_TIMEOUT: float = 60.0  # deadline of a whole call including retries and fallbacks
+    LLM_MAX_ATTEMPTS: int = 3
+    LLM_BACKOFF_BASE: float = 0.5
+    LLM_BACKOFF_MAX: float = 8.0
+    LLM_RETRY_BUDGET_RATIO: float = 0.2
+    LLM_HEDGE_AFTER: Optional[float] = None  # seconds before a hedged request is sent, None disables hedging
+    LLM_BREAKER_FAILURES: int = 5
+    LLM_BREAKER_FAILURE_RATIO: float = 0.5  # of the last 20 calls, with at least LLM_BREAKER_FAILURES failures
+    LLM_BREAKER_RESET: float = 30.0
+    OPENAI_BASE_URL: Optional[str] = None
+    ANTHROPIC_BASE_URL: Optional[str] = None
+
     # Database config
     DATABASE_URL: str
     DATABASE_URL2: str
     collection_name: str
     anthropic_api_key:str
 
+    # Database pool config (engines are shared by URLs on the same server and driver)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_WARMUP: int = 2
+
+    KNOWN_USERS_CACHE_SIZE: int = 10000  # user subs known to exist, their conversations skip the user upsert
+
+    # Write-behind of chat messages: turns are appended to a local SQLite WAL buffer (shared by the workers
+    # of a host) and flushed to the messages table in batches of MESSAGE_FLUSH_BATCH rows, at least every
+    # MESSAGE_FLUSH_INTERVAL seconds
+    MESSAGE_WRITE_BEHIND: bool = False
+    MESSAGE_BUFFER_PATH: str = os.path.join(APP_ROOT_DIRECTORY, "buffers", "messages.sqlite3")
+    MESSAGE_FLUSH_BATCH: int = 200
+    MESSAGE_FLUSH_INTERVAL: float = 0.5
+
+    # Admission control for LLM-bound routes, per worker process
+    # (ADMISSION_CAPACITY slots shared by all routes, optional per-route caps, token buckets per bearer
+    # token sub, or per client address for anonymous requests)
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_CAPACITY: int = 32
+    ADMISSION_ROUTE_LIMITS: Dict[str, int] = {"agent_rag_chain_chat": 8, "ingestion": 2}
+    ADMISSION_MAX_QUEUE: int = 100
+    ADMISSION_MAX_WAIT: float = 10.0
+    RATE_LIMIT_PER_MINUTE: float = 30.0
+    RATE_LIMIT_BURST: int = 10
+    RATE_LIMIT_MAX_USERS: int = 10000
+
+    # Agent route: caps on the agent loop, and the tool result cache (AGENT_TOOL_CACHE_SCOPES maps tool
+    # names to the "conversation" or "global" scope, other tools use the conversation scope; TTLs in seconds)
+    AGENT_MAX_ITERATIONS: int = 6
+    AGENT_MAX_EXECUTION_TIME: float = 90.0
+    AGENT_TOOL_CACHE_ENABLED: bool = True
+    AGENT_TOOL_CACHE_TTL: Dict[str, float] = {"conversation": 1800.0, "global": 300.0}
+    AGENT_TOOL_CACHE_SCOPES: Dict[str, str] = {}
+    AGENT_TOOL_CACHE_SIZE: int = 10000
+
+    # Vector store collections: COLLECTION_ROUTING "single" serves collection_name, "parameter" takes a
+    # collection query parameter or X-Collection header naming collection_name or one of COLLECTION_ALLOWED,
+    # "user" gives each bearer token sub its own COLLECTION_PREFIX collection
+    COLLECTION_ROUTING: str = "single"
+    COLLECTION_PREFIX: str = "tenant_"
+    COLLECTION_ALLOWED: List[str] = []
+    VECTOR_STORE_CACHE_SIZE: int = 64
+    VECTOR_PARTITIONING: bool = False  # new collections get a partition (python -m app.cli partition-embeddings)
+
+    # Admin API (/admin, needs a token with ADMIN_SCOPE) and collection export/import
+    ADMIN_API_ENABLED: bool = False
+    ADMIN_SCOPE: str = "admin"
+    EXPORT_DIRECTORY: str = os.path.join(APP_ROOT_DIRECTORY, "exports")
+    TRANSFER_BATCH_SIZE: int = 5000
+    TRANSFER_SHARD_ROWS: int = 100000
+
+    # RAPTOR ingestion config (benchmarks/raptor_eval.py compares settings)
+    RAPTOR_TOKEN_LIMIT: int = 16000
+    # Documents are stored in INGESTION_BATCH_SIZE batches as the summarizer produces them, by
+    # INGESTION_WRITERS tasks; at most INGESTION_QUEUE_SIZE batches wait before the summarizer is held back
+    INGESTION_BATCH_SIZE: int = 64
+    INGESTION_QUEUE_SIZE: int = 4
+    INGESTION_WRITERS: int = 2
+
+    # Documents retrieved when re-ranking is off; 4 is the LangChain retriever default the chain used before
+    RETRIEVAL_K: int = 4
+    # Re-ranking config (retrieve RERANK_FETCH_K candidates, keep RERANK_TOP_N)
+    RERANK_ENABLED: bool = False
+    RERANK_MODEL: str = "lexical"
+    RERANK_FETCH_K: int = 50
+    RERANK_TOP_N: int = 5
+    RERANK_BATCH_SIZE: int = 16
+    RERANK_CACHE_SIZE: int = 4096
+    RERANK_DEADLINE_MS: int = 1500
+
+    # Query expansion config: QUERY_EXPANSION lists the modes ("multi_query" rewrites the question,
+    # "hyde" searches a hypothetical answer); their searches run next to the question's own and are
+    # fused with reciprocal rank fusion, each mode giving up after its QUERY_EXPANSION_BUDGET_MS
+    QUERY_EXPANSION: List[str] = []
+    QUERY_EXPANSION_QUERIES: int = 3
+    QUERY_EXPANSION_BUDGET_MS: Dict[str, int] = {"multi_query": 1500, "hyde": 2000}
+    QUERY_EXPANSION_CACHE_SIZE: int = 1024
+    RRF_K: int = 60
+
+    # Context assembly config (token budget of the {context} prompt block)
+    CONTEXT_TOKEN_BUDGET: int = 3000
+    CONTEXT_ENCODING: str = "cl100k_base"
+    CONTEXT_DEDUP_THRESHOLD: float = 0.8
+
 
 class ProductionConfig(Settings):
     pass
@@ -0,0 +1,241 @@
+"""
+Database engines, connection pools and sessions.
+
+Engines are created once per server, database and user and shared by every
+caller that connects there, whatever driver its URL names: async callers
+(the conversation DB) get the async engine and sync callers (the pgvector
+store, maintenance, COPY) the sync one, the URL being switched to the
+dialect's async or sync driver when needed. An async and a sync engine
+cannot share connections, so a database used both ways has two pools.
+Pool sizing, overflow, recycling and pre-ping come from Settings.
+"""
+import asyncio
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Union
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+
+from appfrwk.config import get_config
+from appfrwk.logging_config import get_logger
+from appfrwk.metrics import DB_POOL_CONNECTIONS, DB_POOL_EVENTS, REGISTRY
+
+log = get_logger(__name__)
+
+# Drivers that need an AsyncEngine
+ASYNC_DRIVERS = {"asyncpg", "aiosqlite", "aiomysql", "asyncmy", "psycopg_async"}
+# Driver a URL is switched to when an engine of the other kind is asked for
+ADAPTED_DRIVERS = {("postgresql", True): "asyncpg", ("postgresql", False): "psycopg2",
+                   ("sqlite", True): "aiosqlite", ("sqlite", False): "pysqlite"}
+
+
+def is_async_url(url: str) -> bool:
+    return make_url(url).get_driver_name() in ASYNC_DRIVERS
+
+
+def engine_key(url: str, asynchronous: Optional[bool] = None) -> Tuple:
+    """
+    Identify the server, database and user a URL connects to, and whether
+    the engine is async (by default as the URL's driver); the driver itself
+    is not part of the key
+    """
+    url = make_url(url)
+    asynchronous = is_async_url(url) if asynchronous is None else asynchronous
+    return (url.get_backend_name(), url.host or url.query.get("host"), url.port, url.database, url.username,
+            asynchronous)
+
+
+def adapt_url(url: str, asynchronous: bool) -> str:
+    """
+    The URL with the dialect's async or sync driver. Driver specific query
+    parameters are kept as they are.
+    """
+    url = make_url(url)
+    if is_async_url(url) != asynchronous:
+        driver = ADAPTED_DRIVERS.get((url.get_backend_name(), asynchronous))
+        if driver is None:
+            raise ValueError(f"No {'async' if asynchronous else 'sync'} driver known for {url.drivername}")
+        url = url.set(drivername=f"{url.get_backend_name()}+{driver}")
+    return url.render_as_string(hide_password=False)
+
+
+def pool_options(config=None) -> Dict:
+    """
+    Engine keyword arguments for the configured pool
+    """
+    config = config or get_config()
+    return {
+        "pool_size": config.DB_POOL_SIZE,
+        "max_overflow": config.DB_MAX_OVERFLOW,
+        "pool_timeout": config.DB_POOL_TIMEOUT,
+        "pool_recycle": config.DB_POOL_RECYCLE,
+        "pool_pre_ping": config.DB_POOL_PRE_PING,
+    }
+
+
+class Database:
+    """
+    Registry of shared engines and the session factories built on them
+    """
+
+    def __init__(self, engine_options: Optional[Dict] = None):
+        self.engine_options = engine_options if engine_options is not None else pool_options()
+        self._engines: Dict[Tuple, Union[Engine, AsyncEngine]] = {}
+        self._sessionmakers: Dict[Tuple, async_sessionmaker] = {}
+        self._lock = threading.Lock()
+
+    def get_engine(self, url: str, asynchronous: Optional[bool] = None) -> Union[Engine, AsyncEngine]:
+        """
+        Return the shared engine for a URL, creating it on first use. An
+        async or sync engine is returned as the URL's driver implies unless
+        ``asynchronous`` says otherwise.
+        """
+        key = engine_key(url, asynchronous)
+        engine = self._engines.get(key)
+        if engine is not None:
+            return engine
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is None:
+                factory = create_async_engine if key[-1] else create_engine
+                engine = factory(adapt_url(url, key[-1]), **self.engine_options)
+                self._watch_pool(engine)
+                self._engines[key] = engine
+                log.info(f"Created database engine {self.engine_name(engine)}")
+        return engine
+
+    def get_sessionmaker(self, url: str) -> async_sessionmaker:
+        key = engine_key(url, asynchronous=True)
+        sessionmaker = self._sessionmakers.get(key)
+        if sessionmaker is None:
+            engine = self.get_engine(url, asynchronous=True)
+            sessionmaker = self._sessionmakers.setdefault(
+                key, async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False))
+        return sessionmaker
+
+    @staticmethod
+    def engine_name(engine: Union[Engine, AsyncEngine]) -> str:
+        url = engine.url
+        server = f"{url.host}:{url.port}" if url.port else (url.host or "")
+        return f"{url.drivername}://{server}/{url.database or ''}"
+
+    def _watch_pool(self, engine: Union[Engine, AsyncEngine]):
+        """
+        Count connects, checkouts and invalidations (stale connections after a failover)
+        """
+        name = self.engine_name(engine)
+        sync_engine = engine.sync_engine if isinstance(engine, AsyncEngine) else engine
+        for event_name in ("connect", "checkout", "invalidate"):
+            event.listen(sync_engine, event_name,
+                         lambda *args, _event=event_name: DB_POOL_EVENTS.inc(engine=name, event=_event))
+
+    async def warm(self, connections: Optional[int] = None):
+        """
+        Open connections on every engine so the first requests do not pay for them
+        """
+        connections = get_config().DB_POOL_WARMUP if connections is None else connections
+        if connections <= 0:
+            return
+        connections = min(connections, self.engine_options.get("pool_size", connections))
+        await asyncio.gather(*(self._warm_engine(engine, connections) for engine in list(self._engines.values())))
+
+    async def _warm_engine(self, engine: Union[Engine, AsyncEngine], connections: int):
+        try:
+            if isinstance(engine, AsyncEngine):
+                opened = await asyncio.gather(*(engine.connect() for _ in range(connections)))
+                for connection in opened:
+                    await connection.close()
+            else:
+                await asyncio.to_thread(self._warm_sync_engine, engine, connections)
+            log.info(f"Warmed {connections} connections for {self.engine_name(engine)}")
+        except Exception as e:
+            log.warning(f"Could not warm the pool for {self.engine_name(engine)}: {e}")
+
+    @staticmethod
+    def _warm_sync_engine(engine: Engine, connections: int):
+        opened = [engine.connect() for _ in range(connections)]
+        for connection in opened:
+            connection.close()
+
+    async def ping(self, timeout: float = 2.0) -> Dict[str, bool]:
+        """
+        Run ``SELECT 1`` on every engine, used by the readiness check
+        """
+        async def check(engine):
+            try:
+                if isinstance(engine, AsyncEngine):
+                    async with engine.connect() as connection:
+                        await asyncio.wait_for(connection.execute(text("SELECT 1")), timeout)
+                else:
+                    await asyncio.wait_for(asyncio.to_thread(self._ping_sync_engine, engine), timeout)
+                return True
+            except Exception as e:
+                log.warning(f"Database {self.engine_name(engine)} is not reachable: {e}")
+                return False
+
+        engines = list(self._engines.values())
+        results = await asyncio.gather(*(check(engine) for engine in engines))
+        return {self.engine_name(engine): ok for engine, ok in zip(engines, results)}
+
+    @staticmethod
+    def _ping_sync_engine(engine: Engine):
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+
+    def pool_status(self) -> List[Dict]:
+        """
+        Current size and usage of every pool
+        """
+        status = []
+        for engine in list(self._engines.values()):
+            pool = engine.pool
+            if not hasattr(pool, "checkedout"):
+                continue
+            status.append({
+                "engine": self.engine_name(engine),
+                "size": pool.size(),
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                "overflow": max(pool.overflow(), 0),
+            })
+        return status
+
+    async def dispose(self):
+        """
+        Close every pooled connection
+        """
+        for engine in list(self._engines.values()):
+            if isinstance(engine, AsyncEngine):
+                await engine.dispose()
+            else:
+                engine.dispose()
+        self._engines.clear()
+        self._sessionmakers.clear()
+
+
+@lru_cache()
+def get_database() -> Database:
+    """
+    Shared engine registry
+    """
+    return Database()
+
+
+async def get_db():
+    """
+    FastAPI dependency yielding a session on the conversation database
+    """
+    async with get_database().get_sessionmaker(get_config().DATABASE_URL)() as session:
+        yield session
+
+
+@REGISTRY.on_collect
+def _collect_pool_status():
+    if get_database.cache_info().currsize == 0:
+        return
+    for status in get_database().pool_status():
+        engine = status.pop("engine")
+        for state, value in status.items():
+            DB_POOL_CONNECTIONS.set(value, engine=engine, state=state)
@@ -2,6 +2,8 @@
 Custom exceptions for the application
 """
 
+import math
+
 from fastapi import HTTPException, status
 
 class AppError(Exception):
@@ -26,4 +28,15 @@ class UnauthenticatedException(HTTPException):
     def __init__(self):
         super().__init__(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Requires authentication"
-        )
\ No newline at end of file
+        )
+class ServiceOverloadedException(HTTPException):
+    def __init__(self, detail: str, retry_after: float):
+        """Returns HTTP 503"""
+        super().__init__(status.HTTP_503_SERVICE_UNAVAILABLE, detail=detail,
+                         headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+class RateLimitedException(HTTPException):
+    def __init__(self, retry_after: float):
+        """Returns HTTP 429"""
+        super().__init__(status.HTTP_429_TOO_MANY_REQUESTS, detail="Rate limit exceeded",
+                         headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
@@ -1,13 +1,16 @@
 """
 Logging configuration for application
 """
+import atexit
 import logging
 import os
+import queue
 import sys
 import multiprocessing
 
 from logging.config import dictConfig
 from appfrwk.logging_config.log_formatters import JsonFormatter
+from appfrwk.logging_config.log_handlers import DroppingQueueHandler, RoutingQueueListener
 
 from appfrwk.config import get_config
 
@@ -20,11 +23,60 @@ DEUBG = config.DEBUG
 if not os.path.exists(LOG_DIR):
     os.makedirs(LOG_DIR)
 
+# Queue handler and listener used when LOG_ASYNC is enabled
+_queue_handler = None
+_queue_listener = None
+
 def setup_logging():
     """ 
     Setup logging configuration
     """
     dictConfig(LOGGING_CONFIG)
+    if config.LOG_ASYNC:
+        start_queue_logging()
+
+def start_queue_logging():
+    """
+    Move the configured handlers behind a bounded queue served by a background
+    thread, so formatting and file writes never run on the event loop thread
+    """
+    global _queue_handler, _queue_listener
+    stop_queue_logging()
+    log_queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+    _queue_handler = DroppingQueueHandler(log_queue, drop_policy=config.LOG_QUEUE_DROP_POLICY)
+    routes = {}
+    for name in LOGGING_CONFIG['loggers']:
+        logger = logging.getLogger(name)
+        routes[name] = (list(logger.handlers), logger.propagate)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        logger.addHandler(_queue_handler)
+    _queue_listener = RoutingQueueListener(log_queue, routes, flush_interval=config.LOG_FLUSH_INTERVAL)
+    _queue_listener.start()
+
+@atexit.register
+def stop_queue_logging():
+    """
+    Drain the log queue and stop the listener thread
+    """
+    global _queue_listener
+    if _queue_listener is not None:
+        _queue_listener.stop()
+        _queue_listener.flush()
+        _queue_listener = None
+
+def get_logging_stats():
+    """
+    Counters of the log queue (enqueued and dropped records, current depth)
+    """
+    if _queue_handler is None:
+        return {"enqueued": 0, "dropped": 0, "queue_size": 0, "queue_capacity": 0}
+    return {
+        "enqueued": _queue_handler.enqueued,
+        "dropped": _queue_handler.dropped,
+        "queue_size": _queue_handler.queue.qsize(),
+        "queue_capacity": _queue_handler.queue.maxsize,
+    }
 
 def get_logger(logger_name=APP_NAME, module_name=None):
     """
@@ -51,6 +103,23 @@ def get_multiprocessing_logger():
     logger.addHandler(logging.FileHandler(os.path.join(LOG_DIR, 'multiprocessing.log')))
     return logger
 
+def file_handler(formatter, filename):
+    """
+    Rotating file handler config, batched when logging through the queue
+    """
+    handler = {
+        'class': 'logging.handlers.RotatingFileHandler',
+        'formatter': formatter,
+        'filename': os.path.join(LOG_DIR, filename),
+        'maxBytes': 5000000,
+        'backupCount': 5,
+    }
+    if config.LOG_ASYNC:
+        handler['class'] = 'appfrwk.logging_config.log_handlers.BatchingRotatingFileHandler'
+        handler['batch_size'] = config.LOG_BATCH_SIZE
+        handler['flush_interval'] = config.LOG_FLUSH_INTERVAL
+    return handler
+
 # Define the logging configuration
 LOGGING_CONFIG = {
     'version': 1,
@@ -75,35 +144,14 @@ LOGGING_CONFIG = {
             'level': 'DEBUG',
         },
         # RotatingFileHandler allows for log rotation after a certain size
-        'file':{
-            'class': 'logging.handlers.RotatingFileHandler',
-            # for now, using standard formatter
-            'formatter': 'standard',
-            'filename': os.path.join(LOG_DIR, f'{APP_NAME}.log'),
-            'maxBytes': 5000000,
-            'backupCount': 5,
-        },
-        'request':{
-            'class': 'logging.handlers.RotatingFileHandler',
-            'formatter': 'json',
-            'filename': os.path.join(LOG_DIR, f'request.log'),
-            'maxBytes': 5000000,
-            'backupCount': 5,
-        }, # request_processing handler uses the same file as request
-        'request_processing':{
-            'class': 'logging.handlers.RotatingFileHandler',
-            'formatter': 'standard',
-            'filename': os.path.join(LOG_DIR, f'request_processing.log'),
-            'maxBytes': 5000000,
-            'backupCount': 5,
-        },
-        'multiprocessing':{
-            'class': 'logging.handlers.RotatingFileHandler',
-            'formatter': 'standard',
-            'filename': os.path.join(LOG_DIR, f'multiprocessing.log'),
-            'maxBytes': 5000000,
-            'backupCount': 5,
-        },
+        # for now, using standard formatter
+        'file': file_handler('standard', f'{APP_NAME}.log'),
+        'request': file_handler('json', 'request.log'),
+        # request_processing handler uses the same file as request
+        'request_processing': file_handler('standard', 'request_processing.log'),
+        'multiprocessing': file_handler('standard', 'multiprocessing.log'),
+        # one json line per LLM call (stage, model, tokens, latency) for offline comparison
+        'llm_stages': file_handler('json', 'llm_stages.log'),
     },
     # defining loggers
     'loggers': {
@@ -132,6 +180,12 @@ LOGGING_CONFIG = {
             'level': 'DEBUG',
             'propagate': False
         },
+        # LLM stage stats logger
+        'llm_stages': {
+            'handlers': ['llm_stages'],
+            'level': 'INFO',
+            'propagate': False
+        },
         # multiprocessing logger
         'multiprocessing': {
             'handlers': ['console', 'file'],
@@ -6,6 +6,9 @@ class JsonFormatter(Formatter):
     """
     Custom JSON formatter for logging requests and responses
     """
+    # request/response extras are encoded as nested objects in a single pass
+    _encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=str).encode
+
     def __init__(self):
         super(JsonFormatter, self).__init__()
     
@@ -13,13 +16,15 @@ class JsonFormatter(Formatter):
         """
         Format the log record
         """
-        json_record = {}
-        json_record["message"] = record.getMessage()
-        if "request" in record.__dict__:
-            json_record["request"] = json.dumps(record.__dict__["request"])
-        if "response" in record.__dict__:
-            json_record["response"] = json.dumps(record.__dict__["response"])
-        if record.levelno == logging.ERROR and "exc_info" in record.__dict__:
+        json_record = {"message": record.getMessage()}
+        attributes = record.__dict__
+        if "request" in attributes:
+            json_record["request"] = attributes["request"]
+        if "response" in attributes:
+            json_record["response"] = attributes["response"]
+        if "stats" in attributes:
+            json_record["stats"] = attributes["stats"]
+        if record.levelno >= logging.ERROR and record.exc_info:
             json_record["exception"] = self.formatException(record.exc_info)
             
-        return json.dumps(json_record)
\ No newline at end of file
+        return self._encode(json_record)
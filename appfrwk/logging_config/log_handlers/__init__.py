@@ -0,0 +1,171 @@
+"""
+Logging handlers used to move formatting and file I/O off the event loop thread
+"""
+import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, List, Tuple
+
+DROP_NEW = "drop_new"
+DROP_OLDEST = "drop_oldest"
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Queue handler for a bounded queue that never blocks the caller.
+
+    When the queue is full the record is dropped ("drop_new") or the oldest
+    queued record is evicted to make room ("drop_oldest").
+    """
+
+    def __init__(self, log_queue: queue.Queue, drop_policy: str = DROP_NEW):
+        super(DroppingQueueHandler, self).__init__(log_queue)
+        if drop_policy not in (DROP_NEW, DROP_OLDEST):
+            raise ValueError(f"Invalid log queue drop policy: {drop_policy}")
+        self.drop_policy = drop_policy
+        self.enqueued = 0
+        self.dropped = 0
+
+    def prepare(self, record):
+        """
+        Merge the message arguments only, formatting happens on the listener thread
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        """
+        Enqueue the record, applying the drop policy when the queue is full
+        """
+        try:
+            self.queue.put_nowait(record)
+            self.enqueued += 1
+            return
+        except queue.Full:
+            pass
+        if self.drop_policy == DROP_OLDEST:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(record)
+                self.enqueued += 1
+            except queue.Full:
+                pass
+        self.dropped += 1
+
+
+class RoutingQueueListener(QueueListener):
+    """
+    Queue listener that dispatches each record to the handlers of the logger
+    it was logged on, following the same propagation rules as logging itself.
+
+    routes maps a configured logger name to (handlers, propagate).  When the
+    queue is idle for flush_interval seconds the handlers are flushed so that
+    batched file writes do not linger.
+    """
+
+    def __init__(self, log_queue: queue.Queue, routes: Dict[str, Tuple[List[logging.Handler], bool]],
+                 respect_handler_level: bool = True, flush_interval: float = 1.0):
+        handlers = []
+        for route_handlers, _ in routes.values():
+            handlers.extend(h for h in route_handlers if h not in handlers)
+        super(RoutingQueueListener, self).__init__(
+            log_queue, *handlers, respect_handler_level=respect_handler_level)
+        self.routes = routes
+        self.flush_interval = flush_interval
+        self._resolved: Dict[str, List[logging.Handler]] = {}
+
+    def _handlers_for(self, name: str) -> List[logging.Handler]:
+        handlers = self._resolved.get(name)
+        if handlers is None:
+            handlers = []
+            lookup = name
+            while True:
+                if lookup in self.routes:
+                    route_handlers, propagate = self.routes[lookup]
+                    handlers.extend(route_handlers)
+                    if not propagate:
+                        break
+                if not lookup:
+                    break
+                lookup = lookup.rpartition(".")[0]
+            self._resolved[name] = handlers
+        return handlers
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, timeout=self.flush_interval)
+            except queue.Empty:
+                if not block:
+                    raise
+                self.flush()
+
+    def enqueue_sentinel(self):
+        # Block rather than fail when the queue is full, the listener is draining it
+        self.queue.put(self._sentinel)
+
+    def handle(self, record):
+        record = self.prepare(record)
+        for handler in self._handlers_for(record.name):
+            if not self.respect_handler_level or record.levelno >= handler.level:
+                handler.handle(record)
+
+    def flush(self):
+        """
+        Flush every handler served by this listener
+        """
+        for handler in self.handlers:
+            handler.flush()
+
+
+class BatchingRotatingFileHandler(RotatingFileHandler):
+    """
+    Rotating file handler that buffers formatted records and writes them in
+    one call once batch_size records are pending, flush_interval seconds have
+    passed, or an ERROR record arrives.
+    """
+
+    def __init__(self, filename, mode='a', maxBytes=0, backupCount=0, encoding=None, delay=False,
+                 batch_size: int = 64, flush_interval: float = 1.0):
+        super(BatchingRotatingFileHandler, self).__init__(
+            filename, mode=mode, maxBytes=maxBytes, backupCount=backupCount, encoding=encoding, delay=delay)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: List[str] = []
+        self._last_flush = time.monotonic()
+
+    def emit(self, record):
+        try:
+            self._buffer.append(self.format(record) + self.terminator)
+            if (len(self._buffer) >= self.batch_size or record.levelno >= logging.ERROR
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self._buffer:
+                data = "".join(self._buffer)
+                self._buffer.clear()
+                if self.stream is None:
+                    self.stream = self._open()
+                if self.maxBytes > 0 and self.stream.tell() + len(data) >= self.maxBytes and self.stream.tell() > 0:
+                    self.doRollover()
+                    if self.stream is None:
+                        self.stream = self._open()
+                self.stream.write(data)
+                self.stream.flush()
+            self._last_flush = time.monotonic()
+        finally:
+            self.release()
+
+    def close(self):
+        self.flush()
+        super(BatchingRotatingFileHandler, self).close()
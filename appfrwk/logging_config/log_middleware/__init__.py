@@ -1,93 +1,146 @@
+import itertools
 import random
-import string
 import time
+from urllib.parse import parse_qsl
 
-from starlette.middleware.base import BaseHTTPMiddleware
+from appfrwk.config import get_config
 from appfrwk.logging_config import get_logger
+from appfrwk.metrics import HTTP_REQUEST_DURATION, HTTP_REQUESTS_IN_FLIGHT, HTTP_TIME_TO_FIRST_BYTE
+from appfrwk.tracing import SPAN_KIND_SERVER, get_tracer
 
-class LogMiddleware(BaseHTTPMiddleware):
+class LogMiddleware:
     """
-    Middleware to log requests and responses
+    Pure ASGI middleware to log, time and trace requests and responses.
+
+    Response messages are passed through untouched (bodies are never
+    buffered), so streaming responses reach the client as they are produced.
     """
-    async def dispatch(self, request, call_next):
-        """
-        Dispatch requests and log them
-        """
-        # Log the request
-        response = await self.log_requests(request, call_next)
-        return response
+    def __init__(self, app):
+        self.app = app
+        # Initialize loggers once
+        self.request_logger = get_logger('request')
+        self.request_processing_logger = get_logger('request_processing')
+        self.metrics_enabled = get_config().METRICS_ENABLED
+        self.tracer = get_tracer()
+        # Request ids are a per-process random prefix and a counter
+        self._id_prefix = "%04X" % random.getrandbits(16)
+        self._id_counter = itertools.count(1)
 
-    async def log_requests(self, request, call_next):
+    async def __call__(self, scope, receive, send):
         """
-        Log requests
+        Dispatch requests and log them
         """
-        # Initialize loggers
-        request_logger = get_logger('request')
-        request_processing_logger = get_logger('request_processing')
-        # Skip logging for requests to favicon.ico
-        if request.url.path == "/favicon.ico":
-            response = await call_next(request)
-            return response
+        # Skip logging for lifespan/websocket events and requests to favicon.ico
+        if scope["type"] != "http" or scope["path"] == "/favicon.ico":
+            await self.app(scope, receive, send)
+            return
 
         # Generate a unique request id
         rid = self.generate_unique_request_id()
+        headers = dict(scope["headers"])
+        span = None
+        if self.tracer.enabled:
+            traceparent = headers.get(b"traceparent")
+            span = self.tracer.start_span(
+                f"{scope['method']} {scope['path']}", SPAN_KIND_SERVER,
+                {"http.method": scope["method"], "http.target": scope["path"], "request.id": rid},
+                traceparent=traceparent.decode("latin-1") if traceparent else None)
 
         # Log the start of the request
-        self.log_request_start(request, rid, request_processing_logger)
-        
+        self.log_request_start(scope, rid, span)
+
         # Record the start time of the request
-        start_time = time.monotonic()
+        start_time = time.perf_counter()
+        first_byte_time = None
+        status_code = 500
 
-        # Process the request
-        response = await call_next(request)
+        async def send_wrapper(message):
+            nonlocal status_code, first_byte_time
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif first_byte_time is None and message["type"] == "http.response.body":
+                first_byte_time = time.perf_counter()
+            await send(message)
 
-        # Log the details of the request
-        self.log_request_details(request, response, rid, request_logger)
+        if self.metrics_enabled:
+            HTTP_REQUESTS_IN_FLIGHT.inc()
+        try:
+            # Process the request
+            if span is None:
+                await self.app(scope, receive, send_wrapper)
+            else:
+                with self.tracer.activate(span, end_on_exit=False):
+                    await self.app(scope, receive, send_wrapper)
+        finally:
+            end_time = time.perf_counter()
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            if self.metrics_enabled:
+                HTTP_REQUESTS_IN_FLIGHT.dec()
+                HTTP_REQUEST_DURATION.observe(
+                    end_time - start_time, method=scope["method"], route=route_path, status=status_code)
+                if first_byte_time is not None:
+                    HTTP_TIME_TO_FIRST_BYTE.observe(
+                        first_byte_time - start_time, method=scope["method"], route=route_path)
+            if span is not None:
+                if route is not None:
+                    span.name = f"{scope['method']} {route_path}"
+                    span.set_attribute("http.route", route_path)
+                span.set_attribute("http.status_code", status_code)
+                span.end()
 
-        # Log the end of the request with additional info
-        self.log_request_end(response, rid, start_time, request_processing_logger)
+            # Log the details of the request
+            self.log_request_details(scope, headers, status_code, rid)
+
+            # Log the end of the request with additional info
+            self.log_request_end(status_code, rid, start_time, first_byte_time, end_time)
 
-        return response
-    
     def generate_unique_request_id(self):
         """
         Generate a unique request id
         """
-        return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-    
-    def log_request_details(self, request, response, rid, logger):
+        return f"{self._id_prefix}{next(self._id_counter):06X}"
+
+    def log_request_details(self, scope, headers, status_code, rid):
         """
         Log the details of the request
         """
-        logger.info(
+        client_host = scope["client"][0] if scope.get("client") else "unknown"
+        host = headers.get(b"host", b"unknown").decode("latin-1")
+        query_string = scope.get("query_string", b"").decode("latin-1")
+        url = f"{scope.get('scheme', 'http')}://{host}{scope['path']}" + (f"?{query_string}" if query_string else "")
+        forwarded_for = headers.get(b"x-forwarded-for")
+        self.request_logger.info(
             f"Rid={rid}",
             extra={
                 "request": {
-                    "url": str(request.url), 
-                    "remote_address": request.client.host,
-                    "method": request.method,
-                    "path": request.url.path,
-                    "ip": request.headers.get("X-Forwarded-For", request.client.host),
-                    "host": request.headers.get("host", "unknown"),
-                    "request_args": dict(request.query_params),
+                    "url": url,
+                    "remote_address": client_host,
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "ip": forwarded_for.decode("latin-1") if forwarded_for else client_host,
+                    "host": host,
+                    "request_args": dict(parse_qsl(query_string)),
                     },
-                "response": {"status_code": response.status_code},
+                "response": {"status_code": status_code},
             },
         )
 
-    def log_request_start(self, request, rid, logger):
+    def log_request_start(self, scope, rid, span=None):
         """
         Log the start of the request
         """
-        logger.info(f"Received rid={rid} Starting path={request.url.path}")
+        trace = f" trace_id={span.trace_id}" if span is not None else ""
+        self.request_processing_logger.info(f"Received rid={rid}{trace} Starting path={scope['path']}")
 
-    def log_request_end(self, response, rid, start_time, logger):
+    def log_request_end(self, status_code, rid, start_time, first_byte_time, end_time):
         """
         Log the end of the request
         """
-        # Calculate the time taken to process the request
-        process_time = (time.monotonic() - start_time) * 1000
-        # Format the time taken to process the request
-        formatted_process_time = "{:.2f}".format(process_time)
+        # Calculate the time taken to process the request and to send the first body bytes
+        process_time = (end_time - start_time) * 1000
+        first_byte = (first_byte_time - start_time) * 1000 if first_byte_time is not None else process_time
         # Log the end of the request and the time taken to process it
-        logger.info(f"Ended rid={rid} Time to process={formatted_process_time}ms Status Code={response.status_code}")
\ No newline at end of file
+        self.request_processing_logger.info(
+            f"Ended rid={rid} Time to first byte={first_byte:.2f}ms Time to process={process_time:.2f}ms "
+            f"Status Code={status_code}")
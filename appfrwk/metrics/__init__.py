@@ -0,0 +1,308 @@
+"""
+Lightweight in-process metrics rendered in the Prometheus text format.
+
+Metrics are plain counters, gauges and histograms guarded by a lock, so
+recording a sample costs a dictionary lookup and an addition; the text
+exposition is only built when /metrics is scraped.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """
+    Base class for metrics, values are stored per tuple of label values
+    """
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing value
+    """
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        for key, value in list(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(Metric):
+    """
+    Value that can go up and down
+    """
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        for key, value in list(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values over fixed buckets
+    """
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [bucket counts..., +Inf count], sum
+        self._values: Dict[Tuple, List] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the duration of the with block in seconds
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        for key, (counts, total) in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class MetricsRegistry:
+    """
+    Collection of metrics rendered together by the /metrics endpoint.
+
+    Collect callbacks run before rendering and are used to sample values
+    owned elsewhere (queue depths, pool sizes, ...).
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def on_collect(self, callback: Callable[[], None]):
+        self._collectors.append(callback)
+        return callback
+
+    def render(self) -> str:
+        for callback in self._collectors:
+            callback()
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# Application metrics
+HTTP_REQUEST_DURATION = histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"])
+HTTP_TIME_TO_FIRST_BYTE = histogram(
+    "http_time_to_first_byte_seconds", "Time until the first response body bytes are sent", ["method", "route"])
+HTTP_REQUESTS_IN_FLIGHT = gauge(
+    "http_requests_in_flight", "HTTP requests currently being processed")
+WORK_IN_FLIGHT = gauge(
+    "work_in_flight", "Long-running work (ingestion, streaming, background tasks) drained on shutdown", ["kind"])
+PHASE_DURATION = histogram(
+    "rag_phase_duration_seconds", "Time spent in each phase of a handler (db, retrieval, llm, ...)",
+    ["route", "phase"])
+ADMISSION_ACTIVE = gauge(
+    "admission_active_requests", "Requests holding an admission slot", ["route"])
+ADMISSION_QUEUE_DEPTH = gauge(
+    "admission_queue_depth", "Requests waiting for an admission slot", ["route"])
+ADMISSION_WAIT = histogram(
+    "admission_wait_seconds", "Time spent waiting for an admission slot", ["route"])
+ADMISSION_REJECTED = counter(
+    "admission_rejected_total", "Requests rejected by admission control", ["route", "reason"])
+LLM_CALLS = counter(
+    "llm_calls_total", "LLM provider calls by outcome (success, error, circuit_open)", ["provider", "outcome"])
+LLM_RETRIES = counter(
+    "llm_retries_total", "Extra LLM attempts (retry, hedge) and retries refused by the budget", ["provider", "outcome"])
+LLM_BREAKER_STATE = gauge(
+    "llm_circuit_state", "Circuit breaker state per provider (0 closed, 1 open, 2 half open)", ["provider"])
+LLM_STAGE_DURATION = histogram(
+    "llm_stage_duration_seconds", "LLM call latency per pipeline stage and model", ["stage", "model"])
+LLM_STAGE_TOKENS = counter(
+    "llm_stage_tokens_total", "LLM tokens per pipeline stage, model and kind (prompt, completion)",
+    ["stage", "model", "kind"])
+INGESTION_JOBS = counter(
+    "ingestion_jobs_total", "Document ingestion jobs by source and outcome", ["source", "status"])
+INGESTION_DOCUMENTS = counter(
+    "ingestion_documents_total", "Documents (chunks and summaries) written to the vector store", ["source"])
+MESSAGE_BUFFER_PENDING = gauge(
+    "message_buffer_pending", "Chat messages buffered for write-behind and not flushed yet")
+MESSAGES_FLUSHED = counter(
+    "messages_flushed_total", "Buffered chat messages flushed to the conversation database, by outcome",
+    ["outcome"])
+QUERY_EXPANSIONS = counter(
+    "query_expansions_total", "Query expansions by mode and outcome (used, empty, timeout, error)",
+    ["mode", "outcome"])
+VECTOR_STORE_HANDLES = gauge(
+    "vector_store_handles", "Collections with a cached vector store handle")
+CACHE_REQUESTS = counter(
+    "cache_requests_total", "Cache lookups by cache and result (hit or miss)", ["cache", "result"])
+CACHE_HIT_RATIO = gauge(
+    "cache_hit_ratio", "Fraction of cache lookups served from the cache", ["cache"])
+DB_POOL_CONNECTIONS = gauge(
+    "db_pool_connections", "Database pool connections by state (size, checked_in, checked_out, overflow)",
+    ["engine", "state"])
+DB_POOL_EVENTS = counter(
+    "db_pool_events_total", "Database pool connects, checkouts and invalidated connections", ["engine", "event"])
+LOG_RECORDS = gauge(
+    "log_queue_records", "Log queue counters (enqueued, dropped, queued)", ["state"])
+
+
+@contextmanager
+def time_phase(route: str, phase: str):
+    """
+    Time a phase of a request handler and trace it as a span,
+    e.g. ``with time_phase("rag_chain_chat", "db"):``
+    """
+    from appfrwk.tracing import get_tracer
+
+    with get_tracer().span(f"{route}.{phase}", attributes={"rag.route": route, "rag.phase": phase}):
+        with PHASE_DURATION.time(route=route, phase=phase):
+            yield
+
+
+def record_cache(cache: str, hits: int = 0, misses: int = 0):
+    """
+    Count cache hits and misses
+    """
+    if hits:
+        CACHE_REQUESTS.inc(hits, cache=cache, result="hit")
+    if misses:
+        CACHE_REQUESTS.inc(misses, cache=cache, result="miss")
+
+
+@REGISTRY.on_collect
+def _collect_cache_hit_ratio():
+    caches = {key[0] for key in list(CACHE_REQUESTS._values)}
+    for cache in caches:
+        hits = CACHE_REQUESTS.value(cache=cache, result="hit")
+        total = hits + CACHE_REQUESTS.value(cache=cache, result="miss")
+        CACHE_HIT_RATIO.set(hits / total if total else 0, cache=cache)
+
+
+@REGISTRY.on_collect
+def _collect_logging_stats():
+    from appfrwk.logging_config import get_logging_stats
+
+    stats = get_logging_stats()
+    LOG_RECORDS.set(stats["enqueued"], state="enqueued")
+    LOG_RECORDS.set(stats["dropped"], state="dropped")
+    LOG_RECORDS.set(stats["queue_size"], state="queued")
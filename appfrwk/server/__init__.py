@@ -0,0 +1,209 @@
+"""
+Production server launcher and graceful draining of long-running work.
+
+``run()`` starts uvicorn from Settings: worker processes, event loop and
+HTTP parser, keep-alive, connection and backlog limits and the graceful
+shutdown timeout. Workers are separate processes, so only state that lives
+on disk is preloaded in the parent; clients, pools and threads are created
+by each worker's lifespan.
+
+A worker starts draining as soon as it gets the shutdown signal, while it
+still serves (see appfrwk.server.draining): readiness turns 503 and new
+long-running work is refused, and in-flight work has TIMEOUT_GRACEFUL_SHUTDOWN
+in total to finish.
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Coroutine, Dict, Optional, Set
+
+from fastapi import HTTPException, status
+
+from appfrwk.config import get_config
+from appfrwk.logging_config import get_logger, setup_logging
+from appfrwk.metrics import WORK_IN_FLIGHT
+
+log = get_logger(__name__)
+
+
+class ServiceDrainingError(HTTPException):
+    def __init__(self):
+        """Returns HTTP 503 while the worker shuts down"""
+        super().__init__(status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server is shutting down",
+                         headers={"Retry-After": "5", "Connection": "close"})
+
+
+class WorkTracker:
+    """
+    Counts in-flight long-running work (ingestion, streaming responses,
+    background tasks) so shutdown can wait for it instead of cutting it off
+    """
+
+    def __init__(self):
+        self.draining = False
+        self._deadline: Optional[float] = None
+        self._in_flight: Dict[str, int] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._idle: Optional[asyncio.Event] = None
+
+    @property
+    def in_flight(self) -> int:
+        return sum(self._in_flight.values())
+
+    def _event(self) -> asyncio.Event:
+        if self._idle is None:
+            self._idle = asyncio.Event()
+            self._idle.set()
+        return self._idle
+
+    def _enter(self, kind: str, refuse: bool = True):
+        if self.draining and refuse:
+            raise ServiceDrainingError()
+        self._in_flight[kind] = self._in_flight.get(kind, 0) + 1
+        self._event().clear()
+        WORK_IN_FLIGHT.inc(kind=kind)
+
+    def _exit(self, kind: str):
+        self._in_flight[kind] -= 1
+        WORK_IN_FLIGHT.dec(kind=kind)
+        if self.in_flight == 0:
+            self._event().set()
+
+    @asynccontextmanager
+    async def track(self, kind: str):
+        """
+        Track the with block, e.g. ``async with tracker.track("ingestion"):``.
+        Raises ServiceDrainingError once shutdown has started.
+        """
+        self._enter(kind)
+        try:
+            yield
+        finally:
+            self._exit(kind)
+
+    def spawn(self, coroutine: Coroutine, kind: str) -> asyncio.Task:
+        """
+        Run a coroutine in the background and track it until it finishes.
+        Accepted while draining: it is started by work that may finish.
+        """
+        self._enter(kind, refuse=False)
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+
+        def done(finished: asyncio.Task):
+            self._tasks.discard(finished)
+            self._exit(kind)
+            if not finished.cancelled() and finished.exception() is not None:
+                log.error(f"Background {kind} task failed: {finished.exception()}")
+
+        task.add_done_callback(done)
+        return task
+
+    def start_draining(self, timeout: float):
+        """
+        Refuse new work from now on; in-flight work has until timeout
+        seconds from the first call to finish
+        """
+        if not self.draining:
+            self.draining = True
+            self._deadline = time.monotonic() + timeout
+            log.info(f"Draining, {self.in_flight} in-flight jobs {self._in_flight}")
+
+    async def wait_idle(self) -> bool:
+        """
+        Wait until no work is in flight or the drain deadline passes.
+        Returns whether the work finished.
+        """
+        if self.in_flight:
+            try:
+                await asyncio.wait_for(self._event().wait(), max(self._deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                pass
+        return self.in_flight == 0
+
+    async def drain(self, timeout: float) -> int:
+        """
+        Refuse new work and wait for in-flight work until the drain deadline,
+        timeout seconds from now unless draining started earlier. Background
+        tasks still running afterwards are cancelled. Returns the amount of
+        work that did not finish.
+        """
+        self.start_draining(timeout)
+        started = time.monotonic()
+        await self.wait_idle()
+        remaining = self.in_flight
+        if remaining:
+            log.warning(f"{remaining} jobs still running at the drain deadline, cancelling background tasks")
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        else:
+            log.info(f"Drained in {time.monotonic() - started:.2f}s")
+        return remaining
+
+
+@lru_cache()
+def get_work_tracker() -> WorkTracker:
+    """
+    Work tracker of this worker process
+    """
+    return WorkTracker()
+
+
+def uvicorn_options(config=None, **overrides) -> Dict:
+    """
+    uvicorn.run() keyword arguments from Settings
+    """
+    config = config or get_config()
+    options = {
+        "host": config.HOST,
+        "port": config.PORT,
+        "workers": config.WORKERS,
+        "loop": config.LOOP,
+        "http": config.HTTP,
+        "timeout_keep_alive": config.TIMEOUT_KEEP_ALIVE,
+        "timeout_graceful_shutdown": config.TIMEOUT_GRACEFUL_SHUTDOWN,
+        "limit_concurrency": config.LIMIT_CONCURRENCY,
+        "limit_max_requests": config.LIMIT_MAX_REQUESTS,
+        "backlog": config.BACKLOG,
+        "reload": config.DEBUG,
+        "factory": True,
+    }
+    options.update(overrides)
+    if options["reload"]:
+        # uvicorn only reloads a single worker
+        options["workers"] = 1
+    return options
+
+
+def preload(config=None):
+    """
+    Prepare state every worker can share safely: validate the settings and
+    fill the on-disk tokenizer cache so workers do not download it themselves
+    """
+    config = config or get_config()
+    started = time.perf_counter()
+    try:
+        import tiktoken
+
+        tiktoken.get_encoding(config.CONTEXT_ENCODING)
+    except Exception as e:
+        log.warning(f"Could not preload the {config.CONTEXT_ENCODING} tokenizer: {e}")
+    log.info(f"Preloaded shared state in {time.perf_counter() - started:.2f}s")
+
+
+def run(app: str = "app:create_app", **overrides):
+    """
+    Start uvicorn with the configured workers, loop, limits and timeouts
+    """
+    from appfrwk.server.draining import serve
+
+    setup_logging()
+    config = get_config()
+    options = uvicorn_options(config, **overrides)
+    if config.PRELOAD:
+        preload(config)
+    log.info(f"Starting {options['workers']} worker(s) on {options['host']}:{options['port']} "
+             f"loop={options['loop']} http={options['http']}")
+    serve(app, **options)
@@ -0,0 +1,78 @@
+"""
+uvicorn server that starts draining when the shutdown signal arrives.
+
+uvicorn closes its listeners and connections and waits
+timeout_graceful_shutdown for the running requests before it sends the
+lifespan shutdown, so a drain started by the lifespan is never seen by a
+request. DrainingServer instead marks the worker's WorkTracker as draining
+in the signal handler and keeps serving until the tracked work finishes or
+TIMEOUT_GRACEFUL_SHUTDOWN passes: meanwhile /health/ready answers 503 and
+new long-running work gets ServiceDrainingError. uvicorn then closes the
+connections with the time left, and the lifespan drain only cancels what
+is still running at the deadline. A second signal shuts down right away.
+"""
+import asyncio
+import sys
+import time
+from typing import Optional
+
+import uvicorn
+from uvicorn.main import STARTUP_FAILURE
+from uvicorn.supervisors import ChangeReload, Multiprocess
+
+from appfrwk.logging_config import get_logger
+from appfrwk.server import get_work_tracker
+
+log = get_logger(__name__)
+
+# Left to uvicorn for the untracked requests once the tracked work is done
+MIN_CONNECTION_GRACE = 1.0
+
+
+class DrainingServer(uvicorn.Server):
+    def __init__(self, config: uvicorn.Config):
+        super().__init__(config)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._drain: Optional[asyncio.Task] = None
+
+    async def serve(self, sockets=None):
+        self._loop = asyncio.get_running_loop()
+        await super().serve(sockets=sockets)
+
+    def handle_exit(self, sig, frame):
+        if self._drain is not None or self._loop is None or not self.started:
+            super().handle_exit(sig, frame)
+            return
+        # Also called by signal.signal on platforms without loop signal handlers
+        self._loop.call_soon_threadsafe(self._start_drain)
+
+    def _start_drain(self):
+        if self._drain is None:
+            self._drain = asyncio.ensure_future(self._drain_then_exit())
+
+    async def _drain_then_exit(self):
+        timeout = self.config.timeout_graceful_shutdown or 0
+        started = time.monotonic()
+        tracker = get_work_tracker()
+        tracker.start_draining(timeout)
+        await tracker.wait_idle()
+        self.config.timeout_graceful_shutdown = max(timeout - (time.monotonic() - started), MIN_CONNECTION_GRACE)
+        log.info(f"Tracked work drained={tracker.in_flight == 0} after {time.monotonic() - started:.2f}s, "
+                 f"closing connections")
+        self.should_exit = True
+
+
+def serve(app: str, **options):
+    """
+    uvicorn.run() with DrainingServer
+    """
+    config = uvicorn.Config(app, **options)
+    server = DrainingServer(config)
+    if config.should_reload:
+        ChangeReload(config, target=server.run, sockets=[config.bind_socket()]).run()
+    elif config.workers > 1:
+        Multiprocess(config, target=server.run, sockets=[config.bind_socket()]).run()
+    else:
+        server.run()
+    if not server.started and not config.should_reload and config.workers == 1:
+        sys.exit(STARTUP_FAILURE)
@@ -0,0 +1,403 @@
+"""
+Request tracing compatible with OpenTelemetry.
+
+Spans use W3C trace context identifiers (``traceparent``), the active span is
+carried in a contextvar so it follows the request through awaits, threadpool
+calls and LangChain callbacks, and finished spans are exported in batches
+from a background thread as OTLP/JSON, either to a local file or to an OTLP
+HTTP collector (e.g. ``http://localhost:4318/v1/traces``).
+
+Sampling is parent based with a trace-id ratio for new traces, so unsampled
+requests only pay for a contextvar lookup per span.
+"""
+import json
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from appfrwk.config import get_config
+from appfrwk.logging_config import get_logger
+
+log = get_logger(__name__)
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    A timed operation within a trace
+    """
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "sampled", "kind",
+                 "start_ns", "end_ns", "attributes", "events", "status", "status_message")
+
+    def __init__(self, tracer: "Tracer", name: str, trace_id: str, span_id: str, parent_id: Optional[str],
+                 sampled: bool, kind: int = SPAN_KIND_INTERNAL, attributes: Optional[Dict] = None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes) if attributes and sampled else {}
+        self.events: List[Dict] = []
+        self.status = STATUS_UNSET
+        self.status_message = ""
+
+    def set_attribute(self, key: str, value):
+        if self.sampled:
+            self.attributes[key] = value
+
+    def add_event(self, name: str, attributes: Optional[Dict] = None):
+        if self.sampled:
+            self.events.append({"name": name, "time_ns": time.time_ns(), "attributes": attributes or {}})
+
+    def record_exception(self, exc: BaseException):
+        self.status = STATUS_ERROR
+        self.status_message = str(exc)
+        self.add_event("exception", {"exception.type": type(exc).__name__, "exception.message": str(exc)})
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            if self.sampled:
+                self.tracer.processor.on_end(self)
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_otlp(self) -> Dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "status": {"code": self.status, "message": self.status_message},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.events:
+            span["events"] = [
+                {"name": e["name"], "timeUnixNano": str(e["time_ns"]), "attributes": _otlp_attributes(e["attributes"])}
+                for e in self.events
+            ]
+        return span
+
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict) -> List[Dict]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+def parse_traceparent(header: Optional[str]):
+    """
+    Parse a W3C traceparent header into (trace_id, parent_span_id, sampled)
+    """
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        flags = int(parts[3][:2], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+class SpanExporter:
+    """
+    Receives batches of finished spans
+    """
+
+    def export(self, spans: List[Span]):
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+
+class FileSpanExporter(SpanExporter):
+    """
+    Append each batch as one OTLP/JSON ``resourceSpans`` line
+    """
+
+    def __init__(self, path: str, resource: Dict):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.resource = resource
+
+    def export(self, spans: List[Span]):
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(_otlp_payload(self.resource, spans), separators=(",", ":")) + "\n")
+
+
+class OTLPHttpExporter(SpanExporter):
+    """
+    POST batches to an OTLP/HTTP collector using the JSON encoding
+    """
+
+    def __init__(self, endpoint: str, resource: Dict, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.resource = resource
+        self.timeout = timeout
+
+    def export(self, spans: List[Span]):
+        body = json.dumps(_otlp_payload(self.resource, spans), separators=(",", ":")).encode("utf-8")
+        request = urllib.request.Request(
+            self.endpoint, data=body, headers={"Content-Type": "application/json"}, method="POST")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+def _otlp_payload(resource: Dict, spans: List[Span]) -> Dict:
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes(resource)},
+            "scopeSpans": [{"scope": {"name": "appfrwk.tracing"}, "spans": [span.to_otlp() for span in spans]}],
+        }]
+    }
+
+
+class BatchSpanProcessor:
+    """
+    Queue finished spans and export them in batches from a daemon thread.
+
+    The queue is bounded; spans are dropped (and counted) when it is full so
+    tracing never applies backpressure to requests.
+    """
+
+    def __init__(self, exporter: SpanExporter, max_queue_size: int = 2048, batch_size: int = 256,
+                 export_interval: float = 2.0):
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.export_interval = export_interval
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def on_end(self, span: Span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self, block: bool) -> List[Span]:
+        batch = []
+        try:
+            if block:
+                batch.append(self._queue.get(timeout=self.export_interval))
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _export(self, batch: List[Span]):
+        if not batch:
+            return
+        try:
+            self.exporter.export(batch)
+        except Exception as e:
+            log.error(f"Span export failed, dropped {len(batch)} spans: {str(e)}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._export(self._drain(block=True))
+
+    def shutdown(self):
+        """
+        Export what is queued and stop the exporter thread
+        """
+        self._stop.set()
+        self._thread.join(timeout=self.export_interval + 1)
+        while True:
+            batch = self._drain(block=False)
+            if not batch:
+                break
+            self._export(batch)
+        self.exporter.shutdown()
+
+
+class _NoopProcessor:
+    dropped = 0
+
+    def on_end(self, span: Span):
+        pass
+
+    def shutdown(self):
+        pass
+
+
+class Tracer:
+    """
+    Creates spans and tracks the active one in a contextvar
+    """
+
+    def __init__(self, processor=None, sample_ratio: float = 1.0, enabled: bool = True):
+        self.processor = processor or _NoopProcessor()
+        self.sample_ratio = sample_ratio
+        self.enabled = enabled
+
+    def _should_sample(self, trace_id: str) -> bool:
+        # trace-id ratio sampling, consistent across services sharing the trace
+        return int(trace_id[16:], 16) < self.sample_ratio * (1 << 64)
+
+    def start_span(self, name: str, kind: int = SPAN_KIND_INTERNAL, attributes: Optional[Dict] = None,
+                   parent: Optional[Span] = None, traceparent: Optional[str] = None) -> Span:
+        """
+        Start a span without activating it, its parent is the active span unless given
+        """
+        parent = parent or _current_span.get()
+        remote = parse_traceparent(traceparent) if parent is None else None
+        span_id = "%016x" % random.getrandbits(64)
+        if parent is not None:
+            return Span(self, name, parent.trace_id, span_id, parent.span_id, parent.sampled, kind, attributes)
+        if remote is not None:
+            trace_id, parent_id, sampled = remote
+            return Span(self, name, trace_id, span_id, parent_id, sampled, kind, attributes)
+        trace_id = "%032x" % random.getrandbits(128)
+        return Span(self, name, trace_id, span_id, None, self._should_sample(trace_id), kind, attributes)
+
+    @contextmanager
+    def activate(self, span: Span, end_on_exit: bool = True):
+        """
+        Make span the active span for the duration of the with block
+        """
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            if end_on_exit:
+                span.end()
+
+    @contextmanager
+    def span(self, name: str, kind: int = SPAN_KIND_INTERNAL, attributes: Optional[Dict] = None):
+        """
+        Start a child of the active span and activate it, e.g. ``with tracer.span("db.query"):``
+        """
+        if not self.enabled:
+            yield None
+            return
+        with self.activate(self.start_span(name, kind, attributes)) as span:
+            yield span
+
+    def shutdown(self):
+        self.processor.shutdown()
+
+
+def current_span() -> Optional[Span]:
+    """
+    The active span of the current context, if any
+    """
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace_id if span is not None else None
+
+
+@lru_cache()
+def get_tracer() -> Tracer:
+    """
+    Get the tracer configured from settings
+    """
+    config = get_config()
+    if not config.TRACING_ENABLED:
+        return Tracer(enabled=False)
+    resource = {"service.name": config.TRACING_SERVICE_NAME or config.APP_NAME, "service.version": config.VERSION}
+    if config.TRACING_EXPORTER == "otlp":
+        exporter = OTLPHttpExporter(config.TRACING_OTLP_ENDPOINT, resource)
+    elif config.TRACING_EXPORTER == "file":
+        exporter = FileSpanExporter(
+            config.TRACING_FILE or os.path.join(config.LOG_DIRECTORY, "traces.jsonl"), resource)
+    else:
+        raise ValueError(f"Invalid tracing exporter: {config.TRACING_EXPORTER}")
+    processor = BatchSpanProcessor(exporter, max_queue_size=config.TRACING_QUEUE_SIZE,
+                                   batch_size=config.TRACING_BATCH_SIZE,
+                                   export_interval=config.TRACING_EXPORT_INTERVAL)
+    return Tracer(processor, sample_ratio=config.TRACING_SAMPLE_RATIO)
+
+
+def instrument_sqlalchemy():
+    """
+    Trace every SQL statement executed while a span is active.
+
+    Listeners are registered on the Engine class so they cover the
+    conversation database as well as the pgvector store engines.  Statements
+    run outside of a traced request do not start new traces.
+    """
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    if getattr(instrument_sqlalchemy, "installed", False):
+        return
+    instrument_sqlalchemy.installed = True
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        parent = _current_span.get()
+        if parent is None or not parent.sampled or context is None:
+            return
+        operation = statement.lstrip().split(" ", 1)[0].upper()
+        context._trace_span = get_tracer().start_span(
+            f"db.{operation.lower()}", SPAN_KIND_CLIENT,
+            {"db.system": conn.engine.dialect.name, "db.operation": operation,
+             "db.statement": statement[:500], "db.name": conn.engine.url.database or ""},
+            parent=parent)
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        span = getattr(context, "_trace_span", None)
+        if span is not None:
+            span.end()
+
+    def handle_error(exception_context):
+        span = getattr(exception_context.execution_context, "_trace_span", None)
+        if span is not None:
+            span.record_exception(exception_context.original_exception)
+            span.end()
+
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(Engine, "handle_error", handle_error)
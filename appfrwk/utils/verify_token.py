@@ -1,6 +1,13 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+import httpx
 import jwt
 from jwt.exceptions import PyJWKClientError, DecodeError
-from typing import Optional
 from fastapi import Depends
 from fastapi.security import SecurityScopes, HTTPAuthorizationCredentials, HTTPBearer, OAuth2PasswordBearer
 from fastapi import HTTPException, status
@@ -8,15 +15,139 @@ from appfrwk.errors import UnauthorizedException, UnauthenticatedException
 from appfrwk.config import get_config
 from app.api.schemas.token_schemas import TokenVerificationResult, TokenPayload
 from appfrwk.logging_config import get_logger
+from appfrwk.metrics import record_cache
 
 log = get_logger(__name__)
 
 
+class JWKSCache():
+    """
+    In-memory signing keys indexed by kid.
+
+    The key set is fetched asynchronously at startup and refreshed in the
+    background.  An unknown kid triggers an on-demand refresh (at most once
+    per min_refresh_interval) to pick up rotated keys.
+    """
+
+    def __init__(self, jwks_url: str, refresh_interval: float = 3600, min_refresh_interval: float = 30,
+                 timeout: float = 5.0):
+        self.jwks_url = jwks_url
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._keys: Dict[str, Any] = {}
+        self._last_refresh = float("-inf")
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def refresh(self):
+        """
+        Fetch the JWKS and replace the cached keys
+        """
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            response = await client.get(self.jwks_url)
+            response.raise_for_status()
+        jwk_set = jwt.PyJWKSet.from_dict(response.json())
+        self._keys = {key.key_id: key.key for key in jwk_set.keys if key.key_id}
+        self._last_refresh = time.monotonic()
+        log.info(f"Loaded {len(self._keys)} signing keys from JWKS")
+
+    async def get_signing_key(self, kid: Optional[str]):
+        """
+        Return the signing key for a kid, refreshing the key set if it is unknown
+        """
+        key = self._keys.get(kid)
+        if key is None:
+            async with self._lock:
+                key = self._keys.get(kid)
+                if key is None and time.monotonic() - self._last_refresh >= self.min_refresh_interval:
+                    await self.refresh()
+                    key = self._keys.get(kid)
+        if key is None:
+            raise PyJWKClientError(f'Unable to find a signing key that matches: "{kid}"')
+        return key
+
+    async def start(self):
+        """
+        Warm the key set and start the background refresh task
+        """
+        try:
+            await self.refresh()
+        except Exception as e:
+            log.error(f"Initial JWKS fetch failed, keys will be fetched on demand: {str(e)}")
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        """
+        Stop the background refresh task
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                log.error(f"JWKS refresh failed: {str(e)}")
+
+
+class TokenCache():
+    """
+    Bounded LRU of verified token payloads keyed by token hash.
+
+    Entries expire with the token's exp claim.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token: str) -> Optional[Dict]:
+        key = self.key(token)
+        payload = self._entries.get(key)
+        if payload is None or payload["exp"] <= time.time():
+            if payload is not None:
+                del self._entries[key]
+            self.misses += 1
+            record_cache("token", misses=1)
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        record_cache("token", hits=1)
+        return payload
+
+    def put(self, token: str, payload: Dict):
+        if self.maxsize <= 0 or "exp" not in payload:
+            return
+        key = self.key(token)
+        self._entries[key] = payload
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
 class VerifyToken():
     def __init__(self):
         self.config = get_config()
-        jwks_url = f'https://{self.config.AUTH0_DOMAIN}/.well-known/jwks.json'
-        self.jwks_client = jwt.PyJWKClient(jwks_url)
+        jwks_url = self.config.AUTH0_JWKS_URL or f'https://{self.config.AUTH0_DOMAIN}/.well-known/jwks.json'
+        self.jwks = JWKSCache(jwks_url, refresh_interval=self.config.JWKS_REFRESH_INTERVAL,
+                              min_refresh_interval=self.config.JWKS_MIN_REFRESH_INTERVAL,
+                              timeout=self.config.JWKS_FETCH_TIMEOUT)
+        self.token_cache = TokenCache(self.config.TOKEN_CACHE_SIZE)
         self.audience = self.config.AUTH0_API_AUDIENCE
 
     async def __call__(self, security_scopes: SecurityScopes,
@@ -28,11 +159,22 @@ class VerifyToken():
             raise UnauthenticatedException
 
         token = token.credentials
+        payload = self.token_cache.get(token)
+        if payload is not None:
+            return TokenVerificationResult(verified=True, payload=TokenPayload(**payload), sub=payload.get("sub"))
         try:
-            signing_key = self.jwks_client.get_signing_key_from_jwt(token).key
+            kid = jwt.get_unverified_header(token).get("kid")
+            signing_key = await self.jwks.get_signing_key(kid)
             payload = jwt.decode(
                 token, signing_key, algorithms=self.config.AUTH0_ALGORITHMS, audience=self.config.AUTH0_API_AUDIENCE)
+            self.token_cache.put(token, payload)
             return TokenVerificationResult(verified=True, payload=TokenPayload(**payload), sub=payload.get("sub"))
         except (PyJWKClientError, DecodeError, jwt.ExpiredSignatureError, Exception) as e:
             log.error(f"Token verification error: {str(e)}")
-            raise UnauthorizedException(str(e))
\ No newline at end of file
+            raise UnauthorizedException(str(e))
+
+
+@lru_cache()
+def get_verify_token() -> VerifyToken:
+    """Get the shared token verifier"""
+    return VerifyToken()
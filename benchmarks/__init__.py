@@ -0,0 +1,4 @@
+"""
+Benchmarks and load-test scripts. Run them from the repository root, e.g.
+``python -m benchmarks.verify_token_bench``.
+"""
@@ -0,0 +1,69 @@
+"""
+Cold-start time of the API: importing the app, create_app() and the
+startup phase (lifespan or startup handlers) until the first request.
+
+Each sample runs in a fresh interpreter. Pass ``--ref`` to also measure an
+older revision (checked out into a temporary git worktree), e.g. the commit
+before startup moved into the lifespan:
+
+    python -m benchmarks.cold_start --runs 5 --ref HEAD~1
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+SAMPLE = r"""
+import asyncio, json, time
+started = time.perf_counter()
+import app as package
+imported = time.perf_counter()
+app = package.create_app()
+created = time.perf_counter()
+
+async def startup():
+    async with app.router.lifespan_context(app):
+        return time.perf_counter()
+
+ready = asyncio.run(startup())
+print(json.dumps({"import_s": imported - started, "create_app_s": created - imported,
+                  "startup_s": ready - created, "total_s": ready - started}))
+"""
+
+
+def sample(cwd: str) -> dict:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [cwd, os.environ.get("PYTHONPATH")])))
+    output = subprocess.run([sys.executable, "-c", SAMPLE], cwd=cwd, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(cwd: str, runs: int) -> dict:
+    samples = [sample(cwd) for _ in range(runs)]
+    return {key: round(statistics.median(run[key] for run in samples), 3) for key in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--ref", help="git revision to compare against")
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = {"current": measure(root, args.runs)}
+    if args.ref:
+        with tempfile.TemporaryDirectory() as worktree:
+            subprocess.run(["git", "worktree", "add", "--detach", worktree, args.ref], cwd=root, check=True,
+                           capture_output=True)
+            try:
+                results[args.ref] = measure(worktree, args.runs)
+            finally:
+                subprocess.run(["git", "worktree", "remove", "--force", worktree], cwd=root, check=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Throughput of the pgvector collection export/import (app.services.collection_transfer).
+
+A synthetic export of --rows rows (random float32 vectors of --dimension
+and filler documents) is generated, imported with COPY into a scratch
+collection of DATABASE_URL2, exported again and finally deleted. Rows per
+second, MB per second and the peak RSS of each step are printed as JSON:
+
+    python -m benchmarks.collection_transfer --rows 1000000 --dimension 1536 --workdir /data/bench-transfer
+
+The workdir needs room for two copies of the export (about 6.5 GB per
+million 1536-dimension rows). The database needs the pgvector extension
+and the LangChain PGVector tables, i.e. a store that ingested once.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import time
+
+import numpy as np
+from sqlalchemy import select
+
+from app.services.collection_transfer import FORMAT, FORMAT_VERSION, MANIFEST, export_collection, \
+    import_collection, shard_name
+from app.services.vector_stores import collections, embeddings, get_sync_engine
+
+WORDS = "retrieval tree summary cluster embedding token context paper model layer graph vector".split()
+
+
+def peak_rss_mb() -> float:
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def synthetic_export(directory: str, rows: int, dimension: int, shard_rows: int, seed: int):
+    """
+    Export directory of random rows, written shard by shard
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    words = random.Random(seed)
+    shards = []
+    for start in range(0, rows, shard_rows):
+        size = min(shard_rows, rows - start)
+        name = shard_name(len(shards))
+        vectors = np.lib.format.open_memmap(os.path.join(directory, f"{name}.npy"), mode="w+",
+                                            dtype=np.float32, shape=(size, dimension))
+        for offset in range(0, size, 10000):
+            block = rng.standard_normal((min(10000, size - offset), dimension), dtype=np.float32)
+            vectors[offset:offset + len(block)] = block / np.linalg.norm(block, axis=1, keepdims=True)
+        vectors.flush()
+        with open(os.path.join(directory, f"{name}.jsonl"), "w", encoding="utf-8") as documents:
+            for index in range(start, start + size):
+                text = " ".join(words.choice(WORDS) for _ in range(80))
+                documents.write(json.dumps({"id": f"00000000-0000-4000-8000-{index:012d}", "custom_id": None,
+                                            "document": text, "metadata": {"level": index % 4}}) + "\n")
+        shards.append({"documents": f"{name}.jsonl", "vectors": f"{name}.npy", "rows": size})
+    with open(os.path.join(directory, MANIFEST), "w", encoding="utf-8") as file:
+        json.dump({"format": FORMAT, "version": FORMAT_VERSION, "collection": "synthetic", "collection_metadata": None,
+                   "dimension": dimension, "dtype": "float32", "rows": rows, "shards": shards}, file)
+
+
+def drop_collection(engine, name: str):
+    with engine.begin() as connection:
+        collection_id = connection.scalar(select(collections.c.uuid).where(collections.c.name == name))
+        if collection_id is not None:
+            connection.execute(embeddings.delete().where(embeddings.c.collection_id == collection_id))
+            connection.execute(collections.delete().where(collections.c.uuid == collection_id))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--shard-rows", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--workdir", default=".transfer_bench")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch collection and the exports")
+    args = parser.parse_args()
+
+    engine = get_sync_engine()
+    collection = f"bench_transfer_{int(time.time())}"
+    source, exported = os.path.join(args.workdir, "synthetic"), os.path.join(args.workdir, "exported")
+    results = {"parameters": vars(args)}
+    try:
+        started = time.perf_counter()
+        synthetic_export(source, args.rows, args.dimension, args.shard_rows, args.seed)
+        results["generate_s"] = round(time.perf_counter() - started, 2)
+
+        results["import"] = import_collection(source, collection, "replace", engine, args.batch_size).as_dict()
+        results["import"]["peak_rss_mb"] = peak_rss_mb()
+        results["export"] = export_collection(collection, exported, engine, args.batch_size, args.shard_rows,
+                                              overwrite=True).as_dict()
+        results["export"]["peak_rss_mb"] = peak_rss_mb()
+    finally:
+        if not args.keep:
+            drop_collection(engine, collection)
+            for directory in (source, exported):
+                shutil.rmtree(directory, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Load test of /RAG/create-conversation with a burst of new users.
+
+The real app runs in-process behind httpx against the conversation
+database of DATABASE_URL (migrated with alembic upgrade head). --users new
+subs each send --per-user concurrent create-conversation requests, so the
+first requests of every sub race to create its user; a second phase
+repeats the burst for the same, now known, subs. Statuses, latency
+percentiles and the rows created are printed as JSON: every request should
+return 200 and each sub should own exactly one user row.
+
+    python -m benchmarks.conversation_burst --users 500 --per-user 4 --concurrency 64
+
+The users, conversations and messages of the run are deleted afterwards
+unless --keep is given.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+from sqlalchemy import delete, func, select
+
+from app.services.conversations import conversations, messages, users
+from benchmarks.rag_bench import git_revision, run_phase
+
+
+async def count_rows(sessionmaker, prefix: str) -> dict:
+    async with sessionmaker() as session:
+        own = users.c.sub.like(f"{prefix}%")
+        owned = conversations.c.user_sub.like(f"{prefix}%")
+        return {
+            "users": await session.scalar(select(func.count()).select_from(users).where(own)),
+            "conversations": await session.scalar(select(func.count()).select_from(conversations).where(owned)),
+            "messages": await session.scalar(
+                select(func.count()).select_from(messages)
+                .where(messages.c.conversation_id.in_(select(conversations.c.id).where(owned)))),
+        }
+
+
+async def cleanup(sessionmaker, prefix: str):
+    async with sessionmaker() as session:
+        owned = select(conversations.c.id).where(conversations.c.user_sub.like(f"{prefix}%"))
+        await session.execute(delete(messages).where(messages.c.conversation_id.in_(owned)))
+        await session.execute(delete(conversations).where(conversations.c.user_sub.like(f"{prefix}%")))
+        await session.execute(delete(users).where(users.c.sub.like(f"{prefix}%")))
+        await session.commit()
+
+
+async def bench(args) -> dict:
+    from app import create_app
+    from appfrwk.config import get_config
+    from appfrwk.database import get_database
+
+    config = get_config()
+    config.ADMISSION_ENABLED = False
+    app = create_app()
+    sessionmaker = get_database().get_sessionmaker(config.DATABASE_URL)
+    prefix = f"burst-{int(time.time())}-"
+    body = {"messages": [{"user_message": f"question {i}", "agent_message": f"answer {i}"}
+                         for i in range(args.messages)]}
+    results = {}
+    transport = httpx.ASGITransport(app=app, client=("127.0.0.1", 4321))
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            def create(sub):
+                return lambda: client.post("/RAG/create-conversation", json=dict(body, user_sub=sub))
+
+            calls = [create(f"{prefix}{user}") for user in range(args.users) for _ in range(args.per_user)]
+            results["new_users"] = await run_phase(calls, args.concurrency, False)
+            results["known_users"] = await run_phase(calls, args.concurrency, False)
+        results["rows"] = await count_rows(sessionmaker, prefix)
+        results["rows"]["expected"] = {"users": args.users, "conversations": 2 * len(calls),
+                                       "messages": 2 * len(calls) * args.messages}
+    finally:
+        if not args.keep:
+            await cleanup(sessionmaker, prefix)
+        await get_database().dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="new user subs in the burst")
+    parser.add_argument("--per-user", type=int, default=3, help="concurrent conversations created per sub")
+    parser.add_argument("--messages", type=int, default=0, help="initial messages per conversation")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--keep", action="store_true", help="keep the rows created by the run")
+    args = parser.parse_args()
+
+    result = {
+        "revision": git_revision(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "parameters": vars(args),
+        "phases": asyncio.run(bench(args)),
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
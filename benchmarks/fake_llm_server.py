@@ -0,0 +1,233 @@
+"""
+Local OpenAI-compatible chat completions server with injected latency and
+errors, and a benchmark of the LLM gateway policies against it.
+
+Serve a flaky provider (point OPENAI_BASE_URL at it to run the app against it):
+
+    python -m benchmarks.fake_llm_server serve --port 9101 --latency 0.3 --tail-rate 0.05 --error-rate 0.2
+
+Compare gateway policies (single attempt, retries, retries with hedging,
+failover to a second healthy server) on the same traffic:
+
+    python -m benchmarks.fake_llm_server bench --calls 300 --concurrency 20
+
+The benchmark starts a flaky primary and a healthy secondary server and
+reports the success rate, latency percentiles and the number of calls each
+server received per policy. benchmarks/gateway_checks.py asserts on the
+policies against the same servers.
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+async def stream_events(call: int, model: str, content: str):
+    """
+    Server-sent chat.completion.chunk events of an answer, one word per chunk
+    """
+    words = content.split(" ")
+    for i, word in enumerate(words):
+        delta = {"role": "assistant", "content": word} if i == 0 else {"content": f" {word}"}
+        chunk = {"id": f"chatcmpl-fake-{call}", "object": "chat.completion.chunk", "created": int(time.time()),
+                 "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+        yield f"data: {json.dumps(chunk)}\n\n"
+    chunk = {"id": f"chatcmpl-fake-{call}", "object": "chat.completion.chunk", "created": int(time.time()),
+             "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+    yield f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n"
+
+
+def create_fake_llm_app(latency: float = 0.3, tail_rate: float = 0.0, tail_latency: float = 3.0,
+                        error_rate: float = 0.0, error_status: int = 503, tail_every: int = 0):
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    app = FastAPI()
+    stats = {"calls": 0, "errors": 0, "slow": 0, "cancelled": 0, "with_tools": 0}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["calls"] += 1
+        stats["with_tools"] += bool(body.get("tools"))
+        if random.random() < error_rate:
+            stats["errors"] += 1
+            await asyncio.sleep(latency * random.uniform(0, 0.2))
+            return JSONResponse({"error": {"message": "Injected failure", "type": "server_error"}},
+                                status_code=error_status)
+        delay = latency * random.uniform(0.8, 1.2)
+        # tail_every makes the 1st, (n+1)th, ... call slow, for deterministic checks
+        if random.random() < tail_rate or (tail_every and stats["calls"] % tail_every == 1 % tail_every):
+            stats["slow"] += 1
+            delay = tail_latency
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            stats["cancelled"] += 1
+            raise
+        prompt = " ".join(str(message.get("content", "")) for message in body.get("messages", []))
+        content = f"Answer from {body.get('model')}: {prompt[-80:]}"
+        prompt_tokens, completion_tokens = len(prompt.split()), len(content.split())
+        if body.get("stream"):
+            return StreamingResponse(stream_events(stats["calls"], body.get("model"), content),
+                                     media_type="text/event-stream")
+        return {
+            "id": f"chatcmpl-fake-{stats['calls']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def serve(args):
+    import uvicorn
+
+    app = create_fake_llm_app(args.latency, args.tail_rate, args.tail_latency, args.error_rate, args.error_status,
+                              args.tail_every)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def start_server(port: int, **options) -> subprocess.Popen:
+    command = [sys.executable, "-m", "benchmarks.fake_llm_server", "serve", "--port", str(port)]
+    for name, value in options.items():
+        command += [f"--{name.replace('_', '-')}", str(value)]
+    process = subprocess.Popen(command)
+    for _ in range(100):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/stats", timeout=0.5)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"Fake LLM server on port {port} did not start")
+
+
+def chat_model(port: int, timeout: float):
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(model_name=f"fake-{port}", openai_api_key="fake", openai_api_base=f"http://127.0.0.1:{port}/v1",
+                      request_timeout=timeout, max_retries=0, max_tokens=64)
+
+
+async def run_policy(gateway, calls: int, concurrency: int) -> dict:
+    from langchain_core.messages import HumanMessage
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, failures = [], 0
+
+    async def call(i: int):
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await gateway.agenerate([HumanMessage(content=f"question {i}")])
+                latencies.append(time.perf_counter() - started)
+            except Exception:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(call(i) for i in range(calls)))
+    elapsed = time.perf_counter() - started
+
+    def percentile(fraction):
+        values = sorted(latencies)
+        return round(values[max(int(len(values) * fraction) - 1, 0)], 3) if values else None
+
+    return {"elapsed_s": round(elapsed, 2), "success_rate": round(len(latencies) / calls, 3),
+            "p50_s": percentile(0.5), "p95_s": percentile(0.95), "p99_s": percentile(0.99)}
+
+
+def bench(args):
+    from app.services.llm_gateway import CircuitBreaker, LLMGateway, RetryBudget
+
+    primary = start_server(args.primary_port, latency=args.latency, tail_rate=args.tail_rate,
+                           tail_latency=args.tail_latency, error_rate=args.error_rate)
+    secondary = start_server(args.secondary_port, latency=args.latency)
+    try:
+        def gateway(providers, **options):
+            models = [(name, chat_model(port, args.attempt_timeout)) for name, port in providers]
+            breakers = {name: CircuitBreaker(name, args.breaker_failures, args.breaker_reset,
+                                                 args.breaker_ratio) for name, _ in providers}
+            return LLMGateway(models, deadline=args.deadline, retry_budget=RetryBudget(args.budget_ratio),
+                              backoff_base=0.05, backoff_max=0.5, breakers=breakers, **options)
+
+        primary_only = [("primary", args.primary_port)]
+        policies = {
+            "single_attempt": gateway(primary_only, max_attempts=1),
+            "retries": gateway(primary_only, max_attempts=3),
+            "retries_hedged": gateway(primary_only, max_attempts=3, hedge_after=args.hedge_after),
+            "failover": gateway(primary_only + [("secondary", args.secondary_port)], max_attempts=2,
+                                hedge_after=args.hedge_after),
+        }
+
+        async def run_all() -> dict:
+            # One event loop for every policy, the provider SDK clients are bound to it
+            results = {}
+            for name, policy in policies.items():
+                before = {port: httpx.get(f"http://127.0.0.1:{port}/stats").json()["calls"]
+                          for port in (args.primary_port, args.secondary_port)}
+                results[name] = await run_policy(policy, args.calls, args.concurrency)
+                for label, port in (("primary", args.primary_port), ("secondary", args.secondary_port)):
+                    calls = httpx.get(f"http://127.0.0.1:{port}/stats").json()["calls"]
+                    results[name][f"{label}_calls"] = calls - before[port]
+            return results
+
+        print(json.dumps(asyncio.run(run_all()), indent=2))
+    finally:
+        primary.terminate()
+        secondary.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve")
+    serve_parser.add_argument("--port", type=int, default=9101)
+    serve_parser.add_argument("--latency", type=float, default=0.3)
+    serve_parser.add_argument("--tail-rate", type=float, default=0.0, help="fraction of calls taking --tail-latency")
+    serve_parser.add_argument("--tail-latency", type=float, default=3.0)
+    serve_parser.add_argument("--tail-every", type=int, default=0, help="every n-th call, from the first, is slow")
+    serve_parser.add_argument("--error-rate", type=float, default=0.0)
+    serve_parser.add_argument("--error-status", type=int, default=503)
+
+    bench_parser = commands.add_parser("bench")
+    bench_parser.add_argument("--calls", type=int, default=300)
+    bench_parser.add_argument("--concurrency", type=int, default=20)
+    bench_parser.add_argument("--primary-port", type=int, default=9101)
+    bench_parser.add_argument("--secondary-port", type=int, default=9102)
+    bench_parser.add_argument("--latency", type=float, default=0.2)
+    bench_parser.add_argument("--tail-rate", type=float, default=0.05)
+    bench_parser.add_argument("--tail-latency", type=float, default=3.0)
+    bench_parser.add_argument("--error-rate", type=float, default=0.2)
+    bench_parser.add_argument("--attempt-timeout", type=float, default=5.0)
+    bench_parser.add_argument("--deadline", type=float, default=10.0)
+    bench_parser.add_argument("--hedge-after", type=float, default=0.5)
+    bench_parser.add_argument("--budget-ratio", type=float, default=0.5)
+    bench_parser.add_argument("--breaker-failures", type=int, default=5)
+    bench_parser.add_argument("--breaker-ratio", type=float, default=0.5)
+    bench_parser.add_argument("--breaker-reset", type=float, default=5.0)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args)
+    else:
+        bench(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+Deterministic stand-ins for the model providers and the vector store, and
+synthetic PDFs, used by the offline benchmarks.
+
+Everything here is seeded and reproducible: the same arguments produce the
+same documents, embeddings and answers, so two runs only differ by the code
+under test.
+"""
+import asyncio
+import hashlib
+import math
+import random
+import re
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+TOPICS = {
+    "astronomy": "star galaxy orbit telescope planet nebula comet gravity light spectrum",
+    "biology": "cell protein gene enzyme membrane tissue organism evolution species dna",
+    "finance": "market bond equity interest rate inflation credit portfolio risk dividend",
+    "cooking": "flour butter oven sauce garlic simmer roast dough spice recipe",
+    "networking": "packet router latency bandwidth socket protocol tcp congestion switch dns",
+    "geology": "rock mineral erosion magma sediment fault plate volcano crystal quartz",
+}
+FILLER = "the a of and in to is that with for on as by this from which are its into".split()
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def _jitter(latency: float, jitter: float, key: str) -> float:
+    # Deterministic per input, so runs are comparable
+    fraction = int(hashlib.md5(key.encode()).hexdigest()[:8], 16) / 0xFFFFFFFF
+    return latency * (1 + jitter * (2 * fraction - 1))
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model answering after ``latency`` seconds (+/- ``jitter``) with a
+    deterministic answer derived from the prompt
+    """
+    latency: float = 0.05
+    jitter: float = 0.2
+    answer_words: int = 40
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake_chat"
+
+    def _result(self, messages) -> ChatResult:
+        prompt = " ".join(str(message.content) for message in messages)
+        words = _words(prompt) or ["empty"]
+        rng = random.Random(hashlib.md5(prompt.encode()).hexdigest())
+        content = " ".join(rng.choice(words) for _ in range(self.answer_words))
+        usage = {"prompt_tokens": len(words), "completion_tokens": self.answer_words,
+                 "total_tokens": len(words) + self.answer_words}
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))],
+                          llm_output={"token_usage": usage, "model_name": "fake"})
+
+    def _delay(self, messages) -> float:
+        return _jitter(self.latency, self.jitter, str(messages[-1].content) if messages else "")
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self._delay(messages))
+        return self._result(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self._delay(messages))
+        return self._result(messages)
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Bag-of-words feature hashing embeddings: texts sharing words are close,
+    which is enough for retrieval to behave like retrieval
+    """
+
+    def __init__(self, size: int = 256, latency: float = 0.0):
+        self.size = size
+        self.latency = latency
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.size
+        for word in _words(text):
+            if word in FILLER:
+                continue
+            digest = hashlib.md5(word.encode()).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.size] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return self._embed(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await asyncio.sleep(self.latency)
+        return self._embed(text)
+
+
+class InMemoryVectorStore:
+    """
+    Exact cosine search over documents kept in memory, with the subset of the
+    pgvector store API used by the routes
+    """
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+        self._documents: Dict[str, Tuple[Document, List[float]]] = {}
+
+    async def aadd_documents(self, documents: Sequence[Document], ids: Optional[List[str]] = None,
+                             **kwargs: Any) -> List[str]:
+        ids = ids or [str(uuid.uuid4()) for _ in documents]
+        vectors = await self.embeddings.aembed_documents([doc.page_content for doc in documents])
+        for id_, doc, vector in zip(ids, documents, vectors):
+            self._documents[id_] = (doc, vector)
+        return ids
+
+    async def adelete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> bool:
+        for id_ in ids or []:
+            self._documents.pop(id_, None)
+        return True
+
+    def _search(self, vector: List[float], k: int) -> List[Tuple[Document, float]]:
+        scored = [(doc, sum(a * b for a, b in zip(vector, other))) for doc, other in self._documents.values()]
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return [(doc, (score + 1) / 2) for doc, score in scored[:k]]
+
+    async def asimilarity_search_with_relevance_scores(self, query: str, k: int = 4,
+                                                       **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self._search(await self.embeddings.aembed_query(query), k)
+
+    async def asimilarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in await self.asimilarity_search_with_relevance_scores(query, k)]
+
+    def get_all_ids(self) -> List[str]:
+        return list(self._documents)
+
+    def get_documents_by_ids(self, ids: List[str]) -> List[Dict]:
+        return [{"id": id_, "page_content": self._documents[id_][0].page_content,
+                 "metadata": self._documents[id_][0].metadata} for id_ in ids if id_ in self._documents]
+
+
+class FakeSummarizer:
+    """
+    TextClusterSummarizer stand-in: chunks the PDF text, then for each
+    iteration groups ``cluster_size`` consecutive nodes and summarizes each
+    group with the model. Returns the chunks and every summary level, like
+    the RAPTOR tree, or streams them level by level with iter_levels.
+    """
+
+    def __init__(self, token_limit: int, data_directory: str, max_iterations: int, model: BaseChatModel,
+                 chunk_words: int = 120, cluster_size: int = 4):
+        self.token_limit = token_limit
+        self.data_directory = data_directory
+        self.max_iterations = max_iterations
+        self.model = model
+        self.chunk_words = chunk_words
+        self.cluster_size = cluster_size
+
+    def iter_levels(self) -> Iterator[List[Document]]:
+        with open(self.data_directory, "rb") as file:
+            words = extract_pdf_text(file.read()).split()
+        level = [" ".join(words[i:i + self.chunk_words]) for i in range(0, len(words), self.chunk_words)]
+        yield [Document(page_content=text, metadata={"level": 0, "source": self.data_directory}) for text in level]
+        for iteration in range(1, self.max_iterations + 1):
+            if len(level) <= 1:
+                break
+            groups = [level[i:i + self.cluster_size] for i in range(0, len(level), self.cluster_size)]
+            level = [self.model.invoke("Summarize:\n" + "\n".join(group)).content for group in groups]
+            yield [Document(page_content=text, metadata={"level": iteration, "source": self.data_directory})
+                   for text in level]
+
+    def run(self) -> List[Document]:
+        return [document for level in self.iter_levels() for document in level]
+
+
+def synthetic_corpus(documents: int = 10, paragraphs: int = 20, seed: int = 0) -> List[Dict]:
+    """
+    Documents of topical paragraphs, each paragraph has an id so questions can
+    name the passage they are about
+    """
+    rng = random.Random(seed)
+    names = sorted(TOPICS)
+    corpus = []
+    for index in range(documents):
+        topic = names[index % len(names)]
+        vocabulary = TOPICS[topic].split()
+        texts = []
+        for paragraph in range(paragraphs):
+            # A rare marker word per paragraph makes every passage findable
+            marker = f"{topic[:3]}{index:02d}p{paragraph:02d}"
+            sentences = []
+            for _ in range(rng.randint(4, 7)):
+                words = [rng.choice(vocabulary if rng.random() < 0.5 else FILLER) for _ in range(rng.randint(8, 14))]
+                sentences.append(" ".join(words).capitalize() + ".")
+            sentences.insert(rng.randint(0, len(sentences)), f"The {marker} record is described here.")
+            texts.append({"id": f"{index}-{paragraph}", "marker": marker, "text": " ".join(sentences)})
+        corpus.append({"name": f"{topic}-{index:02d}.pdf", "topic": topic, "paragraphs": texts})
+    return corpus
+
+
+def _escape_pdf(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(lines: List[str], lines_per_page: int = 50) -> bytes:
+    """
+    Minimal uncompressed PDF with one text line per entry
+    """
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page in pages:
+        stream = "BT /F1 9 Tf 11 TL 40 800 Td\n" + "".join(f"({_escape_pdf(line)}) Tj T*\n" for line in page) + "ET"
+        objects.append(f"<< /Length {len(stream.encode('latin-1', 'replace'))} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1", "replace")
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    output += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(output)
+
+
+def extract_pdf_text(data: bytes) -> str:
+    """
+    Text of a PDF written by write_pdf
+    """
+    strings = re.findall(rb"\(((?:\\.|[^\\)])*)\) Tj", data)
+    return "\n".join(re.sub(rb"\\(.)", rb"\1", s).decode("latin-1") for s in strings)
+
+
+def corpus_pdf(document: Dict, width: int = 90) -> bytes:
+    lines = []
+    for paragraph in document["paragraphs"]:
+        words, line = paragraph["text"].split(), ""
+        for word in words:
+            if len(line) + len(word) + 1 > width:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}".strip()
+        lines += [line, ""]
+    return write_pdf(lines)
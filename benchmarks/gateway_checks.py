@@ -0,0 +1,281 @@
+"""
+Checks of the LLM gateway policies against fake OpenAI-compatible servers
+(benchmarks/fake_llm_server.py). Each check drives real ChatOpenAI clients
+through an LLMGateway and asserts on the outcome and on the number of calls
+every server received:
+
+- fallback order: a failing model is retried, then the next model answers
+  and the ones after it are never called
+- retry budget: against a provider that always fails, retries stay within
+  the budget's reserve plus its ratio of the calls
+- circuit breaker: opens once the window is full of failures, skips the
+  provider while open, sends one trial call after the reset timeout and
+  closes when the trial succeeds
+- hedging: a second request sent after hedge_after answers while the first
+  one is stuck in the tail, and calls without hedging wait for the tail
+- deadline: a call never outlives the gateway deadline
+- agent routing: a LangChain tools agent (langchain~=0.1 as pinned, or
+  later) routed through the gateway falls back with its tools bound
+
+    python -m benchmarks.gateway_checks
+
+Prints the measurements as JSON and exits with status 1 when a check fails.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import httpx
+
+from benchmarks.fake_llm_server import chat_model, start_server
+
+
+class CheckFailed(AssertionError):
+    pass
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        raise CheckFailed(message)
+
+
+def server_calls(port: int) -> int:
+    return httpx.get(f"http://127.0.0.1:{port}/stats").json()["calls"]
+
+
+class Servers:
+    """
+    Fake servers by name, each started on its own port
+    """
+
+    def __init__(self, base_port: int, **servers):
+        self.ports = {name: base_port + i for i, name in enumerate(servers)}
+        self.processes = [start_server(self.ports[name], **options) for name, options in servers.items()]
+        self._before = {}
+
+    def mark(self):
+        self._before = {name: server_calls(port) for name, port in self.ports.items()}
+
+    def calls(self) -> dict:
+        return {name: server_calls(port) - self._before.get(name, 0) for name, port in self.ports.items()}
+
+    def close(self):
+        for process in self.processes:
+            process.terminate()
+
+
+def gateway(servers: Servers, names, breakers=None, budget=None, timeout: float = 5.0, **options):
+    from app.services.llm_gateway import CircuitBreaker, LLMGateway, RetryBudget
+
+    models = [(name, chat_model(servers.ports[name], timeout)) for name in names]
+    if breakers is None:
+        # Breakers that never open, so only the policy under check limits the calls
+        breakers = {name: CircuitBreaker(name, failure_threshold=10 ** 6) for name in names}
+    options.setdefault("deadline", 10.0)
+    return LLMGateway(models, retry_budget=budget or RetryBudget(ratio=1.0, reserve=100.0), backoff_base=0.01,
+                      backoff_max=0.05, breakers=breakers, **options)
+
+
+async def ask(llm_gateway, question: str = "question"):
+    from langchain_core.messages import HumanMessage
+
+    return await llm_gateway.agenerate([HumanMessage(content=question)])
+
+
+async def check_fallback_order(servers: Servers) -> dict:
+    servers.mark()
+    result = await ask(gateway(servers, ["failing", "healthy", "spare"], max_attempts=2))
+    calls = servers.calls()
+    check(result.llm_output["gateway_provider"] == "healthy",
+          f"expected the second model to answer, got {result.llm_output['gateway_provider']}")
+    check(calls["failing"] == 2, f"expected the failing model to be tried max_attempts=2 times, got {calls['failing']}")
+    check(calls["healthy"] == 1, f"expected one call to the second model, got {calls['healthy']}")
+    check(calls["spare"] == 0, f"expected the third model never to be called, got {calls['spare']}")
+
+    servers.mark()
+    result = await ask(gateway(servers, ["rejecting", "healthy"], max_attempts=3))
+    calls = servers.calls()
+    check(result.llm_output["gateway_provider"] == "healthy", "expected the fallback after a non-retryable error")
+    check(calls["rejecting"] == 1, f"expected a 400 not to be retried, got {calls['rejecting']} calls")
+    return {"retryable": "failing x2 -> healthy", "non_retryable": "rejecting x1 -> healthy"}
+
+
+async def check_retry_budget(servers: Servers, calls: int = 30) -> dict:
+    from app.services.llm_gateway import AllModelsFailed, RetryBudget
+
+    ratio, reserve = 0.1, 2.0
+    llm_gateway = gateway(servers, ["failing"], budget=RetryBudget(ratio=ratio, reserve=reserve), max_attempts=3)
+    servers.mark()
+    failed = 0
+    for i in range(calls):
+        try:
+            await ask(llm_gateway, f"question {i}")
+        except AllModelsFailed:
+            failed += 1
+    received = servers.calls()["failing"]
+    retries = received - calls
+    check(failed == calls, f"expected every call to fail, {calls - failed} succeeded")
+    check(retries >= int(reserve), f"expected the reserve of {reserve} retries to be used, got {retries}")
+    check(retries <= reserve + ratio * calls,
+          f"{retries} retries for {calls} calls exceed the budget of {reserve} + {ratio} per call")
+    return {"calls": calls, "retries": retries, "unbudgeted_retries": calls * 2}
+
+
+async def check_circuit_breaker(servers: Servers, window: int = 10, reset: float = 0.5) -> dict:
+    from app.services.llm_gateway import CircuitBreaker
+
+    breaker = CircuitBreaker("failing", failure_threshold=5, reset_timeout=reset, failure_ratio=0.5, window=window)
+    breakers = {"failing": breaker, "healthy": CircuitBreaker("healthy")}
+    llm_gateway = gateway(servers, ["failing", "healthy"], breakers=breakers, max_attempts=1)
+    servers.mark()
+    for i in range(2 * window):
+        result = await ask(llm_gateway, f"question {i}")
+        check(result.llm_output["gateway_provider"] == "healthy", "expected every call to fall back")
+    calls = servers.calls()
+    opened = {"calls": 2 * window, "failing_calls": calls["failing"]}
+    check(breaker.state == CircuitBreaker.OPEN, f"expected the breaker to open, state {breaker.state}")
+    check(calls["failing"] == window,
+          f"expected the failing provider to be skipped once {window} calls filled the window, got {calls['failing']}")
+
+    await asyncio.sleep(reset)
+    servers.mark()
+    await ask(llm_gateway)
+    await ask(llm_gateway)
+    calls = servers.calls()
+    check(calls["failing"] == 1, f"expected a single trial call after the reset timeout, got {calls['failing']}")
+    check(breaker.state == CircuitBreaker.OPEN, "expected the failed trial to reopen the breaker")
+
+    # The provider recovered: the same breaker in front of a healthy server closes on the trial call
+    await asyncio.sleep(reset)
+    recovered = gateway(servers, ["healthy"], breakers={"healthy": breaker}, max_attempts=1)
+    await ask(recovered)
+    check(breaker.state == CircuitBreaker.CLOSED,
+          f"expected a successful trial to close the breaker, state {breaker.state}")
+    return opened
+
+
+async def check_hedging(servers: Servers, calls: int = 4, hedge_after: float = 0.2, tail: float = 2.0) -> dict:
+    from app.services.llm_gateway import RetryBudget
+
+    async def timed(llm_gateway):
+        latencies = []
+        for i in range(calls):
+            started = time.perf_counter()
+            await ask(llm_gateway, f"question {i}")
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    # Every other call to the server is slow: the first attempt of each question, never its hedge
+    servers.mark()
+    hedged = await timed(gateway(servers, ["tail"], max_attempts=1, hedge_after=hedge_after))
+    hedged_calls = servers.calls()["tail"]
+    check(max(hedged) < tail / 2, f"expected the hedge to answer before the tail, latencies {hedged}")
+    check(hedged_calls == 2 * calls, f"expected one hedge per question, server got {hedged_calls} calls")
+
+    # With an empty retry budget no hedge is sent
+    servers.mark()
+    unhedged = await timed(gateway(servers, ["tail"], budget=RetryBudget(ratio=0.0, reserve=0.0), max_attempts=1,
+                                   hedge_after=hedge_after))
+    check(min(unhedged[0::2]) >= tail * 0.9, f"expected calls without a hedge to wait for the tail, {unhedged}")
+    return {"hedged_max_s": round(max(hedged), 3), "unhedged_max_s": round(max(unhedged), 3)}
+
+
+async def check_deadline(servers: Servers, deadline: float = 0.5) -> dict:
+    from app.services.llm_gateway import DeadlineExceeded
+
+    llm_gateway = gateway(servers, ["slow"], deadline=deadline, max_attempts=3)
+    started = time.perf_counter()
+    try:
+        await ask(llm_gateway)
+        raise CheckFailed("expected the call to the slow server to exceed the deadline")
+    except DeadlineExceeded:
+        elapsed = time.perf_counter() - started
+    check(elapsed < deadline + 0.25, f"call took {elapsed:.2f}s with a {deadline}s deadline")
+    return {"deadline_s": deadline, "elapsed_s": round(elapsed, 3)}
+
+
+async def check_agent_routing(servers: Servers) -> dict:
+    try:
+        from langchain.agents import AgentExecutor, create_openai_tools_agent
+    except ImportError:
+        return {"skipped": "langchain is not installed"}
+    from langchain_core import __version__ as core_version
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain_core.tools import tool
+
+    from app.services.llm_gateway import GatewayChatModel, route_through_gateway
+    from app.services.tool_cache import copy_model
+
+    @tool
+    def search(query: str) -> str:
+        """Search the documents"""
+        return query
+
+    prompt = ChatPromptTemplate.from_messages([("human", "{input}"), MessagesPlaceholder("agent_scratchpad")])
+    agent = create_openai_tools_agent(chat_model(servers.ports["spare"], 5.0), [search], prompt)
+    executor = AgentExecutor(agent=agent, tools=[search])
+    model = GatewayChatModel(gateway=gateway(servers, ["failing", "healthy"], max_attempts=1),
+                             model_names=["failing", "healthy"], stage="agent")
+    routed, replaced = route_through_gateway(executor.agent, model)
+    check(replaced == 1, f"expected the agent's chat model to be replaced, {replaced} were")
+    servers.mark()
+    before = httpx.get(f"http://127.0.0.1:{servers.ports['healthy']}/stats").json()["with_tools"]
+    result = await copy_model(executor, agent=routed).ainvoke({"input": "question"})
+    calls = servers.calls()
+    with_tools = httpx.get(f"http://127.0.0.1:{servers.ports['healthy']}/stats").json()["with_tools"] - before
+    check(calls["spare"] == 0, f"expected the agent's own model not to be called, got {calls['spare']} calls")
+    check(calls["failing"] == 1 and calls["healthy"] == 1,
+          f"expected one call to each gateway model, got {calls['failing']} and {calls['healthy']}")
+    check(with_tools == 1, "expected the fallback model to receive the agent's tools")
+    check(result["output"].startswith(f"Answer from fake-{servers.ports['healthy']}"),
+          f"unexpected agent output {result['output']!r}")
+    return {"langchain_core": core_version, "replaced": replaced}
+
+
+CHECKS = {
+    "fallback_order": check_fallback_order,
+    "retry_budget": check_retry_budget,
+    "circuit_breaker": check_circuit_breaker,
+    "hedging": check_hedging,
+    "deadline": check_deadline,
+    "agent_routing": check_agent_routing,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-port", type=int, default=9111)
+    parser.add_argument("--only", choices=sorted(CHECKS), nargs="*")
+    args = parser.parse_args()
+
+    servers = Servers(args.base_port,
+                      failing={"latency": 0.01, "error_rate": 1.0},
+                      rejecting={"latency": 0.01, "error_rate": 1.0, "error_status": 400},
+                      healthy={"latency": 0.01},
+                      spare={"latency": 0.01},
+                      tail={"latency": 0.01, "tail_every": 2, "tail_latency": 2.0},
+                      slow={"latency": 5.0})
+
+    async def run_all() -> dict:
+        # One event loop for every check, the provider SDK clients are bound to it
+        results = {}
+        for name in args.only or CHECKS:
+            try:
+                results[name] = {"ok": True, **await CHECKS[name](servers)}
+            except CheckFailed as e:
+                results[name] = {"ok": False, "error": str(e)}
+        return results
+
+    try:
+        results = asyncio.run(run_all())
+    finally:
+        servers.close()
+    print(json.dumps(results, indent=2))
+    if not all(result["ok"] for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
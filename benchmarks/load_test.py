@@ -0,0 +1,140 @@
+"""
+HTTP load test of the production launcher across worker counts.
+
+For each worker count a server is started through appfrwk.server.run()
+with a CPU-bound endpoint (hashing for --cpu-ms per request, standing in for
+prompt assembly, JSON work and token counting), then several client
+processes hammer it for --duration seconds. Throughput should grow with the
+worker count up to the number of cores:
+
+    python -m benchmarks.load_test --workers 1,2,4 --clients 4 --concurrency 32
+
+Use --url to load an already running server instead, e.g.
+``--url http://localhost:8000/health/live``.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+
+SERVER = ("from appfrwk.server import run; "
+          "run('benchmarks.load_test:create_bench_app', workers={workers}, port={port}, reload=False)")
+
+
+def create_bench_app():
+    from fastapi import FastAPI
+
+    from appfrwk.logging_config import setup_logging
+    from appfrwk.logging_config.log_middleware import LogMiddleware
+
+    setup_logging()
+    cpu_seconds = float(os.getenv("BENCH_CPU_MS", "5")) / 1000
+    app = FastAPI()
+    app.add_middleware(LogMiddleware)
+
+    @app.get("/cpu")
+    def cpu():
+        digest = b""
+        deadline = time.perf_counter() + cpu_seconds
+        while time.perf_counter() < deadline:
+            digest = hashlib.sha256(digest).digest()
+        return {"digest": digest.hex()}
+
+    @app.get("/noop")
+    async def noop():
+        return {"ok": True}
+
+    return app
+
+
+async def _client(url: str, concurrency: int, duration: float) -> list:
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(url)
+                    response.raise_for_status()
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return [latencies, errors]
+
+
+def _client_process(args) -> list:
+    return asyncio.run(_client(*args))
+
+
+def load(url: str, clients: int, concurrency: int, duration: float) -> dict:
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.map(_client_process, [(url, concurrency, duration)] * clients)
+    latencies = sorted(latency for result in results for latency in result[0])
+    errors = sum(result[1] for result in results)
+    return {
+        "requests_per_sec": round(len(latencies) / duration, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2) if latencies else None,
+        "p99_ms": round(latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000, 2) if latencies else None,
+        "errors": errors,
+    }
+
+
+def wait_until_up(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not come up")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default=",".join(str(n) for n in sorted({1, 2, os.cpu_count() or 1})))
+    parser.add_argument("--clients", type=int, default=2, help="client processes")
+    parser.add_argument("--concurrency", type=int, default=32, help="connections per client process")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--cpu-ms", type=float, default=5.0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--url", help="load this URL instead of starting servers")
+    args = parser.parse_args()
+
+    if args.url:
+        print(json.dumps(load(args.url, args.clients, args.concurrency, args.duration), indent=2))
+        return
+
+    results = {"cpu_count": os.cpu_count()}
+    base = f"http://127.0.0.1:{args.port}"
+    for workers in (int(count) for count in args.workers.split(",")):
+        env = dict(os.environ, BENCH_CPU_MS=str(args.cpu_ms), DEBUG="false")
+        server = subprocess.Popen([sys.executable, "-c", SERVER.format(workers=workers, port=args.port)], env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_until_up(f"{base}/noop")
+            results[f"workers={workers}"] = load(f"{base}/cpu", args.clients, args.concurrency, args.duration)
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=60)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
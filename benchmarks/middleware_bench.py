@@ -0,0 +1,109 @@
+"""
+Request throughput of the logging middleware on a no-op route.
+
+Compares no middleware, the previous BaseHTTPMiddleware-based
+implementation and the pure ASGI LogMiddleware, driving the app in-process
+through httpx's ASGI transport so only application overhead is measured.
+
+    python -m benchmarks.middleware_bench --requests 5000 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import random
+import string
+import time
+
+import httpx
+from fastapi import FastAPI
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from appfrwk.logging_config import get_logger, setup_logging
+from appfrwk.logging_config.log_middleware import LogMiddleware
+
+
+class BaseHTTPLogMiddleware(BaseHTTPMiddleware):
+    """
+    The previous LogMiddleware, kept here as the benchmark baseline
+    """
+    async def dispatch(self, request, call_next):
+        request_logger = get_logger('request')
+        request_processing_logger = get_logger('request_processing')
+        rid = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+        request_processing_logger.info(f"Received rid={rid} Starting path={request.url.path}")
+        start_time = time.monotonic()
+        response = await call_next(request)
+        request_logger.info(
+            f"Rid={rid}",
+            extra={
+                "request": {
+                    "url": str(request.url),
+                    "remote_address": request.client.host,
+                    "method": request.method,
+                    "path": request.url.path,
+                    "ip": request.headers.get("X-Forwarded-For", request.client.host),
+                    "host": request.headers.get("host", "unknown"),
+                    "request_args": dict(request.query_params),
+                },
+                "response": {"status_code": response.status_code},
+            },
+        )
+        process_time = (time.monotonic() - start_time) * 1000
+        request_processing_logger.info(
+            f"Ended rid={rid} Time to process={process_time:.2f}ms Status Code={response.status_code}")
+        return response
+
+
+def build_app(middleware=None) -> FastAPI:
+    app = FastAPI()
+    if middleware is not None:
+        app.add_middleware(middleware)
+
+    @app.get("/noop")
+    async def noop():
+        return {"ok": True}
+
+    return app
+
+
+async def run(app: FastAPI, requests: int, concurrency: int) -> dict:
+    transport = httpx.ASGITransport(app=app, client=("127.0.0.1", 12345))
+    latencies = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.get("/noop")
+        remaining = iter(range(requests))
+
+        async def worker():
+            for _ in remaining:
+                started = time.perf_counter()
+                response = await client.get("/noop", params={"q": "1"})
+                latencies.append(time.perf_counter() - started)
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests_per_sec": round(requests / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    setup_logging()
+    results = {}
+    for name, middleware in (("none", None), ("base_http_middleware", BaseHTTPLogMiddleware),
+                             ("asgi_log_middleware", LogMiddleware)):
+        results[name] = asyncio.run(run(build_app(middleware), args.requests, args.concurrency))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
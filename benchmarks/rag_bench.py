@@ -0,0 +1,260 @@
+"""
+Offline benchmark of the /RAG routes.
+
+The real FastAPI app (routes, middleware, pipelines, admission) runs
+in-process behind httpx; only the providers are swapped through
+app.dependency_overrides for the deterministic fakes of benchmarks.fakes:
+a chat model and embeddings with configurable latency, and an in-memory
+vector store (or the local pgvector store of DATABASE_URL2 with --store
+pgvector). Synthetic PDFs and conversations are generated from a seed.
+
+Three phases are measured, each reporting throughput, p50/p95/p99 latency,
+errors and memory (RSS growth, and the Python heap peak with --trace-memory):
+
+- ingest: POST /RAG/add-documents-upload with the synthetic PDFs
+- retrieval: POST /RAG/rag_chain_with_source/ with questions about them
+- chat: POST /RAG/rag_chain_chat/ turns in new conversations; this phase
+  needs the conversation database of DATABASE_URL migrated (alembic upgrade
+  head), skip it with --chat 0
+
+Results are written as JSON; --compare prints the change against an
+earlier result file:
+
+    python -m benchmarks.rag_bench --output bench-results/before.json
+    python -m benchmarks.rag_bench --output bench-results/after.json --compare bench-results/before.json
+
+--expansion multi_query hyde measures the latency cost of query expansion.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+
+import httpx
+
+from benchmarks.fakes import FakeChatModel, FakeSummarizer, HashEmbeddings, InMemoryVectorStore, corpus_pdf, \
+    synthetic_corpus
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return round(values[max(int(len(values) * fraction) - 1, 0)] * 1000, 2) if values else None
+
+
+async def run_phase(calls, concurrency: int, trace_memory: bool) -> dict:
+    """
+    Run the call factories with bounded concurrency, each returns an httpx response
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], {}
+    rss_before = rss_mb()
+    if trace_memory:
+        tracemalloc.start()
+
+    async def run(call):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                status = (await call()).status_code
+            except Exception as e:
+                status = type(e).__name__
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run(call) for call in calls))
+    elapsed = time.perf_counter() - started
+    result = {
+        "requests": len(calls),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": percentile(latencies, 0.5),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "statuses": {str(status): count for status, count in statuses.items()},
+        "rss_growth_mb": round(rss_mb() - rss_before, 1),
+    }
+    if trace_memory:
+        result["python_heap_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        tracemalloc.stop()
+    return result
+
+
+def build_store(args, embeddings):
+    if args.store == "memory":
+        return InMemoryVectorStore(embeddings)
+    from RagLLM.PGvector.store import AsnyPgVector
+
+    from app.services.vector_stores import get_sync_engine
+    from appfrwk.config import get_config
+
+    config = get_config()
+    return AsnyPgVector(connection_string=config.DATABASE_URL2, embedding_function=embeddings,
+                        collection_name=f"bench_{int(time.time())}", connection=get_sync_engine(config.DATABASE_URL2))
+
+
+def build_app(args):
+    from app import create_app
+    from app.api import dependencies
+    from appfrwk.config import get_config
+
+    config = get_config()
+    config.ADMISSION_ENABLED = args.admission
+    config.QUERY_EXPANSION = args.expansion
+
+    app = create_app()
+    model = FakeChatModel(latency=args.llm_latency)
+    summary_model = FakeChatModel(latency=args.summary_latency)
+    store = build_store(args, HashEmbeddings(latency=args.embedding_latency))
+
+    def summarizer_factory(data_directory: str, max_iterations: int):
+        if args.real_summarizer:
+            return dependencies.create_summarizer(data_directory, max_iterations)
+        return FakeSummarizer(16000, data_directory, max_iterations, summary_model)
+
+    expanders = dependencies.create_query_expanders(FakeChatModel(latency=args.expansion_latency))
+    source_pipeline = dependencies.build_answer_pipeline("rag_chain_with_source", store, model, expanders)
+    chat_pipeline = dependencies.build_chat_pipeline(store, model, model, expanders)
+    app.dependency_overrides[dependencies.get_vector_store] = lambda: store
+    app.dependency_overrides[dependencies.get_source_pipeline] = lambda: source_pipeline
+    app.dependency_overrides[dependencies.get_chat_pipeline] = lambda: chat_pipeline
+    app.dependency_overrides[dependencies.get_summarizer_factory] = lambda: summarizer_factory
+    return app
+
+
+def questions(corpus, count: int, seed: int):
+    rng = random.Random(seed)
+    paragraphs = [(doc, paragraph) for doc in corpus for paragraph in doc["paragraphs"]]
+    for _ in range(count):
+        doc, paragraph = rng.choice(paragraphs)
+        words = [word for word in paragraph["text"].split() if len(word) > 4]
+        yield f"What does the {paragraph['marker']} record say about {' '.join(rng.sample(words, 3))}?"
+
+
+async def bench(args) -> dict:
+    app = build_app(args)
+    corpus = synthetic_corpus(args.docs, args.paragraphs, args.seed)
+    pdfs = [(doc["name"], corpus_pdf(doc)) for doc in corpus]
+    transport = httpx.ASGITransport(app=app, client=("127.0.0.1", 4321))
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+        def upload(name, data):
+            return lambda: client.post("/RAG/add-documents-upload", params={"max_iteration": args.max_iteration},
+                                       files={"pdf_file": (name, data, "application/pdf")})
+
+        results["ingest"] = await run_phase([upload(name, data) for name, data in pdfs],
+                                            args.ingest_concurrency, args.trace_memory)
+
+        def ask(question):
+            return lambda: client.post("/RAG/rag_chain_with_source/", json={"question": question})
+
+        results["retrieval"] = await run_phase([ask(q) for q in questions(corpus, args.queries, args.seed)],
+                                               args.concurrency, args.trace_memory)
+
+        if args.chat:
+            turns = list(questions(corpus, args.chat * args.turns, args.seed + 1))
+
+            def conversation(index):
+                async def call():
+                    created = await client.post("/RAG/create-conversation", json={"user_sub": f"bench-{index}"})
+                    if created.status_code != 200:
+                        return created
+                    conversation_id = created.json()["id"]
+                    response = created
+                    for turn in turns[index * args.turns:(index + 1) * args.turns]:
+                        response = await client.post("/RAG/rag_chain_chat/",
+                                                     json={"conversation_id": conversation_id, "message": turn})
+                        if response.status_code != 200:
+                            break
+                    return response
+                return call
+
+            results["chat"] = await run_phase([conversation(i) for i in range(args.chat)],
+                                              args.concurrency, args.trace_memory)
+            results["chat"]["turns_per_conversation"] = args.turns
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current: dict, previous: dict) -> dict:
+    changes = {}
+    for phase, stats in current["phases"].items():
+        before = previous.get("phases", {}).get(phase)
+        if not before:
+            continue
+        changes[phase] = {key: f"{before[key]} -> {value} ({(value - before[key]) / before[key]:+.1%})"
+                          for key, value in stats.items()
+                          if isinstance(value, (int, float)) and isinstance(before.get(key), (int, float))
+                          and before[key]}
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=6)
+    parser.add_argument("--paragraphs", type=int, default=30, help="paragraphs per synthetic PDF")
+    parser.add_argument("--max-iteration", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--chat", type=int, default=20, help="conversations, 0 skips the chat phase")
+    parser.add_argument("--turns", type=int, default=3, help="messages per conversation")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--ingest-concurrency", type=int, default=2)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--summary-latency", type=float, default=0.02)
+    parser.add_argument("--embedding-latency", type=float, default=0.005)
+    parser.add_argument("--expansion", nargs="*", default=[], choices=["multi_query", "hyde"],
+                        help="query expansion modes of the retrieval and chat phases")
+    parser.add_argument("--expansion-latency", type=float, default=0.03)
+    parser.add_argument("--store", choices=["memory", "pgvector"], default="memory")
+    parser.add_argument("--real-summarizer", action="store_true",
+                        help="use RagLLM's TextClusterSummarizer (calls its own providers)")
+    parser.add_argument("--admission", action="store_true", help="keep admission control and rate limits on")
+    parser.add_argument("--trace-memory", action="store_true", help="also report the Python heap peak (slower)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    result = {
+        "revision": git_revision(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "phases": asyncio.run(bench(args)),
+    }
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            result["compared_to"] = args.compare
+            result["changes"] = compare(result, json.load(file))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(result, file, indent=2)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
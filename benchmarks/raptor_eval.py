@@ -0,0 +1,300 @@
+"""
+Retrieval quality and latency of RAPTOR ingestion settings.
+
+A fixed corpus is ingested once per summarizer configuration
+(token_limit:max_iterations). Then a question set with known relevant
+passages runs through each retrieval mode:
+
+- collapsed: every tree node, like the pgvector store the app queries
+- leaves: only the level 0 chunks
+- summaries: only the summary levels
+
+For each configuration, mode and k the report gives recall@k, MRR, mean
+context tokens of the top k, query latency percentiles and the ingestion
+time:
+
+    python -m benchmarks.raptor_eval --configs 16000:1,16000:3,8000:3 --top-k 3,5,10
+
+The corpus is a directory of PDFs plus a questions JSONL file. Each line
+holds {"question": ..., "relevant": ["passage text or marker", ...]}. A
+retrieved node counts as relevant when it contains one of those strings.
+Without --corpus, a seeded synthetic corpus is written to the cache
+directory and used, so runs are comparable across machines.
+
+Summarization trees, node embeddings, query embeddings and summary
+completions are cached in --cache-dir (sqlite). Each is keyed by its
+inputs, so a sweep only recomputes the stages whose inputs changed.
+For example, raising max_iterations reuses the cached lower levels.
+--summarizer ragllm uses RagLLM's TextClusterSummarizer and --embeddings
+openai uses the app's OpenAI embeddings. The defaults are the offline
+fakes from benchmarks.fakes.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from benchmarks.fakes import FakeChatModel, FakeSummarizer, HashEmbeddings, InMemoryVectorStore, corpus_pdf, \
+    synthetic_corpus
+
+MODES = {
+    "collapsed": lambda level: True,
+    "leaves": lambda level: level == 0,
+    "summaries": lambda level: level > 0,
+}
+
+
+def digest(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ArtifactCache:
+    """
+    JSON artifacts in a sqlite file, keyed by kind and a digest of their inputs
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(directory, "artifacts.sqlite3"))
+        self.connection.execute("CREATE TABLE IF NOT EXISTS artifacts "
+                                "(kind TEXT, key TEXT, value TEXT, PRIMARY KEY (kind, key))")
+        self.hits = {}
+        self.misses = {}
+
+    def get_many(self, kind: str, keys: List[str]) -> Dict[str, object]:
+        found = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.connection.execute(
+                f"SELECT key, value FROM artifacts WHERE kind = ? AND key IN ({','.join('?' * len(chunk))})",
+                [kind, *chunk])
+            found.update((key, json.loads(value)) for key, value in rows)
+        self.hits[kind] = self.hits.get(kind, 0) + len(found)
+        self.misses[kind] = self.misses.get(kind, 0) + len(set(keys) - set(found))
+        return found
+
+    def put_many(self, kind: str, values: Dict[str, object]):
+        self.connection.executemany("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?)",
+                                    [(kind, key, json.dumps(value)) for key, value in values.items()])
+        self.connection.commit()
+
+    def get_or_compute(self, kind: str, key: str, compute: Callable[[], object]):
+        found = self.get_many(kind, [key])
+        if key in found:
+            return found[key]
+        value = compute()
+        self.put_many(kind, {key: value})
+        return value
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings looked up by model and text digest before calling the model
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: ArtifactCache, namespace: str):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.namespace = namespace
+
+    def _key(self, text: str) -> str:
+        return digest(self.namespace, text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        found = self.cache.get_many("embedding", keys)
+        missing = [(key, text) for key, text in zip(keys, texts) if key not in found]
+        if missing:
+            vectors = self.embeddings.embed_documents([text for _, text in missing])
+            computed = {key: vector for (key, _), vector in zip(missing, vectors)}
+            self.cache.put_many("embedding", computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self.embed_query(text)
+
+
+class CachedSummaryModel(FakeChatModel):
+    """
+    Summary completions cached by prompt, so deeper trees reuse the levels
+    already summarized for a shallower configuration
+    """
+    artifacts: object = None
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        from langchain_core.messages import AIMessage
+        from langchain_core.outputs import ChatGeneration, ChatResult
+
+        prompt = "\n".join(str(message.content) for message in messages)
+        generate = super()._generate
+        content = self.artifacts.get_or_compute("completion", digest("fake", self.answer_words, prompt),
+                                                lambda: generate(messages).generations[0].message.content)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+
+def write_synthetic_corpus(directory: str, documents: int, seed: int) -> str:
+    """
+    Write seeded synthetic PDFs and a question per paragraph, returns the questions file
+    """
+    os.makedirs(directory, exist_ok=True)
+    questions = []
+    for document in synthetic_corpus(documents, 20, seed):
+        with open(os.path.join(directory, document["name"]), "wb") as file:
+            file.write(corpus_pdf(document))
+        for paragraph in document["paragraphs"]:
+            questions.append({"question": f"What is said about the {paragraph['marker']} record?",
+                              "relevant": [paragraph["marker"]]})
+    path = os.path.join(directory, "questions.jsonl")
+    with open(path, "w", encoding="utf-8") as file:
+        file.writelines(json.dumps(question) + "\n" for question in questions)
+    return path
+
+
+def build_tree(path: str, token_limit: int, max_iterations: int, args, cache: ArtifactCache) -> dict:
+    with open(path, "rb") as file:
+        file_digest = hashlib.sha256(file.read()).hexdigest()
+
+    def compute():
+        started = time.perf_counter()
+        if args.summarizer == "ragllm":
+            from app.api.dependencies import create_summarizer
+
+            summarizer = create_summarizer(path, max_iterations, token_limit)
+        else:
+            model = CachedSummaryModel(latency=args.summary_latency, artifacts=cache)
+            summarizer = FakeSummarizer(token_limit, path, max_iterations, model,
+                                        chunk_words=max(token_limit // 130, 20))
+        nodes = [{"text": doc.page_content, "metadata": doc.metadata} for doc in summarizer.run()]
+        return {"nodes": nodes, "elapsed_s": time.perf_counter() - started}
+
+    return cache.get_or_compute("tree", digest(file_digest, args.summarizer, token_limit, max_iterations), compute)
+
+
+def node_level(metadata: dict) -> int:
+    try:
+        return int(metadata.get("level", 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+async def evaluate(args) -> dict:
+    from app.services.context_assembly import count_tokens
+
+    cache = ArtifactCache(args.cache_dir)
+    corpus = args.corpus or os.path.join(args.cache_dir, f"synthetic-{args.synthetic_docs}-{args.seed}")
+    questions_path = args.questions or os.path.join(corpus, "questions.jsonl")
+    if not args.corpus and not os.path.exists(questions_path):
+        write_synthetic_corpus(corpus, args.synthetic_docs, args.seed)
+    with open(questions_path, encoding="utf-8") as file:
+        questions = [json.loads(line) for line in file if line.strip()]
+    files = sorted(os.path.join(corpus, name) for name in os.listdir(corpus) if name.lower().endswith(".pdf"))
+
+    if args.embeddings == "openai":
+        from app.api.dependencies import get_embeddings
+
+        embeddings = CachedEmbeddings(get_embeddings(), cache, "openai")
+    else:
+        embeddings = CachedEmbeddings(HashEmbeddings(latency=args.embedding_latency), cache, "hash")
+    top_ks = sorted(int(k) for k in args.top_k.split(","))
+
+    report = {}
+    for config in args.configs.split(","):
+        token_limit, max_iterations = (int(value) for value in config.split(":"))
+        started = time.perf_counter()
+        trees = [build_tree(path, token_limit, max_iterations, args, cache) for path in files]
+        nodes = [node for tree in trees for node in tree["nodes"]]
+        ingestion = {
+            "documents": len(files),
+            "nodes": len(nodes),
+            "levels": max((node_level(node["metadata"]) for node in nodes), default=0) + 1,
+            "summarize_s": round(sum(tree["elapsed_s"] for tree in trees), 3),
+        }
+        for mode, include in MODES.items():
+            store = InMemoryVectorStore(embeddings)
+            selected = [Document(page_content=node["text"], metadata=node["metadata"]) for node in nodes
+                        if include(node_level(node["metadata"]))]
+            embed_started = time.perf_counter()
+            if selected:
+                await store.aadd_documents(selected)
+            embed_s = time.perf_counter() - embed_started
+
+            latencies, recalls, reciprocal_ranks, context_tokens = [], {k: [] for k in top_ks}, [], {k: [] for k in top_ks}
+            for question in questions:
+                query_started = time.perf_counter()
+                ranked = await store.asimilarity_search_with_relevance_scores(question["question"], k=top_ks[-1])
+                latencies.append(time.perf_counter() - query_started)
+                relevant = question["relevant"]
+                hits = [[needle for needle in relevant if needle in doc.page_content] for doc, _ in ranked]
+                first = next((rank for rank, found in enumerate(hits, start=1) if found), None)
+                reciprocal_ranks.append(1 / first if first else 0.0)
+                for k in top_ks:
+                    found = {needle for found in hits[:k] for needle in found}
+                    recalls[k].append(len(found) / len(relevant) if relevant else 0.0)
+                    context_tokens[k].append(sum(count_tokens(doc.page_content, args.encoding)
+                                                 for doc, _ in ranked[:k]))
+            latencies.sort()
+            report[f"{config}/{mode}"] = {
+                **ingestion,
+                "indexed_nodes": len(selected),
+                "embed_s": round(embed_s, 3),
+                **{f"recall@{k}": round(sum(recalls[k]) / len(questions), 3) for k in top_ks},
+                "mrr": round(sum(reciprocal_ranks) / len(questions), 3),
+                **{f"context_tokens@{k}": round(sum(context_tokens[k]) / len(questions), 1) for k in top_ks},
+                "query_p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+                "query_p95_ms": round(latencies[max(int(len(latencies) * 0.95) - 1, 0)] * 1000, 2),
+            }
+        report[f"{config}/collapsed"]["wall_s"] = round(time.perf_counter() - started, 3)
+    return {"questions": len(questions), "results": report,
+            "cache": {"hits": cache.hits, "misses": cache.misses}}
+
+
+def print_table(report: dict, top_ks: List[int]):
+    columns = ["nodes", *[f"recall@{k}" for k in top_ks], "mrr", *[f"context_tokens@{k}" for k in top_ks],
+               "query_p95_ms", "summarize_s"]
+    print(f"{'config/mode':<24}" + "".join(f"{column:>18}" for column in columns))
+    for name, row in report["results"].items():
+        print(f"{name:<24}" + "".join(f"{str(row.get(column)):>18}" for column in columns))
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="directory of PDFs, a synthetic corpus is used when omitted")
+    parser.add_argument("--questions", help="questions JSONL, defaults to CORPUS/questions.jsonl")
+    parser.add_argument("--configs", default="16000:1,16000:3,4000:3", help="token_limit:max_iterations,...")
+    parser.add_argument("--top-k", default="3,5,10")
+    parser.add_argument("--summarizer", choices=["fake", "ragllm"], default="fake")
+    parser.add_argument("--embeddings", choices=["hash", "openai"], default="hash")
+    parser.add_argument("--summary-latency", type=float, default=0.0)
+    parser.add_argument("--embedding-latency", type=float, default=0.0)
+    parser.add_argument("--encoding", default="cl100k_base")
+    parser.add_argument("--synthetic-docs", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache-dir", default=".eval_cache")
+    parser.add_argument("--output", help="write the report to this JSON file")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(evaluate(args))
+    report["parameters"] = vars(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    print_table(report, sorted(int(k) for k in args.top_k.split(",")))
+    print(json.dumps(report["cache"]))
+
+
+if __name__ == "__main__":
+    main()
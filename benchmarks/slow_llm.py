@@ -0,0 +1,162 @@
+"""
+Burst test of admission control against a simulated slow LLM provider.
+
+The stand-in provider answers after --latency seconds and returns a 429
+once more than --provider-limit calls are in flight; handlers retry those
+like the provider SDKs do. A burst of interactive chat requests from
+several users and background ingestion requests is sent with admission
+control off and on, and the outcome per request kind, the provider 429s
+and the latency of successful requests are compared. The requests are
+anonymous, so each user sends them from its own client address:
+
+    python -m benchmarks.slow_llm --chat 200 --ingest 20 --users 20
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+
+import httpx
+from fastapi import Depends, FastAPI, HTTPException
+
+from appfrwk.admission import PRIORITY_BACKGROUND, admission, get_admission_controller, get_rate_limiter
+from appfrwk.config import get_config
+
+
+class ProviderRateLimited(Exception):
+    pass
+
+
+class SlowLLMProvider:
+    """
+    Answers after a fixed latency, rejects calls beyond its concurrency limit
+    """
+
+    def __init__(self, latency: float, limit: int):
+        self.latency = latency
+        self.limit = limit
+        self.active = 0
+        self.calls = 0
+        self.rate_limited = 0
+
+    async def complete(self, prompt: str) -> str:
+        self.calls += 1
+        if self.active >= self.limit:
+            self.rate_limited += 1
+            raise ProviderRateLimited()
+        self.active += 1
+        try:
+            await asyncio.sleep(self.latency * random.uniform(0.8, 1.2))
+            return f"answer to {prompt}"
+        finally:
+            self.active -= 1
+
+    async def complete_with_retries(self, prompt: str, retries: int = 3, backoff: float = 0.25) -> str:
+        for attempt in range(retries + 1):
+            try:
+                return await self.complete(prompt)
+            except ProviderRateLimited:
+                if attempt == retries:
+                    raise HTTPException(status_code=502, detail="Provider rate limited")
+                await asyncio.sleep(backoff * 2 ** attempt)
+
+
+def build_app(provider: SlowLLMProvider, ingest_calls: int) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/chat", dependencies=[Depends(admission("rag_chain_chat"))])
+    async def chat():
+        return {"answer": await provider.complete_with_retries("chat")}
+
+    @app.post("/ingest", dependencies=[Depends(admission("ingestion", PRIORITY_BACKGROUND))])
+    async def ingest():
+        # Ingestion summarizes several clusters one after another
+        for _ in range(ingest_calls):
+            await provider.complete_with_retries("summary")
+        return {"ok": True}
+
+    return app
+
+
+async def burst(args, enabled: bool) -> dict:
+    config = get_config()
+    config.ADMISSION_ENABLED = enabled
+    config.ADMISSION_CAPACITY = args.capacity
+    config.ADMISSION_ROUTE_LIMITS = {"ingestion": args.ingest_limit}
+    config.ADMISSION_MAX_WAIT = args.max_wait
+    config.ADMISSION_MAX_QUEUE = args.max_queue
+    config.RATE_LIMIT_PER_MINUTE = args.user_rate
+    config.RATE_LIMIT_BURST = args.user_burst
+    get_admission_controller.cache_clear()
+    get_rate_limiter.cache_clear()
+
+    provider = SlowLLMProvider(args.latency, args.provider_limit)
+    app = build_app(provider, args.ingest_calls)
+    statuses = {"chat": Counter(), "ingest": Counter()}
+    latencies = {"chat": [], "ingest": []}
+
+    def user_client(user: int) -> httpx.AsyncClient:
+        address = f"10.0.{user // 250}.{user % 250 + 1}"
+        transport = httpx.ASGITransport(app=app, client=(address, 1234))
+        return httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120)
+
+    clients = [user_client(user) for user in range(args.users)]
+
+    async def call(kind: str, user: int):
+        started = time.perf_counter()
+        response = await clients[user].post(f"/{kind}")
+        statuses[kind][response.status_code] += 1
+        if response.status_code == 200:
+            latencies[kind].append(time.perf_counter() - started)
+
+    calls = [call("chat", i % args.users) for i in range(args.chat)]
+    calls += [call("ingest", i % args.users) for i in range(args.ingest)]
+    random.shuffle(calls)
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*calls)
+    finally:
+        await asyncio.gather(*(client.aclose() for client in clients))
+    elapsed = time.perf_counter() - started
+
+    def percentile(values, fraction):
+        values = sorted(values)
+        return round(values[max(int(len(values) * fraction) - 1, 0)], 3) if values else None
+
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "provider_calls": provider.calls,
+        "provider_429s": provider.rate_limited,
+        **{f"{kind}_status": dict(statuses[kind]) for kind in statuses},
+        **{f"{kind}_p50_s": percentile(latencies[kind], 0.5) for kind in latencies},
+        **{f"{kind}_p99_s": percentile(latencies[kind], 0.99) for kind in latencies},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chat", type=int, default=200)
+    parser.add_argument("--ingest", type=int, default=20)
+    parser.add_argument("--ingest-calls", type=int, default=3, help="provider calls per ingestion request")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--provider-limit", type=int, default=16)
+    parser.add_argument("--capacity", type=int, default=16)
+    parser.add_argument("--ingest-limit", type=int, default=2)
+    parser.add_argument("--max-wait", type=float, default=10.0)
+    parser.add_argument("--max-queue", type=int, default=100)
+    parser.add_argument("--user-rate", type=float, default=600.0, help="requests per minute per user")
+    parser.add_argument("--user-burst", type=int, default=20)
+    args = parser.parse_args()
+
+    results = {
+        "admission_off": asyncio.run(burst(args, enabled=False)),
+        "admission_on": asyncio.run(burst(args, enabled=True)),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
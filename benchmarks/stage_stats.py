@@ -0,0 +1,62 @@
+"""
+Summarize the per-stage LLM call log (LOG_DIRECTORY/llm_stages.log) to
+compare model routing configurations offline.
+
+Run the same workload once per LLM_STAGE_MODELS configuration, keep each
+llm_stages.log, then compare them side by side:
+
+    python -m benchmarks.stage_stats baseline=logs-gpt4/llm_stages.log tiered=logs-tiered/llm_stages.log
+
+For every log, stage and model the number of calls, error rate, latency
+percentiles and mean prompt/completion tokens are printed.
+"""
+import argparse
+import json
+from collections import defaultdict
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return round(values[max(int(len(values) * fraction) - 1, 0)], 3) if values else None
+
+
+def summarize(path: str) -> dict:
+    calls = defaultdict(list)
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                stats = json.loads(line)["stats"]
+            except (ValueError, KeyError):
+                continue
+            calls[(stats["stage"], stats["model"])].append(stats)
+
+    summary = {}
+    for (stage, model), entries in sorted(calls.items()):
+        succeeded = [entry for entry in entries if entry["status"] == "success"]
+        latencies = [entry["latency_s"] for entry in succeeded]
+        summary[f"{stage}/{model}"] = {
+            "calls": len(entries),
+            "error_rate": round(1 - len(succeeded) / len(entries), 3),
+            "p50_s": percentile(latencies, 0.5),
+            "p95_s": percentile(latencies, 0.95),
+            "mean_prompt_tokens": round(sum(e["prompt_tokens"] for e in succeeded) / max(len(succeeded), 1), 1),
+            "mean_completion_tokens": round(sum(e["completion_tokens"] for e in succeeded) / max(len(succeeded), 1), 1),
+            "total_tokens": sum(e["prompt_tokens"] + e["completion_tokens"] for e in succeeded),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("logs", nargs="+", help="llm_stages.log files, optionally labelled as name=path")
+    args = parser.parse_args()
+
+    results = {}
+    for log in args.logs:
+        label, _, path = log.rpartition("=")
+        results[label or path] = summarize(path)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
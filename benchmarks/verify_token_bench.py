@@ -0,0 +1,146 @@
+"""
+Token verification throughput benchmark.
+
+Starts a local JWKS stand-in server, signs RS256 tokens with a throwaway key
+and compares VerifyToken (cached JWKS keys, cached payloads) with two
+baselines: PyJWKClient + jwt.decode with the client's own JWK set cache
+(the previous verifier), and the same with that cache off, fetching the
+JWK set on every request. The JWKS fetches of each run are reported.
+
+    python -m benchmarks.verify_token_bench --requests 5000 --distinct-tokens 100
+"""
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+AUDIENCE = "bench-audience"
+KID = "bench-key"
+
+
+class JWKSStandIn:
+    """
+    Serves a JWKS document on 127.0.0.1 and counts fetches
+    """
+
+    def __init__(self, public_jwk: dict):
+        body = json.dumps({"keys": [public_jwk]}).encode("utf-8")
+        stand_in = self
+        self.fetches = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stand_in.fetches += 1
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/.well-known/jwks.json"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+
+
+def make_key():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    public_jwk.update({"kid": KID, "use": "sig", "alg": "RS256"})
+    return private_key, public_jwk
+
+
+def make_tokens(private_key, count: int):
+    now = int(time.time())
+    return [
+        jwt.encode({"sub": f"user-{i}", "aud": AUDIENCE, "iat": now, "exp": now + 3600, "iss": "bench"},
+                   private_key, algorithm="RS256", headers={"kid": KID})
+        for i in range(count)
+    ]
+
+
+def bench_pyjwkclient(jwks_url: str, tokens, requests: int, cache_jwk_set: bool) -> float:
+    """
+    Previous behaviour: PyJWKClient lookup and decode on every request,
+    the JWK set cached by the client for its default lifespan or not at all
+    """
+    client = jwt.PyJWKClient(jwks_url, cache_jwk_set=cache_jwk_set)
+    started = time.perf_counter()
+    for i in range(requests):
+        token = tokens[i % len(tokens)]
+        key = client.get_signing_key_from_jwt(token).key
+        jwt.decode(token, key, algorithms="RS256", audience=AUDIENCE)
+    return requests / (time.perf_counter() - started)
+
+
+async def bench_cached(tokens, requests: int) -> dict:
+    from fastapi.security import HTTPAuthorizationCredentials, SecurityScopes
+    from appfrwk.utils.verify_token import VerifyToken
+
+    verifier = VerifyToken()
+    await verifier.jwks.start()
+    scopes = SecurityScopes()
+    started = time.perf_counter()
+    for i in range(requests):
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=tokens[i % len(tokens)])
+        await verifier(scopes, credentials)
+    elapsed = time.perf_counter() - started
+    await verifier.jwks.stop()
+    return {
+        "ops_per_sec": requests / elapsed,
+        "token_cache_hits": verifier.token_cache.hits,
+        "token_cache_misses": verifier.token_cache.misses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--distinct-tokens", type=int, default=50)
+    args = parser.parse_args()
+
+    private_key, public_jwk = make_key()
+    stand_in = JWKSStandIn(public_jwk)
+    os.environ["AUTH0_JWKS_URL"] = stand_in.url
+    os.environ["AUTH0_API_AUDIENCE"] = AUDIENCE
+    os.environ["AUTH0_ALGORITHMS"] = "RS256"
+    tokens = make_tokens(private_key, args.distinct_tokens)
+
+    fetches = {}
+    try:
+        uncached = bench_pyjwkclient(stand_in.url, tokens, args.requests, cache_jwk_set=False)
+        fetches["uncached"] = stand_in.fetches
+        pyjwkclient = bench_pyjwkclient(stand_in.url, tokens, args.requests, cache_jwk_set=True)
+        fetches["pyjwkclient"] = stand_in.fetches - sum(fetches.values())
+        cached = asyncio.run(bench_cached(tokens, args.requests))
+        fetches["cached"] = stand_in.fetches - sum(fetches.values())
+    finally:
+        stand_in.close()
+
+    print(json.dumps({
+        "requests": args.requests,
+        "distinct_tokens": args.distinct_tokens,
+        "uncached_ops_per_sec": round(uncached, 1),
+        "pyjwkclient_ops_per_sec": round(pyjwkclient, 1),
+        "cached_ops_per_sec": round(cached["ops_per_sec"], 1),
+        "token_cache_hits": cached["token_cache_hits"],
+        "token_cache_misses": cached["token_cache_misses"],
+        "jwks_fetches_uncached_run": fetches["uncached"],
+        "jwks_fetches_pyjwkclient_run": fetches["pyjwkclient"],
+        "jwks_fetches_cached_run": fetches["cached"],
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,141 @@
-from typing import Dict, List
+"""
+Client of the FastAPI backend.
 
-import requests
-from streamlit.runtime.uploaded_file_manager import UploadedFile
+Every call goes through one pooled httpx.Client per Streamlit server
+process (st.cache_resource), so reruns reuse keep-alive connections instead
+of opening new ones. Calls have timeouts, and are retried a bounded number
+of times when the backend is unreachable or overloaded: idempotent calls on
+connection errors, 429 and 502/503/504, other calls only when the request
+was refused before any work was done (429 and 503).
 
-SERVER_URL = "http://fast-api-service:8000/RAG"
+Calls carry the session's access token (entered with ``token_input``, or
+SERVER_ACCESS_TOKEN for every session) as a bearer token, so the backend
+rate limits each user on its own rather than every session of this
+server together.
+"""
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
 
+import httpx
+import streamlit as st
 
-def get_fastapi_status(server_url: str = "http://fast-api-service:8000"):
+BASE_URL = os.getenv("SERVER_BASE_URL", "http://fast-api-service:8000")
+SERVER_URL = f"{BASE_URL}/RAG"
+
+TIMEOUT = httpx.Timeout(float(os.getenv("CLIENT_TIMEOUT", 30)), connect=5.0)
+# Answers and ingestion wait on the LLM providers
+LLM_TIMEOUT = httpx.Timeout(float(os.getenv("CLIENT_LLM_TIMEOUT", 180)), connect=5.0)
+INGESTION_TIMEOUT = httpx.Timeout(float(os.getenv("CLIENT_INGESTION_TIMEOUT", 900)), connect=5.0)
+
+ACCESS_TOKEN = os.getenv("SERVER_ACCESS_TOKEN")
+# Token of the calls made from worker threads, which have no session state
+_access_token: contextvars.ContextVar = contextvars.ContextVar("access_token", default=None)
+
+MAX_RETRIES = 2
+RETRY_STATUS = {429, 502, 503, 504}
+# Refused before the backend did any work (rate limit, admission control)
+REFUSED_STATUS = {429, 503}
+
+
+@st.cache_resource
+def get_http_client() -> httpx.Client:
+    """
+    Shared connection pool; httpx.Client is thread safe
+    """
+    transport = httpx.HTTPTransport(
+        retries=MAX_RETRIES,  # connection attempts only
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60))
+    return httpx.Client(transport=transport, timeout=TIMEOUT)
+
+
+@st.cache_resource
+def get_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="backend")
+
+
+def token_input():
+    """
+    Sidebar field for the access token of the session
+    """
+    st.sidebar.text_input("Access token", type="password", key="access_token",
+                          help="Bearer token sent with every request to the backend")
+
+
+def access_token() -> Optional[str]:
+    token = _access_token.get()
+    if token is None:
+        try:
+            token = st.session_state.get("access_token")
+        except Exception:
+            token = None
+    return token or ACCESS_TOKEN
+
+
+def auth_headers() -> Dict[str, str]:
+    token = access_token()
+    return {"Authorization": f"Bearer {token}"} if token else {}
+
+
+def _retry_delay(response: Optional[httpx.Response], attempt: int) -> float:
+    try:
+        return min(float(response.headers["Retry-After"]), 10.0)
+    except (AttributeError, KeyError, ValueError):
+        return 0.5 * 2 ** attempt
+
+
+def request(method: str, url: str, idempotent: bool = True, client: Optional[httpx.Client] = None,
+            **kwargs) -> httpx.Response:
+    """
+    Send a request on the pooled client with bounded retries
+    """
+    client = client or get_http_client()
+    kwargs["headers"] = {**auth_headers(), **kwargs.get("headers", {})}
+    retry_status = RETRY_STATUS if idempotent else REFUSED_STATUS
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = client.request(method, url, **kwargs)
+        except httpx.TransportError:
+            if not idempotent or attempt == MAX_RETRIES:
+                raise
+            time.sleep(_retry_delay(None, attempt))
+            continue
+        if response.status_code not in retry_status or attempt == MAX_RETRIES:
+            return response
+        time.sleep(_retry_delay(response, attempt))
+    return response
+
+
+def fetch_concurrently(*calls) -> List:
+    """
+    Run independent calls in parallel, e.g.
+    ``conversations, messages = fetch_concurrently((get_conversations, user), (get_messages, conversation))``.
+    Results are returned in order.
+    """
+    # Resolved here: worker threads have no Streamlit script context
+    client = get_http_client()
+    token = access_token()
+
+    def call(function, *args):
+        _access_token.set(token or "")
+        return function(*args, client=client)
+
+    futures = [get_executor().submit(contextvars.copy_context().run, call, *call_args) for call_args in calls]
+    return [future.result() for future in futures]
+
+
+def get_fastapi_status(server_url: str = BASE_URL):
     """Access FastAPI /docs endpoint to check if server is running"""
     try:
-        response = requests.get(f"{server_url}/docs")
+        response = request("GET", f"{server_url}/docs")
         if response.status_code == 200:
             return True
-    except requests.exceptions.RequestException:
+    except httpx.HTTPError:
         return False
 
 
-# Assuming SERVER_URL is defined elsewhere in your code.
-
-
 def post_store_arxiv(arxiv_ids: str, server_url: str = SERVER_URL, max_iteration: int = 5):
     try:
         pdf_url = arxiv_ids[0]
@@ -31,57 +148,84 @@ def post_store_arxiv(arxiv_ids: str, server_url: str = SERVER_URL, max_iteration
         # Construct the endpoint URL (without query parameters)
         full_url = f"{server_url}/add-documents-internet"
         # Make the POST request with JSON data
-        response = requests.post(full_url, json=data)
+        response = request("POST", full_url, idempotent=False, json=data, timeout=INGESTION_TIMEOUT)
         response.raise_for_status()  # This will raise an exception for HTTP error responses
         return response.json()
-    except requests.exceptions.RequestException as err:
+    except httpx.HTTPError as err:
         # Handle request errors (e.g., network issues, server not responding)
         return {"response": "Error", "detail": str(err)}
 
 
 def post_store_pdfs(pdf_file) -> Dict:
     """Send POST request to FastAPI /store_pdfs endpoint"""
-    files = {'pdf_file': (pdf_file.name, pdf_file, 'application/pdf')}
+    # Bytes rather than the file object, so a refused upload can be sent again
+    files = {'pdf_file': (pdf_file.name, pdf_file.getvalue(), 'application/pdf')}
     data = {'max_iteration': 5}  # Example, adjust as needed
-    response = requests.post(f"{SERVER_URL}/add-documents-upload", files=files, data=data)
+    response = request("POST", f"{SERVER_URL}/add-documents-upload", idempotent=False, files=files,
+                       data=data, timeout=INGESTION_TIMEOUT)
     response.raise_for_status()
     return response.json()
 
 
 def get_rag_summary(
         rag_query: str,
-
-
+        client: Optional[httpx.Client] = None,
 ):
-    """Send GET request to FastAPI /rag_summary endpoint"""
+    """Send POST request to FastAPI /rag_chain_with_source endpoint"""
     payload = {
-   "question": rag_query
+        "question": rag_query
     }
-    response = requests.post(f"{SERVER_URL}/rag_chain_with_source", json=payload)
+    # Read only, safe to retry
+    response = request("POST", f"{SERVER_URL}/rag_chain_with_source/", json=payload, timeout=LLM_TIMEOUT,
+                       client=client)
     response.raise_for_status()
     return response
 
 
-def send_message(conversation_id: str, message: str) -> Dict:
+def send_message(conversation_id: str, message: str, client: Optional[httpx.Client] = None) -> Dict:
     try:
         payload = {"conversation_id": conversation_id, "message": message}
-        response = requests.post(f"{SERVER_URL}/rag_chain_chat", json=payload)
+        response = request("POST", f"{SERVER_URL}/rag_chain_chat/", idempotent=False, json=payload,
+                           timeout=LLM_TIMEOUT, client=client)
         response.raise_for_status()
         return response.json()
-    except requests.exceptions.RequestException as err:
+    except httpx.HTTPError:
         return {"response": "Error"}
 
 
+def stream_message(conversation_id: str, message: str) -> Iterator[str]:
+    """
+    Send a chat message and yield the answer text as it is generated,
+    e.g. ``st.write_stream(stream_message(conversation_id, message))``
+    """
+    payload = {"conversation_id": conversation_id, "message": message}
+    url = f"{SERVER_URL}/rag_chain_chat/stream"
+    try:
+        for attempt in range(MAX_RETRIES + 1):
+            with get_http_client().stream("POST", url, json=payload, headers=auth_headers(),
+                                          timeout=LLM_TIMEOUT) as response:
+                if response.status_code in REFUSED_STATUS and attempt < MAX_RETRIES:
+                    time.sleep(_retry_delay(response, attempt))
+                    continue
+                if response.status_code != 200:
+                    response.read()
+                    yield f"Error {response.status_code}: {response.text}"
+                    return
+                yield from response.iter_text()
+                return
+    except httpx.HTTPError as err:
+        yield f"\n\nError: {err}"
+
+
 def get_all_documents_file_name():
     """Send GET request to FastAPI /documents endpoint"""
-    response = requests.get(f"{SERVER_URL}/documents")
+    response = request("GET", f"{SERVER_URL}/documents")
     return response
 
 
-def get_conversations(user_id: str) -> List[str]:
+def get_conversations(user_id: str, client: Optional[httpx.Client] = None) -> List[str]:
     try:
-        response = requests.get(
-            f"{SERVER_URL}/user-conversations", params={"user_sub": user_id})
+        response = request("GET", f"{SERVER_URL}/user-conversations", params={"user_sub": user_id}, client=client)
         response.raise_for_status()
 
         # Parse JSON response and extract only the conversation IDs
@@ -89,26 +233,28 @@ def get_conversations(user_id: str) -> List[str]:
         conversation_ids = [conversation['id'] for conversation in conversations_data]
 
         return conversation_ids
-    except requests.exceptions.RequestException as err:
+    except httpx.HTTPError:
         return []
 
 
-def create_conversation(user_sub: str) -> str:
-    new_conversation = requests.post(
-        f"{SERVER_URL}/create-conversation",
-        json={
-            "user_sub": user_sub
-        }
-    ).json()
+def create_conversation(user_sub: str, client: Optional[httpx.Client] = None) -> str:
+    new_conversation = request("POST", f"{SERVER_URL}/create-conversation", idempotent=False,
+                               json={"user_sub": user_sub}, client=client).json()
     return new_conversation['id']
 
 
-def get_messages(conversation_id: str) -> List[Dict]:
+def get_messages(conversation_id: str, after: Optional[str] = None,
+                 client: Optional[httpx.Client] = None) -> List[Dict]:
+    """
+    Messages of a conversation, only those created after the ``after`` cursor when given
+    """
+    params = {"conversation_id": conversation_id}
+    if after:
+        params["after"] = after
     try:
-        response = requests.get(
-            f"{SERVER_URL}/get-conversation-messages", params={"conversation_id": conversation_id})
+        response = request("GET", f"{SERVER_URL}/get-conversation-messages", params=params, client=client)
 
         response.raise_for_status()
         return response.json()
-    except requests.exceptions.RequestException as err:
+    except httpx.HTTPError:
         return []
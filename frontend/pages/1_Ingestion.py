@@ -89,6 +89,7 @@ def app() -> None:
         layout="centered",
         menu_items={"Get help": None, "Report a bug": None},
     )
+    client.token_input()
 
 
     st.title("📥 Ingestion")
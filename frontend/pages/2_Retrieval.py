@@ -1,6 +1,12 @@
+import time
+
 import client
 import streamlit as st
 
+# Seconds before cached data is fetched again; messages are fetched incrementally
+CONVERSATIONS_TTL = 60
+MESSAGES_TTL = 15
+
 
 # def show_pdf(base64_pdf: str) -> str:
 #     """Show a base64 encoded PDF in the browser using an HTML tag"""
@@ -51,64 +57,106 @@ def history_display_container(history):
     st.write(entry["response"])
 
 
+def is_fresh(key, ttl: float) -> bool:
+    fetched_at = st.session_state['fetched_at'].get(key)
+    return fetched_at is not None and time.monotonic() - fetched_at < ttl
+
+
+def mark_fetched(key):
+    st.session_state['fetched_at'][key] = time.monotonic()
+
+
+def last_seen(messages) -> str:
+    """created_at of the newest stored message, the cursor for the next fetch"""
+    return max((message["created_at"] for message in messages if message.get("created_at")), default=None)
+
+
+def merge_messages(cached, new):
+    """Append newly fetched messages, they replace the turns added locally"""
+    return [message for message in cached if not message.get("local")] + new
+
+
 def app() -> None:
     st.set_page_config(page_title="Chat Interface", page_icon="🗨️", layout="centered")
     st.title("🗨️ Chat Interface")
+    client.token_input()
 
     user_sub = st.text_input("Enter your User ID:")
     if 'new_conversation_id' not in st.session_state:
         st.session_state['new_conversation_id'] = None
     if 'selected_conversation_id' not in st.session_state:
         st.session_state['selected_conversation_id'] = None
-    # Initialize session state for conversations
+    # Initialize session state for conversations, conversation id -> cached messages
     if 'conversations' not in st.session_state:
         st.session_state['conversations'] = {}
+    if 'fetched_at' not in st.session_state:
+        st.session_state['fetched_at'] = {}
+    conversations = st.session_state['conversations']
 
     if user_sub:
         if st.button("Start New Conversation"):
             new_conversation_id = client.create_conversation(user_sub)
-            st.session_state['conversations'][new_conversation_id] = []
+            conversations[new_conversation_id] = []
+            mark_fetched(('messages', new_conversation_id))
             st.session_state['selected_conversation_id'] = new_conversation_id
 
-        # Fetch conversations for the user
-        conversation_ids = client.get_conversations(user_sub)
-        for conversation_id in conversation_ids:
-            if conversation_id not in st.session_state['conversations']:
-                st.session_state['conversations'][conversation_id] = []
+        # Refresh what is stale: the conversation list, and the new messages of the
+        # conversation selected last run, concurrently
+        previous_conversation_id = st.session_state['selected_conversation_id']
+        calls = {}
+        if not is_fresh(('conversations', user_sub), CONVERSATIONS_TTL):
+            calls['conversations'] = (client.get_conversations, user_sub)
+        if previous_conversation_id and not is_fresh(('messages', previous_conversation_id), MESSAGES_TTL):
+            calls['messages'] = (client.get_messages, previous_conversation_id,
+                                 last_seen(conversations.get(previous_conversation_id, [])))
+        results = dict(zip(calls, client.fetch_concurrently(*calls.values()))) if calls else {}
+        if 'conversations' in results:
+            for conversation_id in results['conversations']:
+                conversations.setdefault(conversation_id, [])
+            mark_fetched(('conversations', user_sub))
+        if 'messages' in results:
+            conversations[previous_conversation_id] = merge_messages(
+                conversations.get(previous_conversation_id, []), results['messages'])
+            mark_fetched(('messages', previous_conversation_id))
 
         # Use session_state to pre-select the conversation
         selected_conversation_id = st.selectbox(
-            "Select a Conversation", options=list(st.session_state['conversations'].keys()),
-            index=list(st.session_state['conversations'].keys()).index(st.session_state['selected_conversation_id']) if st.session_state['selected_conversation_id'] in st.session_state['conversations'] else 0
+            "Select a Conversation", options=list(conversations.keys()),
+            index=list(conversations.keys()).index(st.session_state['selected_conversation_id']) if st.session_state['selected_conversation_id'] in conversations else 0
         )
         st.session_state['selected_conversation_id'] = selected_conversation_id
 
         if selected_conversation_id:
-            # Fetch messages for the selected conversation
-            messages = client.get_messages(selected_conversation_id)
-            st.session_state['conversations'][selected_conversation_id] = messages
+            # A newly selected conversation was not refreshed above
+            if not is_fresh(('messages', selected_conversation_id), MESSAGES_TTL):
+                cached = conversations.get(selected_conversation_id, [])
+                conversations[selected_conversation_id] = merge_messages(
+                    cached, client.get_messages(selected_conversation_id, last_seen(cached)))
+                mark_fetched(('messages', selected_conversation_id))
 
             # Display conversation history
-            if st.session_state['conversations'][selected_conversation_id]:
+            if conversations[selected_conversation_id]:
                 st.write("Conversation History:")
-                for message in st.session_state['conversations'][selected_conversation_id]:
+                for message in conversations[selected_conversation_id]:
                     with st.chat_message("user"):
                         st.write(message["user_message"])
                     with st.chat_message("assistant"):
                         st.write(message["agent_message"])
 
             # Form for sending a new message
-            with st.form(key='message_form'):
+            with st.form(key='message_form', clear_on_submit=True):
                 message_input = st.text_input("Enter your message here:")
                 send_message = st.form_submit_button("Send Message")
 
                 if send_message and message_input:
-                    if send_message and message_input:
-                        with st.spinner("Thinking..."):
-                            response = client.send_message(selected_conversation_id, message_input)
-                            with st.chat_message("assistant"):
-                                st.write(response)
-                        st.rerun()
+                    with st.chat_message("user"):
+                        st.write(message_input)
+                    with st.chat_message("assistant"):
+                        # Tokens render as they arrive
+                        answer = st.write_stream(client.stream_message(selected_conversation_id, message_input))
+                    # Kept locally until the stored turn comes back with the next incremental fetch
+                    conversations[selected_conversation_id].append(
+                        {"user_message": message_input, "agent_message": answer, "local": True})
 
 if __name__ == "__main__":
     app()
\ No newline at end of file
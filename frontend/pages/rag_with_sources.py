@@ -55,6 +55,7 @@ def app() -> None:
         layout="centered",
         menu_items={"Get help": None, "Report a bug": None},
     )
+    client.token_input()
 
     st.title("📤 RAG with sources")
 